@@ -1,7 +1,115 @@
-from langchain_ollama import ChatOllama
+import os
+import json
+import time
+import asyncio
+import threading
+from typing import Any, Dict, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import PrivateAttr
+
+# 设置后所有 get_llm() 返回本地桩模型（值为每次调用的模拟延迟秒数），用于无 Ollama 的压测/联调
+STUB_LLM_ENV = "QA_AGENT_STUB_LLM"
+# （可选）桩模型的脚本文件：{"rules": [{"pattern", "response", "scope"}], "responses": [...]}
+STUB_SCRIPT_ENV = "QA_AGENT_STUB_SCRIPT"
+
+
+class StubChatModel(BaseChatModel):
+    """
+    本地脚本化桩 LLM，每次调用前 sleep delay 秒（异步调用不占线程）。
+    - rules：按顺序匹配，pattern 出现在最后一条消息（scope="last"）或整段提示（scope="all"）中时返回 response
+    - responses：没有规则命中时按顺序循环返回
+    - calls：累计调用次数，压测时用来统计每个操作的 LLM 调用数
+    - 与 ChatOllama 一样在生成过程中逐块触发 on_llm_new_token（每块 chunk_chars 个字符，
+      delay 平均分摊到各块），用来测首 token 时延
+    """
+
+    delay: float = 0.0
+    rules: List[Dict[str, str]] = []
+    responses: List[str] = ["Final Answer: 您好，已收到您的问题（stub）。"]
+    chunk_chars: int = 4
+    _i: int = PrivateAttr(default=0)
+    _calls: int = PrivateAttr(default=0)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    @property
+    def calls(self) -> int:
+        return self._calls
+
+    def reset_calls(self) -> None:
+        with self._lock:
+            self._calls = 0
+
+    def _pick(self, messages: List[BaseMessage]) -> str:
+        last = str(messages[-1].content) if messages else ""
+        full = "\n".join(str(m.content) for m in messages)
+        for rule in self.rules:
+            target = full if rule.get("scope") == "all" else last
+            if rule["pattern"] in target:
+                return rule["response"]
+        with self._lock:
+            text = self.responses[self._i % len(self.responses)]
+            self._i += 1
+        return text
+
+    def _next(self, messages: List[BaseMessage]) -> str:
+        with self._lock:
+            self._calls += 1
+        return self._pick(messages)
+
+    def _chunks(self, text: str) -> List[str]:
+        n = max(1, self.chunk_chars)
+        return [text[i:i + n] for i in range(0, len(text), n)] or [""]
+
+    @staticmethod
+    def _result(text: str) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        text = self._next(messages)
+        chunks = self._chunks(text)
+        for piece in chunks:
+            if self.delay:
+                time.sleep(self.delay / len(chunks))
+            if run_manager:
+                run_manager.on_llm_new_token(piece)
+        return self._result(text)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        text = self._next(messages)
+        chunks = self._chunks(text)
+        for piece in chunks:
+            if self.delay:
+                await asyncio.sleep(self.delay / len(chunks))
+            if run_manager:
+                await run_manager.on_llm_new_token(piece)
+        return self._result(text)
+
+
+def stub_enabled() -> bool:
+    return bool(os.getenv(STUB_LLM_ENV))
+
+
+def get_stub_llm() -> StubChatModel:
+    script: Dict[str, Any] = {}
+    if os.getenv(STUB_SCRIPT_ENV):
+        with open(os.environ[STUB_SCRIPT_ENV], "r", encoding="utf-8") as f:
+            script = json.load(f)
+    return StubChatModel(delay=float(os.getenv(STUB_LLM_ENV) or 0), **script)
+
 
 def get_llm(model="llama3.1", temperature=0):
+    if stub_enabled():
+        return get_stub_llm()
+    from langchain_ollama import ChatOllama
     return ChatOllama(
         model=model,
         temperature=temperature
-    )
\ No newline at end of file
+    )
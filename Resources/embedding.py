@@ -3,24 +3,61 @@
 从两个 JSONL（utterances / flows 的分块结果）构建 bge-m3 + FAISS 向量库。
 - 优先从本地路径加载 bge-m3 模型（减少重复下载）
 - 读取 JSONL（每行必须包含: text, metadata）
-- 用 bge-m3 计算向量，并做 L2 归一化
-- 建立 IndexFlatIP（内积）索引并落盘
-- 写出 meta.jsonl（与索引向量顺序严格对齐）
+- 用 bge-m3 计算向量，并做 L2 归一化（经 embed_cache 缓存，只为新增/修改的 chunk 计算）
+- 建立内积索引并落盘（向量 id 由 chunk id 派生）：flat / ivf_flat / ivf_pq / hnsw，见根目录 ann_index.py
+- 已有索引时按 chunk id 增量同步：只删除消失的向量、只添加新增的 chunk（索引类型变化或 HNSW 需要删除时全量重建）
+- 可选压缩存储（--storage fp16/int8/pq）与精确重排（--rerank，查询时由 utils.load_vectorstore 执行）
+- --bench：以 flat 为真值，报告各索引类型/参数/存储方式下的 recall@k、查询延迟与内存节省；配合 --index 按 --target-recall 自动选参
+- 选定的索引配置写入 faiss_store/index_spec.json，utils.load_vectorstore 构建/加载时读取同一份配置
+- 写出 meta.jsonl（每行带 faiss_id，与索引中的向量一一对应）
 - 提供一个检索 demo
 
 依赖:
 pip install sentence-transformers faiss-cpu tqdm ujson huggingface_hub
+
+用法（在仓库根目录）：
+    python Resources/embedding.py                                   # 沿用 index_spec.json（默认 flat）
+    python Resources/embedding.py --index hnsw --ef-search 128
+    python Resources/embedding.py --bench --index ivf_flat --target-recall 0.95
+    python Resources/embedding.py --storage int8 --rerank 4
 """
 
+import argparse
+import hashlib
 import os
+import sys
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 import ujson as json
 from tqdm import tqdm
 import numpy as np
 import faiss
 from sentence_transformers import SentenceTransformer
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))  # 复用仓库根目录的 embed_cache
+from embed_cache import EmbeddingCache
+from ann_index import (
+    INDEX_TYPES,
+    SPEC_FILE,
+    STORAGE_TYPES,
+    IndexSpec,
+    benchmark,
+    create_index,
+    default_grid,
+    format_table,
+    index_kind,
+    index_storage,
+    load_spec,
+    resolve_spec,
+    save_spec,
+    select,
+    set_search_params,
+    spec_of,
+    supports_remove,
+    train,
+    with_ids,
+)
+
 # =========================
 # 配置
 # =========================
@@ -33,6 +70,8 @@ LOCAL_MODEL_DIR = r"D:\huggingface/models/bge-m3"  # 本地 bge-m3 模型目录
 HF_MODEL_ID = "BAAI/bge-m3"  # 如果本地不存在则从 Hugging Face 下载
 BATCH_SIZE = 64
 TOP_K = 5
+NORMALIZE = True
+EMBED_CACHE_DIR = os.path.join(OUT_DIR, "embed_cache")  # 与 utils.load_vectorstore 共用
 TEXT_FIELD = "text"
 META_FIELD = "metadata"
 
@@ -67,23 +106,106 @@ def load_jsonl(path: str, namespace: str) -> List[Dict[str, Any]]:
 
 
 def embed_chunks(chunks: List[Dict[str, Any]], model_path: str, batch_size: int) -> np.ndarray:
-    model = SentenceTransformer(model_path)
+    cache = EmbeddingCache(model_path, NORMALIZE, Path(EMBED_CACHE_DIR))
+    model = None
+
+    def encode(texts: List[str]) -> np.ndarray:
+        nonlocal model
+        if model is None:  # 全部命中缓存时不必加载模型
+            model = SentenceTransformer(model_path)
+        return model.encode(texts, batch_size=batch_size, normalize_embeddings=NORMALIZE, show_progress_bar=True)
+
     texts = [c[TEXT_FIELD] for c in chunks]
-    vecs = model.encode(texts, batch_size=batch_size, normalize_embeddings=True, show_progress_bar=True)
-    return np.asarray(vecs, dtype="float32")
+    vecs = cache.get_or_compute(texts, encode)
+    print(f"✅ 向量缓存：命中 {cache.hits}，新计算 {cache.misses}")
+    return vecs
 
 
-def build_faiss(embeddings: np.ndarray) -> faiss.Index:
+def to_faiss_id(chunk_id: str) -> int:
+    """chunk id（字符串）→ FAISS 的 int64 向量 id（取 sha256 前 60 位，保证为正）。"""
+    return int(hashlib.sha256(chunk_id.encode("utf-8")).hexdigest()[:15], 16)
+
+
+def build_faiss(embeddings: np.ndarray, ids: np.ndarray, spec: IndexSpec) -> faiss.Index:
+    """spec 需已 resolve；IVF / PQ 先用全部向量训练。"""
     d = embeddings.shape[1]
-    index = faiss.IndexFlatIP(d)
-    index.add(embeddings)
+    base = create_index(spec, d)
+    train(base, embeddings)
+    index = with_ids(base)
+    index.add_with_ids(embeddings, ids)
+    set_search_params(index, spec)
     return index
 
 
+def _has_ids(index: faiss.Index) -> bool:
+    return hasattr(index, "id_map") or isinstance(faiss.downcast_index(index), faiss.IndexIVF)
+
+
+def sync_faiss(
+    chunks: List[Dict[str, Any]],
+    index_path: str,
+    meta_path: str,
+    model_path: str,
+    batch_size: int,
+    spec: IndexSpec,
+) -> Tuple[faiss.Index, IndexSpec]:
+    """
+    与已落盘的索引按 chunk id 做 diff：删除旧向量、只嵌入新增 chunk。
+    没有可增量的索引（首次构建 / 旧版无 id 映射的索引 / 索引类型变化 / HNSW 需要删除）时全量构建。
+    返回 (索引, 实际使用的 spec)。
+    """
+    new_ids = {to_faiss_id(c["id"]): c for c in chunks}
+    if len(new_ids) != len(chunks):
+        raise ValueError("chunk id 存在重复，请重新运行分块脚本生成 JSONL。")
+
+    index = None
+    if os.path.exists(index_path) and os.path.exists(meta_path):
+        index = faiss.read_index(index_path)
+        resolved = resolve_spec(spec, len(chunks), index.d)
+        if not _has_ids(index):
+            print("⚠️ 现有索引不含 id 映射，改为全量构建")
+            index = None
+        elif (index_kind(index), index_storage(index)) != (resolved.kind, resolved.storage):
+            print(f"⚠️ 现有索引为 {spec_of(index, resolved).describe()}，配置为 {resolved.describe()}，改为全量构建")
+            index = None
+
+    old_ids = set()
+    if index is not None:
+        old_ids = {m["faiss_id"] for m in load_sidecar_meta(meta_path) if "faiss_id" in m}
+    removed = [i for i in old_ids if i not in new_ids]
+    if removed and index is not None and not supports_remove(resolved.kind):
+        print(f"⚠️ {resolved.kind} 不支持删除向量，改为全量构建")
+        index = None
+
+    if index is None:
+        embeddings = embed_chunks(chunks, model_path, batch_size)
+        print(f"✅ 嵌入完成：shape={embeddings.shape}")
+        resolved = resolve_spec(spec, len(chunks), embeddings.shape[1])
+        print(f"✅ 索引类型：{resolved.describe()}")
+        return build_faiss(embeddings, np.fromiter(new_ids.keys(), dtype="int64"), resolved), resolved
+
+    # 沿用现有索引结构，查询参数（nprobe / efSearch）以当前配置为准
+    resolved = spec_of(index, spec)
+    set_search_params(index, resolved)
+    added = [i for i in new_ids if i not in old_ids]
+    if removed:
+        index.remove_ids(np.asarray(removed, dtype="int64"))
+    if added:
+        embeddings = embed_chunks([new_ids[i] for i in added], model_path, batch_size)
+        index.add_with_ids(embeddings, np.asarray(added, dtype="int64"))
+    print(f"✅ 增量同步：新增 {len(added)}，删除 {len(removed)}，当前 {index.ntotal} 条")
+    return index, resolved
+
+
 def save_sidecar_meta(chunks: List[Dict[str, Any]], out_path: str):
     with open(out_path, "w", encoding="utf-8") as f:
         for c in chunks:
-            out = {"id": c.get("id"), "text": c.get(TEXT_FIELD, ""), "metadata": c.get(META_FIELD, {})}
+            out = {
+                "id": c.get("id"),
+                "faiss_id": to_faiss_id(c["id"]),
+                "text": c.get(TEXT_FIELD, ""),
+                "metadata": c.get(META_FIELD, {}),
+            }
             f.write(json.dumps(out, ensure_ascii=False) + "\n")
 
 
@@ -91,15 +213,21 @@ def load_sidecar_meta(path: str) -> List[Dict[str, Any]]:
     return [json.loads(line) for line in open(path, "r", encoding="utf-8")]
 
 
+def meta_by_faiss_id(meta: List[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+    """search() 返回的是 faiss_id 而不是行号，用它回查元数据。"""
+    return {m["faiss_id"]: m for m in meta if "faiss_id" in m}
+
+
 # def demo_search(query: str, index: faiss.Index, meta: List[Dict[str, Any]], model_path: str, top_k: int):
 #     model = SentenceTransformer(model_path)
 #     q = model.encode([query], normalize_embeddings=True)
 #     scores, ids = index.search(np.asarray(q, dtype="float32"), top_k)
+#     by_id = meta_by_faiss_id(meta)
 #     print(f"\n🔎 Query: {query}")
 #     for rank, (i, s) in enumerate(zip(ids[0], scores[0]), start=1):
 #         if i == -1:
 #             continue
-#         item = meta[i]
+#         item = by_id[i]
 #         ns = item["metadata"].get("namespace")
 #         sec = item["metadata"].get("section_path", "")
 #         src = item["metadata"].get("source", "")
@@ -108,10 +236,66 @@ def load_sidecar_meta(path: str) -> List[Dict[str, Any]]:
 #         print(f"    {preview}{'...' if len(item['text'])>200 else ''}")
 
 
+def bench_queries(vecs: np.ndarray, n: int, noise: float, seed: int = 0) -> np.ndarray:
+    """从语料向量中抽样并加少量高斯噪声作为查询（模拟与已有 chunk 相近但不相同的问题）。"""
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vecs), size=min(n, len(vecs)), replace=False)
+    q = vecs[picks] + noise * rng.standard_normal((len(picks), vecs.shape[1])).astype("float32")
+    faiss.normalize_L2(q)
+    return q
+
+
+def run_ann_bench(vecs: np.ndarray, args) -> List[Dict[str, Any]]:
+    queries = bench_queries(vecs, args.bench_queries, args.bench_noise)
+    rows = benchmark(vecs, queries, default_grid(len(vecs), vecs.shape[1]), k=args.k)
+    print(f"\n—— ANN 基准：{len(vecs)} 条向量，{len(queries)} 条查询，recall@{args.k} 以 flat 为真值 ——")
+    print(format_table(rows))
+    out = os.path.join(OUT_DIR, "ann_bench.json")
+    with open(out, "w", encoding="utf-8") as f:
+        f.write(json.dumps(rows, ensure_ascii=False, indent=2))
+    print(f"✅ 基准结果：{out}")
+    return rows
+
+
+def spec_from_args(args) -> IndexSpec:
+    """命令行未指定 --index / --storage 时沿用 index_spec.json；指定时以命令行为准。"""
+    if args.index is None and args.storage is None:
+        return load_spec(Path(OUT_DIR) / SPEC_FILE)
+    return IndexSpec(
+        kind=args.index or "flat",
+        nlist=args.nlist,
+        nprobe=args.nprobe,
+        pq_m=args.pq_m,
+        hnsw_m=args.hnsw_m,
+        ef_search=args.ef_search,
+        storage=args.storage,
+        rerank=args.rerank,
+    )
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="构建 bge-m3 + FAISS 向量库")
+    ap.add_argument("--index", choices=INDEX_TYPES, default=None, help="索引类型（默认沿用 index_spec.json）")
+    ap.add_argument("--nlist", type=int, default=None, help="IVF 倒排桶数（默认约 4·sqrt(N)）")
+    ap.add_argument("--nprobe", type=int, default=None, help="IVF 查询探查桶数")
+    ap.add_argument("--pq-m", type=int, default=None, help="PQ 子向量个数（需整除维度）")
+    ap.add_argument("--hnsw-m", type=int, default=None, help="HNSW 邻居数")
+    ap.add_argument("--ef-search", type=int, default=None, help="HNSW 查询时的候选队列长度")
+    ap.add_argument("--storage", choices=STORAGE_TYPES, default=None, help="压缩存储（仅 flat / ivf_flat）")
+    ap.add_argument("--rerank", type=int, default=None, help="候选放大倍数，>1 时用 float32 原始向量精确重排")
+    ap.add_argument("--bench", action="store_true", help="跑各索引类型/参数的 recall 与延迟基准")
+    ap.add_argument("--bench-queries", type=int, default=200)
+    ap.add_argument("--bench-noise", type=float, default=0.02, help="基准查询相对语料向量的扰动幅度")
+    ap.add_argument("-k", type=int, default=10, help="recall@k")
+    ap.add_argument("--target-recall", type=float, default=0.95, help="--bench 配合 --index 时自动选参的召回目标")
+    return ap.parse_args()
+
+
 # =========================
 # 主流程
 # =========================
 def main():
+    args = parse_args()
     os.makedirs(OUT_DIR, exist_ok=True)
 
     all_chunks = []
@@ -129,15 +313,28 @@ def main():
 
     model_path = get_model_path(LOCAL_MODEL_DIR, HF_MODEL_ID)
 
-    embeddings = embed_chunks(all_chunks, model_path, BATCH_SIZE)
-    print(f"✅ 嵌入完成：shape={embeddings.shape}")
+    spec = spec_from_args(args)
+    if args.bench:
+        rows = run_ann_bench(embed_chunks(all_chunks, model_path, BATCH_SIZE), args)
+        if args.index is not None or args.storage is not None:
+            chosen = select(rows, spec.kind, args.target_recall, storage=spec.storage)
+            if chosen is None:
+                print(f"⚠️ 基准中没有可用的 {spec.describe()} 组合（语料规模不足），沿用该配置")
+            else:
+                spec = chosen
+                print(f"✅ 按 recall ≥ {args.target_recall} 选定：{spec.describe()}")
 
-    index = build_faiss(embeddings)
     faiss_path = os.path.join(OUT_DIR, "index.faiss")
+    meta_path = os.path.join(OUT_DIR, "meta.jsonl")
+    index, resolved = sync_faiss(all_chunks, faiss_path, meta_path, model_path, BATCH_SIZE, spec)
     faiss.write_index(index, faiss_path)
-    print(f"✅ FAISS 已保存：{faiss_path}")
+    print(f"✅ FAISS 已保存：{faiss_path}（{resolved.describe()}）")
 
-    meta_path = os.path.join(OUT_DIR, "meta.jsonl")
+    # 记录的是请求的配置：语料增长后降级的索引类型可以自动升回来
+    save_spec(spec, Path(OUT_DIR) / SPEC_FILE)
+    print(f"✅ 索引配置已保存：{os.path.join(OUT_DIR, SPEC_FILE)}")
+
+    # meta 最后写：sync 中途失败时旧 meta 仍与旧索引一致
     save_sidecar_meta(all_chunks, meta_path)
     print(f"✅ 元数据已保存：{meta_path}")
 
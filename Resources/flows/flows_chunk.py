@@ -1,4 +1,5 @@
 import json
+import re
 import uuid
 from pathlib import Path
 from typing import List
@@ -16,6 +17,10 @@ HEADERS = [("#","h1"),("##","h2"),("###","h3")]
 CHUNK_SIZE = 1200
 CHUNK_OVERLAP = 120
 SEPARATORS = ["\n```", "```", "\n\n", "\n", "。", "！", "？", ".", "!", "?", "；", ";", "，", ",", " ", ""]
+# 稳定 chunk id 的命名空间（勿修改，否则所有 id 都会变化并触发全量重建）
+CHUNK_ID_NAMESPACE = uuid.UUID("6f1c5b0e-2a4d-5e8f-9b3c-7d1e0a2f4c68")
+# h3 标题中的场景 id，如“1.1 查询订单状态（id: `orders.status_query`）”；与另一份文档按此 id 对齐
+SCENARIO_ID_RE = re.compile(r"id:\s*`([a-z_]+\.[a-z_]+)`")
 USE_TOKEN_LENGTH = False            # 如用 OpenAI/Claude 再改 True（需要 tiktoken）
 
 # 分隔符由“粗到细”，递归回退，尽量不破坏语义边界
@@ -68,16 +73,31 @@ def build_markdown_chunks(
             h3 = p.metadata.get("h3", "")
             p.metadata["section_path"] = " > ".join([x for x in (h1, h2, h3) if x])
             p.metadata["source"] = source_name
+            m = SCENARIO_ID_RE.search(h3)
+            if m:
+                p.metadata["scenario_id"] = m.group(1)
             chunks.append(p)
     return chunks
 
 
+def stable_chunk_id(source: str, section_path: str, text: str, occurrence: int = 0) -> str:
+    """由 来源文件 + section_path + 内容 派生确定性 id；内容不变则 id 不变。"""
+    key = f"{source}\n{section_path}\n{text}"
+    if occurrence:
+        key += f"\n#{occurrence}"  # 同一小节内完全相同的文本块
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, key))
+
+
 def export_jsonl(chunks, out_path: Path):
     out_path.parent.mkdir(parents=True, exist_ok=True)
+    seen = {}
     with out_path.open("w", encoding="utf-8") as f:
         for d in chunks:
+            key = (d.metadata.get("source", ""), d.metadata.get("section_path", ""), d.page_content)
+            occurrence = seen.get(key, 0)
+            seen[key] = occurrence + 1
             rec = {
-                "id": str(uuid.uuid4()),
+                "id": stable_chunk_id(*key, occurrence=occurrence),
                 "text": d.page_content,
                 "metadata": d.metadata,
             }
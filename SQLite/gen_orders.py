@@ -0,0 +1,169 @@
+"""
+可扩展的伪造订单生成器：为 tools/dbtools.py 的压测准备百万级数据。
+- 客户分布有偏：按 Zipf 选择下单客户（少数老客户贡献大量订单），部分客户共用手机号/邮箱（家庭/代下单）
+- 下单时间偏向近期：大部分订单集中在最近几周，其余均匀分布在整个区间
+- 订单状态随订单“年龄”变化：新订单多为待支付/待发货，老订单多为已签收/退款
+- 批量 executemany + 大事务写入，写完再建索引（tools/db_migrations.py），最后 ANALYZE
+- 固定 --seed 可复现
+
+用法（在仓库根目录）：
+    python SQLite/gen_orders.py --rows 1000000 --db SQLite/orders_bench.db --seed 42
+"""
+
+import argparse
+import datetime
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))  # 复用仓库根目录的 tools.db_migrations
+from tools.db_migrations import migrate
+
+SCHEMA_SQL = "SQLite/init_orders.sql"
+
+SURNAMES = "张李王赵孙周吴郑钱刘陈杨黄高林何马罗唐冯许韩曹邓彭曾肖田董袁潘蒋蔡余杜叶程苏魏吕丁任沈姚卢"
+GIVEN = "伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华玉兰萍红鹏辉建国文斌宇浩凯"
+DOMAINS = ["@example.com", "@mail.com", "@test.cn", "@qq.com", "@163.com"]
+CITIES = [("北京市", ["朝阳区", "海淀区", "东城区"]), ("上海市", ["浦东新区", "徐汇区", "静安区"]),
+          ("广州市", ["天河区", "越秀区"]), ("深圳市", ["南山区", "福田区"]), ("杭州市", ["西湖区", "滨江区"]),
+          ("成都市", ["武侯区", "锦江区"]), ("武汉市", ["洪山区", "江汉区"])]
+ITEMS = [
+    "蓝牙耳机x1, 保护壳x1", "机械键盘x1, 鼠标垫x1", "27寸显示器x1", "游戏手柄x2", "笔记本支架x1, 散热器x1",
+    "智能手表x1", "U盘64Gx3", "路由器x1, 网线x2", "无线鼠标x1, 键盘x1", "平板电脑x1, 保护套x1",
+]
+# 订单年龄（天）上限 → 状态权重
+STATUS_BY_AGE = [
+    (1, [("待支付", 30), ("已支付待发货", 50), ("已发货", 20)]),
+    (7, [("已支付待发货", 15), ("已发货", 60), ("已签收", 25)]),
+    (None, [("已签收", 85), ("已发货", 5), ("退款中", 3), ("已退款", 7)]),
+]
+
+INSERT_SQL = """
+    INSERT INTO orders (order_id,user_id,user_name,email,phone,status,tracking_no,item_summary,total_amount,created_at,address)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def make_customers(rng: random.Random, n: int, shared_ratio: float):
+    customers = []
+    for i in range(n):
+        name = rng.choice(SURNAMES) + rng.choice(GIVEN) + (rng.choice(GIVEN) if rng.random() < 0.6 else "")
+        city, districts = rng.choice(CITIES)
+        customers.append([
+            f"U{100000 + i}",
+            name,
+            f"u{100000 + i}{rng.choice(DOMAINS)}",
+            "1" + str(rng.randint(3000000000, 9999999999)),
+            f"{city}{rng.choice(districts)}某街道{rng.randint(1, 199)}号",
+        ])
+    # 一部分客户与另一位客户共用手机号或邮箱
+    for c in customers:
+        if rng.random() < shared_ratio:
+            other = rng.choice(customers)
+            if rng.random() < 0.5:
+                c[3] = other[3]
+            else:
+                c[2] = other[2]
+    return customers
+
+
+def zipf_cum_weights(n: int, s: float):
+    return list(itertools.accumulate(1.0 / (rank ** s) for rank in range(1, n + 1)))
+
+
+def pick_status(rng: random.Random, age_days: float):
+    for limit, weights in STATUS_BY_AGE:
+        if limit is None or age_days < limit:
+            statuses, w = zip(*weights)
+            return rng.choices(statuses, weights=w)[0]
+
+
+def gen_rows(rng, customers, cum_weights, rows, start, end, hot_ratio, hot_days, id_base):
+    span = (end - start).total_seconds()
+    for i in range(rows):
+        uid, name, email, phone, address = rng.choices(customers, cum_weights=cum_weights)[0]
+        if rng.random() < hot_ratio:
+            age = min(rng.expovariate(1.0 / hot_days), span / 86400)
+            created = end - datetime.timedelta(days=age)
+        else:
+            created = start + datetime.timedelta(seconds=rng.random() * span)
+            age = (end - created).total_seconds() / 86400
+        status = pick_status(rng, age)
+        tracking_no = f"SF{rng.randint(100000000, 999999999)}CN" if status not in ("待支付", "已支付待发货") else None
+        yield (
+            f"OD{id_base + i:010d}",
+            uid, name, email, phone, status, tracking_no,
+            rng.choice(ITEMS),
+            round(rng.uniform(20, 3000), 2),
+            created.strftime("%Y-%m-%d %H:%M:%S"),
+            address,
+        )
+
+
+def main():
+    ap = argparse.ArgumentParser(description="生成大规模伪造订单数据")
+    ap.add_argument("--db", default="SQLite/orders_bench.db")
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--customers", type=int, default=None, help="客户数（默认 rows/5）")
+    ap.add_argument("--zipf", type=float, default=0.9, help="客户下单频次的 Zipf 指数，越大越集中")
+    ap.add_argument("--shared-ratio", type=float, default=0.05, help="与他人共用手机号/邮箱的客户比例")
+    ap.add_argument("--hot-ratio", type=float, default=0.7, help="集中在近期的订单比例")
+    ap.add_argument("--hot-days", type=float, default=21.0, help="近期订单年龄的平均天数（指数分布）")
+    ap.add_argument("--start", default="2024-01-01")
+    ap.add_argument("--end", default="2025-08-15")
+    ap.add_argument("--batch", type=int, default=100_000, help="每个事务写入的行数")
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    start = datetime.datetime.fromisoformat(args.start)
+    end = datetime.datetime.fromisoformat(args.end)
+    n_customers = args.customers or max(1, args.rows // 5)
+
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    con = sqlite3.connect(args.db, isolation_level=None)
+    # 装载阶段不要日志与 fsync；装完再切回 WAL
+    con.execute("PRAGMA journal_mode=OFF")
+    con.execute("PRAGMA synchronous=OFF")
+    con.execute("PRAGMA cache_size=-262144")
+    with open(SCHEMA_SQL, "r", encoding="utf-8") as f:
+        con.executescript(f.read())
+    con.execute("PRAGMA journal_mode=OFF")  # schema 脚本里会设置 WAL
+
+    t0 = time.perf_counter()
+    customers = make_customers(rng, n_customers, args.shared_ratio)
+    cum_weights = zipf_cum_weights(n_customers, args.zipf)
+    rows = gen_rows(rng, customers, cum_weights, args.rows, start, end,
+                    args.hot_ratio, args.hot_days, id_base=2_500_000_001)
+
+    written = 0
+    while True:
+        chunk = list(itertools.islice(rows, args.batch))
+        if not chunk:
+            break
+        con.execute("BEGIN")
+        con.executemany(INSERT_SQL, chunk)
+        con.execute("COMMIT")
+        written += len(chunk)
+        print(f"\r写入 {written}/{args.rows}", end="", flush=True)
+    t_load = time.perf_counter() - t0
+
+    # 数据写完再建索引
+    t1 = time.perf_counter()
+    migrate(con)
+    con.execute("ANALYZE")
+    t_index = time.perf_counter() - t1
+    con.execute("PRAGMA journal_mode=WAL")
+    con.close()
+
+    print(f"\n✅ {args.db}：{written} 笔订单 / {n_customers} 个客户；"
+          f"写入 {t_load:.1f}s（{written / max(t_load, 1e-9):.0f} 行/s），建索引 {t_index:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
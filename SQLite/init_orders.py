@@ -1,6 +1,11 @@
 import sqlite3
 import random
 import datetime
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))  # 复用仓库根目录的 tools.db_migrations
+from tools.db_migrations import migrate
 
 # 1) 初始化数据库（读取 init_orders.sql 并执行）
 with open("SQLite/init_orders.sql", "r", encoding="utf-8") as f:
@@ -64,6 +69,9 @@ for i in range(1, 21):
     """, (order_id, user_id, name, email, phone, status, tracking_no, item_summary, total_amount, created_at, address))
 
 con.commit()
+
+# 4) 数据写完再建索引（迁移），比逐行维护索引更快
+migrate(con)
 con.close()
 
 print("orders.db 已创建并初始化完成，并插入 20 条随机订单数据！")
@@ -3,6 +3,7 @@ PRAGMA journal_mode = WAL;
 PRAGMA synchronous = NORMAL;
 
 DROP TABLE IF EXISTS orders;
+PRAGMA user_version = 0;                                   -- 重建后由 tools/db_migrations.py 重新应用索引等迁移
 CREATE TABLE orders (
   order_id     TEXT PRIMARY KEY,                           -- 订单号
   user_id      TEXT,
@@ -17,6 +18,4 @@ CREATE TABLE orders (
   address      TEXT                                        -- 收货地址
 );
 
--- 常用检索索引
-CREATE INDEX IF NOT EXISTS idx_orders_email      ON orders(email);
-CREATE INDEX IF NOT EXISTS idx_orders_phone      ON orders(phone);
+-- 常用检索索引见 tools/db_migrations.py（按 user_version 版本化应用）
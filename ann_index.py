@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+# ann_index.py
+"""
+FAISS 近似最近邻索引的构建、参数选择与召回/延迟基准（Resources/embedding.py 与 utils.load_vectorstore 共用）。
+- 支持 flat（暴力内积）、ivf_flat、ivf_pq、hnsw；向量已 L2 归一化，统一用内积度量
+- IndexSpec 描述索引类型与参数；未指定的参数按语料规模自动取值，语料太小无法训练时自动降级
+- 压缩存储（storage）：fp16 / int8 标量量化或 PQ，flat 与 ivf_flat 可选；可配合 rerank：
+  先从压缩索引取 k·rerank 个候选，再用磁盘上的 float32 原始向量（memmap，按需换页）精确重排
+- benchmark()：以 flat 结果为真值，报告每组参数的 recall@k、单条查询延迟、索引大小（相对 flat 的比例）与构建耗时
+- 选定的 spec 写入 faiss_store/index_spec.json，两条建库流程读取同一份配置
+"""
+
+import json
+import math
+import time
+from dataclasses import asdict, dataclass, fields, replace
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+STORAGE_TYPES = ("fp16", "int8", "pq")
+SPEC_FILE = "index_spec.json"
+# rerank 用的 float32 原始向量，行号与索引中的位置一致
+FULL_VECTORS_FILE = "vectors.f32"
+
+# k-means 每个中心至少需要的训练点数（低于此值 FAISS 会告警，聚类质量明显下降）
+MIN_POINTS_PER_CENTROID = 39
+# 只影响查询、不需要重建索引的参数
+SEARCH_PARAMS = ("nprobe", "ef_search")
+
+
+@dataclass
+class IndexSpec:
+    kind: str = "flat"
+    nlist: Optional[int] = None  # IVF 倒排桶数
+    nprobe: Optional[int] = None  # IVF 查询时探查的桶数
+    pq_m: Optional[int] = None  # PQ 子向量个数（需整除维度）
+    pq_nbits: Optional[int] = None  # 每个子向量的码本位数（默认 8）
+    hnsw_m: Optional[int] = None  # HNSW 每个节点的邻居数
+    ef_construction: Optional[int] = None
+    ef_search: Optional[int] = None
+    storage: Optional[str] = None  # 向量压缩方式；None 为 float32 原样存储
+    rerank: Optional[int] = None  # 候选放大倍数；>1 时用 float32 原始向量精确重排
+
+    def __post_init__(self):
+        if self.kind not in INDEX_TYPES:
+            raise ValueError(f"未知索引类型：{self.kind}（可选 {', '.join(INDEX_TYPES)}）")
+        if self.storage is not None:
+            if self.storage not in STORAGE_TYPES:
+                raise ValueError(f"未知存储方式：{self.storage}（可选 {', '.join(STORAGE_TYPES)}）")
+            if self.kind not in ("flat", "ivf_flat"):
+                raise ValueError(f"storage 只适用于 flat / ivf_flat（{self.kind} 自带编码方式）")
+
+    @property
+    def uses_pq(self) -> bool:
+        return self.kind == "ivf_pq" or self.storage == "pq"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {k: v for k, v in asdict(self).items() if v is not None}
+
+    @classmethod
+    def from_dict(cls, d: Optional[Dict[str, Any]]) -> "IndexSpec":
+        names = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in (d or {}).items() if k in names})
+
+    def build_key(self) -> Dict[str, Any]:
+        """决定索引结构的参数；只有这些变化才需要重建。"""
+        return {k: v for k, v in self.to_dict().items() if k not in SEARCH_PARAMS}
+
+    def describe(self) -> str:
+        params = ", ".join(f"{k}={v}" for k, v in self.to_dict().items() if k != "kind")
+        return f"{self.kind}({params})" if params else self.kind
+
+
+def load_spec(path: Path) -> IndexSpec:
+    path = Path(path)
+    if not path.exists():
+        return IndexSpec()
+    return IndexSpec.from_dict(json.loads(path.read_text(encoding="utf-8")))
+
+
+def save_spec(spec: IndexSpec, path: Path) -> None:
+    Path(path).write_text(json.dumps(spec.to_dict(), ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def _default_pq_m(d: int) -> int:
+    """每个子向量 8~16 维：1024 维 → 64 个子向量（64 字节/向量）。"""
+    for m in (64, 48, 32, 24, 16, 8, 4, 2, 1):
+        if d % m == 0 and d // m >= 8:
+            return m
+    return 1
+
+
+def _resolve_pq(spec: IndexSpec, n: int, d: int) -> IndexSpec:
+    nbits = spec.pq_nbits or 8
+    if n < MIN_POINTS_PER_CENTROID * (1 << nbits):
+        if spec.kind == "ivf_pq":
+            print(f"⚠️ 仅 {n} 条向量，不足以训练 {1 << nbits} 中心的 PQ 码本，改用 ivf_flat")
+            return replace(spec, kind="ivf_flat", pq_m=None, pq_nbits=None)
+        print(f"⚠️ 仅 {n} 条向量，不足以训练 {1 << nbits} 中心的 PQ 码本，改用 int8 存储")
+        return replace(spec, storage="int8", pq_m=None, pq_nbits=None)
+    pq_m = spec.pq_m or _default_pq_m(d)
+    if d % pq_m:
+        raise ValueError(f"pq_m={pq_m} 不能整除向量维度 {d}")
+    return replace(spec, pq_m=pq_m, pq_nbits=nbits)
+
+
+def resolve_spec(spec: IndexSpec, n: int, d: int) -> IndexSpec:
+    """补齐未指定的参数；训练样本不足时降级（ivf_pq → ivf_flat → flat，pq 存储 → int8），并打印原因。"""
+    if spec.kind == "ivf_flat" and spec.storage == "pq":
+        spec = replace(spec, kind="ivf_pq", storage=None)
+    if spec.kind == "flat":
+        return _resolve_pq(spec, n, d) if spec.uses_pq else spec
+    if spec.kind == "hnsw":
+        return replace(
+            spec,
+            hnsw_m=spec.hnsw_m or 32,
+            ef_construction=spec.ef_construction or 80,
+            ef_search=spec.ef_search or 64,
+        )
+
+    nlist = spec.nlist or max(1, int(4 * math.sqrt(n)))
+    nlist = min(nlist, n // MIN_POINTS_PER_CENTROID)
+    if nlist < 2:
+        print(f"⚠️ 仅 {n} 条向量，不足以训练 IVF，改用 flat")
+        return resolve_spec(IndexSpec(storage=spec.storage, rerank=spec.rerank), n, d)
+    nprobe = min(nlist, spec.nprobe or max(1, round(math.sqrt(nlist))))
+    spec = replace(spec, nlist=nlist, nprobe=nprobe)
+    return _resolve_pq(spec, n, d) if spec.uses_pq else spec
+
+
+_SQ_TYPES = {"fp16": "QT_fp16", "int8": "QT_8bit"}
+
+
+def create_index(spec: IndexSpec, d: int) -> faiss.Index:
+    """按已 resolve 的 spec 创建空索引（内积度量）；IVF / 量化类需要先 train。"""
+    ip = faiss.METRIC_INNER_PRODUCT
+    if spec.kind == "flat":
+        if spec.storage == "pq":
+            return faiss.IndexPQ(d, spec.pq_m, spec.pq_nbits, ip)
+        if spec.storage:
+            return faiss.IndexScalarQuantizer(d, getattr(faiss.ScalarQuantizer, _SQ_TYPES[spec.storage]), ip)
+        return faiss.IndexFlatIP(d)
+    if spec.kind == "hnsw":
+        index = faiss.IndexHNSWFlat(d, spec.hnsw_m, ip)
+        index.hnsw.efConstruction = spec.ef_construction
+        return index
+    quantizer = faiss.IndexFlatIP(d)
+    if spec.uses_pq:
+        return faiss.IndexIVFPQ(quantizer, d, spec.nlist, spec.pq_m, spec.pq_nbits, ip)
+    if spec.storage:
+        qtype = getattr(faiss.ScalarQuantizer, _SQ_TYPES[spec.storage])
+        return faiss.IndexIVFScalarQuantizer(quantizer, d, spec.nlist, qtype, ip)
+    return faiss.IndexIVFFlat(quantizer, d, spec.nlist, ip)
+
+
+def with_ids(index: faiss.Index) -> faiss.Index:
+    """需要自定义向量 id 时的包装：IVF 原生支持 add_with_ids / remove_ids，其余套 IndexIDMap2。"""
+    if isinstance(faiss.downcast_index(index), faiss.IndexIVF):
+        return index
+    return faiss.IndexIDMap2(index)
+
+
+def train(index: faiss.Index, vecs: np.ndarray) -> None:
+    if not index.is_trained:
+        index.train(np.ascontiguousarray(vecs, dtype="float32"))
+
+
+def set_search_params(index: faiss.Index, spec: IndexSpec) -> None:
+    """nprobe / efSearch 不随索引落盘，加载后需要重新设置。"""
+    ps = faiss.ParameterSpace()
+    if spec.kind.startswith("ivf") and spec.nprobe:
+        ps.set_index_parameter(index, "nprobe", spec.nprobe)
+    if spec.kind == "hnsw" and spec.ef_search:
+        ps.set_index_parameter(index, "efSearch", spec.ef_search)
+
+
+def _unwrap(index: faiss.Index) -> faiss.Index:
+    inner = faiss.downcast_index(index)
+    if isinstance(inner, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        inner = faiss.downcast_index(inner.index)
+    return inner
+
+
+def _sq_storage(sq) -> str:
+    return "fp16" if sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "int8"
+
+
+def index_kind(index: faiss.Index) -> str:
+    """从已加载的索引反推类型（用于判断落盘索引与当前配置是否一致）。"""
+    inner = _unwrap(index)
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(inner, faiss.IndexIVF):
+        return "ivf_flat"
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def index_storage(index: faiss.Index) -> Optional[str]:
+    inner = _unwrap(index)
+    if isinstance(inner, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return _sq_storage(inner.sq)
+    if isinstance(inner, faiss.IndexPQ):
+        return "pq"
+    return None
+
+
+def spec_of(index: faiss.Index, wanted: IndexSpec) -> IndexSpec:
+    """已构建索引的结构参数 + wanted 中的查询参数与 rerank（增量同步沿用旧结构时用）。"""
+    kind, inner = index_kind(index), _unwrap(index)
+    spec = IndexSpec(kind=kind, storage=index_storage(index), rerank=wanted.rerank)
+    if kind == "hnsw":
+        spec.hnsw_m = inner.hnsw.nb_neighbors(1)
+        spec.ef_construction = inner.hnsw.efConstruction
+        spec.ef_search = wanted.ef_search or inner.hnsw.efSearch
+    elif kind != "flat":
+        spec.nlist = inner.nlist
+        spec.nprobe = min(inner.nlist, wanted.nprobe or inner.nprobe)
+    if isinstance(inner, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        spec.pq_m, spec.pq_nbits = inner.pq.M, inner.pq.nbits
+    return spec
+
+
+def supports_remove(kind: str) -> bool:
+    """HNSW 不支持删除向量，删除 chunk 时只能重建。"""
+    return kind != "hnsw"
+
+
+def index_bytes(index: faiss.Index) -> int:
+    return int(faiss.serialize_index(index).size)
+
+
+# -------------------- 精确重排 --------------------
+def write_full_vectors(path: Path, vecs: np.ndarray) -> None:
+    """按索引位置顺序写出 float32 原始向量（裸数组，形状由调用方记录）。"""
+    path = Path(path)
+    tmp = path.with_suffix(".tmp")
+    np.ascontiguousarray(vecs, dtype="float32").tofile(tmp)
+    tmp.replace(path)
+
+
+def open_full_vectors(path: Path, d: int) -> np.ndarray:
+    """只读 memmap：查询时只有被访问的候选行才会换入内存。"""
+    return np.memmap(path, dtype="float32", mode="r").reshape(-1, d)
+
+
+def rescore(full_vectors: np.ndarray, query: np.ndarray, positions: Sequence[int], k: int):
+    """对候选位置用原始向量重新计算内积，返回按分数降序的前 k 个 (位置, 分数)。"""
+    positions = [p for p in positions if p >= 0]
+    if not positions:
+        return []
+    scores = np.asarray(full_vectors[np.asarray(positions)], dtype="float32") @ np.asarray(query, dtype="float32")
+    order = np.argsort(-scores)[:k]
+    return [(positions[i], float(scores[i])) for i in order]
+
+
+# -------------------- 基准 --------------------
+def default_grid(n: int, d: int) -> List[IndexSpec]:
+    """每种结构一组构建参数 + 一串查询参数（nprobe / efSearch 由小到大），以及各压缩存储（含 / 不含重排）。"""
+    grid = [IndexSpec()]
+    for storage in STORAGE_TYPES:
+        base = resolve_spec(IndexSpec(storage=storage), n, d)
+        if base.storage != storage:
+            continue
+        # PQ 码本误差大，候选池要放得更宽
+        grid += [base, replace(base, rerank=16 if storage == "pq" else 4)]
+    for kind in ("ivf_flat", "ivf_pq"):
+        base = resolve_spec(IndexSpec(kind=kind), n, d)
+        if base.kind != kind:
+            continue
+        for nprobe in sorted({1, 2, 4, 8, 16, 32, 64, base.nlist} & set(range(1, base.nlist + 1))):
+            grid.append(replace(base, nprobe=nprobe))
+    base = resolve_spec(IndexSpec(kind="hnsw"), n, d)
+    for ef in (16, 32, 64, 128, 256):
+        grid.append(replace(base, ef_search=ef))
+    base = resolve_spec(IndexSpec(kind="ivf_flat", storage="int8", rerank=4), n, d)
+    if base.kind == "ivf_flat":
+        grid.append(base)
+    return grid
+
+
+def _recall(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    hits = sum(len(set(f[f >= 0]) & set(t)) for f, t in zip(found, truth))
+    return hits / (k * len(truth))
+
+
+def benchmark(
+    vecs: np.ndarray,
+    queries: np.ndarray,
+    specs: Iterable[IndexSpec],
+    k: int = 10,
+) -> List[Dict[str, Any]]:
+    """
+    逐组参数测 recall@k（相对 flat 精确结果）与单条查询延迟（含重排）。
+    构建参数相同的 spec 共用同一个索引，只切换查询参数 / 重排倍数。
+    mem_saved 为索引体积相对 flat 节省的比例，recall_lost 为相对 flat 损失的召回；
+    重排所需的 float32 原始向量在磁盘上（rerank_disk_mb），按需换页，不计入常驻内存。
+    """
+    vecs = np.ascontiguousarray(vecs, dtype="float32")
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    d = vecs.shape[1]
+    k = min(k, len(vecs))
+    exact = faiss.IndexFlatIP(d)
+    exact.add(vecs)
+    _, truth = exact.search(queries, k)
+    flat_bytes = index_bytes(exact)
+
+    built: Dict[str, Any] = {}
+    rows = []
+    for spec in specs:
+        key = json.dumps({k_: v for k_, v in spec.build_key().items() if k_ != "rerank"}, sort_keys=True)
+        if key not in built:
+            t0 = time.perf_counter()
+            index = create_index(spec, d)
+            train(index, vecs)
+            index.add(vecs)
+            built[key] = (index, time.perf_counter() - t0)
+        index, build_s = built[key]
+        set_search_params(index, spec)
+
+        fetch = k * spec.rerank if spec.rerank and spec.rerank > 1 else k
+        lat = []
+        found = np.full_like(truth, -1)
+        for i in range(len(queries)):
+            t0 = time.perf_counter()
+            _, ids = index.search(queries[i:i + 1], fetch)
+            if fetch > k:
+                top = [p for p, _ in rescore(vecs, queries[i], ids[0].tolist(), k)]
+            else:
+                top = ids[0].tolist()
+            lat.append(time.perf_counter() - t0)
+            found[i, :len(top)] = top
+        lat.sort()
+        size = index_bytes(index)
+        recall = _recall(found, truth)
+        rows.append({
+            "spec": spec.to_dict(),
+            "describe": spec.describe(),
+            f"recall@{k}": round(recall, 4),
+            "recall_lost": round(1 - recall, 4),
+            "p50_ms": round(lat[len(lat) // 2] * 1000, 4),
+            "p95_ms": round(lat[min(len(lat) - 1, int(len(lat) * 0.95))] * 1000, 4),
+            "index_mb": round(size / 2**20, 3),
+            "mem_saved": round(1 - size / flat_bytes, 3),
+            "rerank_disk_mb": round(vecs.nbytes / 2**20, 3) if fetch > k else 0,
+            "build_s": round(build_s, 3),
+        })
+    return rows
+
+
+def select(
+    rows: Sequence[Dict[str, Any]], kind: str, target_recall: float, storage: Optional[str] = None
+) -> Optional[IndexSpec]:
+    """指定类型（与存储方式）中达到目标召回的最快参数；都达不到时取召回最高的一组。"""
+    cands = [r for r in rows if r["spec"]["kind"] == kind and r["spec"].get("storage") == storage]
+    if not cands:
+        return None
+    recall_key = next(k for k in cands[0] if k.startswith("recall@"))
+    ok = [r for r in cands if r[recall_key] >= target_recall]
+    best = min(ok, key=lambda r: r["p50_ms"]) if ok else max(cands, key=lambda r: r[recall_key])
+    return IndexSpec.from_dict(best["spec"])
+
+
+def format_table(rows: Sequence[Dict[str, Any]]) -> str:
+    if not rows:
+        return ""
+    cols = list(rows[0].keys())[1:]
+    widths = [max(len(c), *(len(str(r[c])) for r in rows)) for c in cols]
+    lines = ["  ".join(c.ljust(w) for c, w in zip(cols, widths))]
+    lines += ["  ".join(str(r[c]).ljust(w) for c, w in zip(cols, widths)) for r in rows]
+    return "\n".join(lines)
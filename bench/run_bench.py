@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+# bench/run_bench.py
+"""
+端到端基准：用脚本化桩 LLM（LLM.StubChatModel，可配置延迟）替换 ChatOllama，
+分别测量冷启动、FAISS 检索、各 orders.* 工具、完整 doc_qa、以及不同并发下的完整 agent 轮次，
+输出 p50/p95/p99 与吞吐，结果写成 JSON 便于跨提交对比。
+
+用法（在仓库根目录）：
+    python -m bench.run_bench --llm-delay 0.2 --out bench_results.json
+    python -m bench.run_bench --fake-embeddings        # 无 bge-m3 时用确定性假向量（写入临时目录，不动 faiss_store/）
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Sequence
+
+from LLM import STUB_LLM_ENV, STUB_SCRIPT_ENV
+
+DEFAULT_SCRIPT = Path(__file__).with_name("stub_script.json")
+QUERIES = [
+    "退货政策是什么？",
+    "物流一般几天能到？",
+    "怎么申请发票？",
+    "订单已经发货了还能改地址吗？",
+    "缺货了怎么办？",
+    "支持哪些支付方式？",
+]
+# 依赖上文的追问：doc_qa 需要先改写问题（needs_condense 为真），每次 2 次 LLM 调用
+FOLLOWUPS = [
+    "那退款多久到账呢？",
+    "这个需要提供什么材料？",
+    "它一般几天能处理完？",
+]
+
+
+# -------------------- 统计 --------------------
+def _percentile(sorted_vals: Sequence[float], p: float) -> float:
+    """nearest-rank 百分位。"""
+    if not sorted_vals:
+        return float("nan")
+    k = max(0, min(len(sorted_vals) - 1, math.ceil(p / 100 * len(sorted_vals)) - 1))
+    return sorted_vals[k]
+
+
+def summarize(latencies_s: List[float], wall_s: float, extra: Dict[str, Any] = None) -> Dict[str, Any]:
+    lat = sorted(x * 1000 for x in latencies_s)
+    out = {
+        "n": len(lat),
+        "mean_ms": round(sum(lat) / len(lat), 3) if lat else None,
+        "p50_ms": round(_percentile(lat, 50), 3),
+        "p95_ms": round(_percentile(lat, 95), 3),
+        "p99_ms": round(_percentile(lat, 99), 3),
+        "throughput_per_s": round(len(lat) / wall_s, 2) if wall_s else None,
+    }
+    out.update(extra or {})
+    return out
+
+
+def timed(fn: Callable[[int], Any], n: int, warmup: int = 1) -> Dict[str, Any]:
+    for i in range(warmup):
+        fn(i)
+    lat = []
+    t0 = time.perf_counter()
+    for i in range(n):
+        s = time.perf_counter()
+        fn(i)
+        lat.append(time.perf_counter() - s)
+    return summarize(lat, time.perf_counter() - t0)
+
+
+# -------------------- 环境准备 --------------------
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def _use_fake_embeddings(tmp: Path, dim: int) -> None:
+    """把 utils 的嵌入模型换成确定性假向量，并把向量库目录指向临时目录。"""
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    import utils
+    from embed_batcher import BatchedQueryEmbeddings
+
+    store = tmp / "faiss_store"
+    utils.FAISS_DIR = store
+    utils.MANIFEST_FILE = store / "manifest.json"
+    utils.EMBED_CACHE_DIR = store / "embed_cache"
+    utils.BM25_FILE = store / "bm25.json"
+    utils.SCENARIO_INDEX_FILE = store / "scenario_index.json"
+    utils.FULL_VECTORS_PATH = store / "vectors.f32"
+    utils.LOCAL_BGE_DIR = Path(f"fake-embedding-{dim}")
+    embed = BatchedQueryEmbeddings(DeterministicFakeEmbedding(size=dim))  # 与 utils 一样整个进程共用一份
+    utils._get_embeddings = lambda: embed
+
+
+def _use_db_copy(tmp: Path, src: str) -> str:
+    """orders.address_update 会写库，压测在副本上进行。"""
+    import tools.dbtools as dbtools
+
+    dst = tmp / "orders.db"
+    shutil.copy(src, dst)
+    dbtools._DB_PATH = str(dst)
+    return str(dst)
+
+
+def _sample_args(db_path: str) -> Dict[str, List[Any]]:
+    con = sqlite3.connect(db_path)
+    from tools.dbtools import ADDRESS_EDITABLE_STATUSES
+
+    rows = con.execute("SELECT order_id, phone, email, status, user_id FROM orders ORDER BY order_id LIMIT 50").fetchall()
+    con.close()
+    return {
+        "order_id": [r[0] for r in rows],
+        "user_id": [r[4] for r in rows],  # 与 order_id 一一对应：改地址时以订单归属用户的身份调用
+        # 只有这些状态的订单会真正被改地址，其余会被 UPDATE 的条件挡下
+        "editable_order_id": [r[0] for r in rows if r[3] in ADDRESS_EDITABLE_STATUSES],
+        "phone": [r[1] for r in rows if r[1]],
+        "email": [r[2] for r in rows if r[2]],
+    }
+
+
+# -------------------- 各项基准 --------------------
+def bench_cold_start(runs: int) -> Dict[str, Any]:
+    """load_vectorstore（命中 manifest 时为纯加载）+ 工具初始化 + agent 组装。"""
+    import utils
+    from main import bootstrap_agent
+    from tools.registry import init_all_tools
+
+    def once(_):
+        vs = utils.load_vectorstore()
+        bootstrap_agent(verbose=False, tools=init_all_tools(vs=vs, cache_path=None))
+
+    return timed(once, runs, warmup=1)  # warmup 负责首次建库
+
+
+def bench_faiss(vs, n: int, k: int) -> Dict[str, Any]:
+    return timed(lambda i: vs.similarity_search(QUERIES[i % len(QUERIES)], k=k), n)
+
+
+def bench_db_tools(n: int, samples: Dict[str, List[Any]]) -> Dict[str, Any]:
+    import tools.dbtools as dbtools
+    from tools.dbtools import (
+        orders_get_by_id,
+        orders_search_by_phone,
+        orders_search_by_email,
+        orders_address_update,
+        user_context,
+    )
+
+    ids, phones, emails = samples["order_id"], samples["phone"], samples["email"]
+    editable = samples["editable_order_id"]
+    rejected = [oid for oid in ids if oid not in set(editable)]
+    owner = dict(zip(ids, samples["user_id"]))
+
+    def update_as_owner(order_id: str, new_address: str):
+        with user_context(owner[order_id]):
+            return orders_address_update.invoke({"order_id": order_id, "new_address": new_address})
+
+    res = {
+        "orders.get_by_id": timed(lambda i: orders_get_by_id.invoke({"order_id": ids[i % len(ids)]}), n),
+        "orders.search_by_phone": timed(
+            lambda i: orders_search_by_phone.invoke({"phone": phones[i % len(phones)]}), n),
+        "orders.search_by_email": timed(
+            lambda i: orders_search_by_email.invoke({"email": emails[i % len(emails)]}), n),
+        "orders.address_update": timed(
+            lambda i: update_as_owner(editable[i % len(editable)], f"上海市浦东新区压测路{i}号"), n),
+        # 状态不允许修改：条件 UPDATE 不命中，失败原因取自同一事务里读到的旧行
+        "orders.address_update_rejected": timed(
+            lambda i: update_as_owner(rejected[i % len(rejected)], f"上海市浦东新区压测路{i}号"), n),
+        # 同一条指令重复下发（agent 重试）：命中幂等键，不访问数据库
+        "orders.address_update_replay": timed(
+            lambda i: update_as_owner(editable[0], "上海市浦东新区压测路0号"), n),
+        # 后台批量改地址：全部订单一个事务、一次提交（每次 op 处理全部样本订单）
+        "update_addresses_batch": timed(
+            lambda i: dbtools.update_addresses(
+                [(oid, f"上海市浦东新区批量路{i}号") for oid in ids], actor="bench"), max(1, n // 10)),
+    }
+    res["update_addresses_batch"]["orders_per_op"] = len(ids)
+    audit = dbtools.audit_log()
+    audit.flush()
+    res["audit"] = asdict(audit.stats())
+    return res
+
+
+def bench_doc_qa(n: int, llm_counter, session: str = None, queries: Sequence[str] = QUERIES) -> Dict[str, Any]:
+    """session 为空时每次一个新会话（无历史）；指定时所有调用共用该会话，历史逐轮累积（同 agent 内的调用）。"""
+    from tools.rag_docqa import tool as doc_qa_module
+    from tools.rag_docqa.memory_pool import session_context
+    from tools.rag_docqa.packing import PackingStats
+
+    packer = doc_qa_module._CRC.retriever.packer
+    packer.stats = PackingStats()
+    if session is not None:
+        # 先垫一轮，保证计时的每次调用都带历史
+        with session_context(session):
+            doc_qa_module.doc_qa.invoke({"question": QUERIES[0]})
+
+    def once(i: int) -> None:
+        with session_context(session or f"b{i}"):
+            doc_qa_module.doc_qa.invoke({"question": queries[i % len(queries)]})
+
+    llm_counter.reset_calls()
+    res = timed(once, n, warmup=0)
+    res["llm_calls_per_op"] = round(llm_counter.calls / n, 3)
+    # 上下文装配（packing.py）前后送进 prompt 的估算 token 数
+    stats = packer.stats
+    res["context_tokens_in_per_op"] = round(stats.tokens_in / max(1, stats.calls), 1)
+    res["context_tokens_out_per_op"] = round(stats.tokens_out / max(1, stats.calls), 1)
+    return res
+
+
+def bench_agent(executor, llm_counter, levels: List[int], turns_per_level: int) -> Dict[str, Any]:
+    """闭环压测：每个并发档位起 level 个会话，各自顺序发送请求，延迟不含排队。"""
+    from server import AgentServer
+
+    out: Dict[str, Any] = {}
+    for level in levels:
+        async def run() -> Dict[str, Any]:
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=max(4, level * 2)))
+            server = AgentServer(executor, router=None, max_concurrency=level)
+            per_session = max(1, turns_per_level // level)
+
+            async def session(sid: int) -> List[float]:
+                lat = []
+                for i in range(per_session):
+                    r = await server.handle(f"c{level}-{sid}", QUERIES[(sid + i) % len(QUERIES)])
+                    lat.append(r["latency_ms"] / 1000)
+                return lat
+
+            llm_counter.reset_calls()
+            t0 = time.perf_counter()
+            lats = await asyncio.gather(*(session(s) for s in range(level)))
+            wall = time.perf_counter() - t0
+            flat = [x for lat in lats for x in lat]
+            return summarize(
+                flat,
+                wall,
+                {"concurrency": level, "llm_calls_per_turn": round(llm_counter.calls / len(flat), 3)},
+            )
+
+        out[f"c{level}"] = asyncio.run(run())
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="QA Agent 端到端基准（桩 LLM）")
+    ap.add_argument("--llm-delay", type=float, default=0.0, help="桩 LLM 每次调用的模拟延迟（秒）")
+    ap.add_argument("--script", default=str(DEFAULT_SCRIPT), help="桩 LLM 脚本（JSON）")
+    ap.add_argument("--fake-embeddings", action="store_true", help="不加载 bge-m3，用确定性假向量")
+    ap.add_argument("--dim", type=int, default=1024, help="假向量维度")
+    ap.add_argument("--db", default="SQLite/orders.db", help="压测使用的订单库（会复制到临时目录）")
+    ap.add_argument("-n", type=int, default=200, help="FAISS / DB 工具的迭代次数")
+    ap.add_argument("--doc-qa-n", type=int, default=30)
+    ap.add_argument("--cold-runs", type=int, default=3)
+    ap.add_argument("--concurrency", default="1,4,16", help="agent 轮次的并发档位")
+    ap.add_argument("--turns", type=int, default=48, help="每个并发档位的轮次数")
+    ap.add_argument("--only", default="", help="只跑指定项，逗号分隔：cold_start,faiss,db,doc_qa,agent")
+    ap.add_argument("--out", default="bench_results.json")
+    args = ap.parse_args()
+
+    os.environ[STUB_LLM_ENV] = str(args.llm_delay)
+    os.environ[STUB_SCRIPT_ENV] = args.script
+    only = {x for x in args.only.split(",") if x}
+
+    def want(name: str) -> bool:
+        return not only or name in only
+
+    tmp = Path(tempfile.mkdtemp(prefix="qa_bench_"))
+    try:
+        if args.fake_embeddings:
+            _use_fake_embeddings(tmp, args.dim)
+        db_path = _use_db_copy(tmp, args.db)
+
+        import utils
+        from LLM import get_llm
+        from main import bootstrap_agent
+        from tools.registry import init_all_tools
+
+        results: Dict[str, Any] = {}
+        if want("cold_start"):
+            results["cold_start"] = bench_cold_start(args.cold_runs)
+
+        vs = utils.load_vectorstore()
+        if want("faiss"):
+            results["faiss_search"] = bench_faiss(vs, args.n, k=5)
+        if want("db"):
+            results["db_tools"] = bench_db_tools(args.n, _sample_args(db_path))
+
+        # doc_qa 与 agent 共用同一个桩 LLM 实例，便于统计调用次数；答案缓存关闭以测真实路径
+        import tools.rag_docqa.crc_chain as crc_chain
+
+        llm = get_llm()
+        crc_chain._get_llm = lambda: llm
+        tools = init_all_tools(vs=vs, cache_path=None)
+        if want("doc_qa"):
+            results["doc_qa"] = bench_doc_qa(args.doc_qa_n, llm)
+            # 有历史时：完整问题直接检索 + 生成（1 次调用），指代式追问才改写（2 次）
+            results["doc_qa_with_history"] = bench_doc_qa(args.doc_qa_n, llm, session="bench-history")
+            results["doc_qa_followup"] = bench_doc_qa(args.doc_qa_n, llm, session="bench-followup", queries=FOLLOWUPS)
+        if want("agent"):
+            executor = bootstrap_agent(llm=llm, verbose=False, tools=tools)
+            levels = [int(x) for x in args.concurrency.split(",") if x]
+            results["agent_turn"] = bench_agent(executor, llm, levels, args.turns)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "results": results,
+    }
+    Path(args.out).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    print(f"✅ 结果已写入 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
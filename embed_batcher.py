@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# embed_batcher.py
+"""
+查询向量的微批合并：并发到达的 embed_query 在一个很短的收集窗口（max_wait_ms）内
+合并成一次批量 encode，再把结果分发回各调用方。
+- 单个请求：最多多等 max_wait_ms，几乎不影响延迟
+- 并发请求：一次前向计算服务 max_batch 个查询，CPU 上吞吐成倍提升
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Sequence
+
+from langchain_core.embeddings import Embeddings
+
+from tracing import traced
+
+
+class QueryBatcher:
+    def __init__(
+        self,
+        encode: Callable[[List[str]], Sequence[Sequence[float]]],
+        max_batch: int = 32,
+        max_wait_ms: float = 5.0,
+    ):
+        self.encode = encode
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._q: "queue.Queue[tuple]" = queue.Queue()
+        # 统计：批次数 / 已处理查询数 / 最大批大小
+        self.batches = 0
+        self.items = 0
+        self.max_seen_batch = 0
+        self._worker = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+        self._worker.start()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._q.qsize()
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.items / self.batches if self.batches else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "queue_depth": self.queue_depth,
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": round(self.mean_batch_size, 2),
+            "max_batch_size": self.max_seen_batch,
+        }
+
+    def submit(self, text: str) -> "Future[List[float]]":
+        fut: "Future[List[float]]" = Future()
+        self._q.put((text, fut))
+        return fut
+
+    def embed(self, text: str) -> List[float]:
+        return self.submit(text).result()
+
+    def _collect(self) -> List[tuple]:
+        batch = [self._q.get()]  # 阻塞等第一条
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._q.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            texts = [t for t, _ in batch]
+            try:
+                vecs = self.encode(texts)
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            self.max_seen_batch = max(self.max_seen_batch, len(batch))
+            for (_, fut), v in zip(batch, vecs):
+                fut.set_result(list(v))
+
+
+class BatchedQueryEmbeddings(Embeddings):
+    """embed_query 走微批合并；embed_documents（建库）本身就是批量，直通。"""
+
+    def __init__(self, base, max_batch: int = 32, max_wait_ms: float = 5.0):
+        self.base = base
+        # 远程 embedding（embed_server.RemoteEmbeddings）单独提供查询批接口，服务端再跨进程合并
+        encode = getattr(base, "embed_queries", base.embed_documents)
+        self.batcher = QueryBatcher(encode, max_batch=max_batch, max_wait_ms=max_wait_ms)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.base.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with traced("embedding", "embed_query"):
+            return self.batcher.embed(text)
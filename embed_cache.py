@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# embed_cache.py
+"""
+按内容寻址的持久化向量缓存，供 utils.load_vectorstore 与 Resources/embedding.py 共用。
+- 命名空间：(模型标识, 是否归一化) → 各自独立的子目录
+- 键：sha256(chunk 文本)
+- 存储：vectors.f32（float32 矩阵，np.memmap 只读映射）+ keys.jsonl（key → 行号）
+- 只追加写：先写向量再写键，异常中断时多余的向量行会被忽略
+这样只修改 flows.md 的一个小节时，重新建库只需为变化的 chunk 计算向量。
+"""
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+try:
+    from langchain_core.embeddings import Embeddings
+except ImportError:  # Resources/embedding.py 单独运行时可不依赖 LangChain
+    Embeddings = object  # type: ignore
+
+DEFAULT_CACHE_DIR = Path("faiss_store/embed_cache")
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _normalize_model_id(model_id: str) -> str:
+    # 两条流水线对同一本地模型目录的写法不同（\ 与 /），统一后才能共享缓存
+    return os.path.normcase(os.path.normpath(str(model_id)))
+
+
+class EmbeddingCache:
+    """(model_id, normalize, sha256(text)) → float32 向量。"""
+
+    def __init__(self, model_id: str, normalize: bool, root: Path = DEFAULT_CACHE_DIR):
+        self.model_id = _normalize_model_id(model_id)
+        self.normalize = bool(normalize)
+        ns = hashlib.sha256(f"{self.model_id}|{self.normalize}".encode("utf-8")).hexdigest()[:16]
+        self.dir = Path(root) / ns
+        self.vec_file = self.dir / "vectors.f32"
+        self.keys_file = self.dir / "keys.jsonl"
+        self.meta_file = self.dir / "meta.json"
+
+        self._lock = threading.Lock()
+        self._rows: Dict[str, int] = {}
+        self._dim: Optional[int] = None
+        self._mm: Optional[np.memmap] = None
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    # -------------------- 读 --------------------
+    def _load(self) -> None:
+        if not self.meta_file.exists():
+            return
+        meta = json.loads(self.meta_file.read_text(encoding="utf-8"))
+        self._dim = int(meta["dim"])
+        n_rows = self._n_rows()
+        if self.keys_file.exists():
+            with self.keys_file.open("r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue  # 末行写到一半
+                    if rec["row"] < n_rows:
+                        self._rows[rec["key"]] = rec["row"]
+        self._remap()
+
+    def _n_rows(self) -> int:
+        if not self._dim or not self.vec_file.exists():
+            return 0
+        return self.vec_file.stat().st_size // (4 * self._dim)
+
+    def _remap(self) -> None:
+        n_rows = self._n_rows()
+        self._mm = (
+            np.memmap(self.vec_file, dtype="float32", mode="r", shape=(n_rows, self._dim))
+            if n_rows
+            else None
+        )
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    # -------------------- 写 --------------------
+    def _append(self, keys: Sequence[str], vecs: np.ndarray) -> None:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        if self._dim is None:
+            self._dim = int(vecs.shape[1])
+            self.meta_file.write_text(
+                json.dumps(
+                    {"model": self.model_id, "normalize": self.normalize, "dim": self._dim},
+                    ensure_ascii=False,
+                ),
+                encoding="utf-8",
+            )
+        elif vecs.shape[1] != self._dim:
+            raise ValueError(f"向量维度不一致：缓存为 {self._dim}，新向量为 {vecs.shape[1]}")
+
+        start = self._n_rows()
+        with self.vec_file.open("ab") as f:
+            f.write(np.ascontiguousarray(vecs, dtype="float32").tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with self.keys_file.open("a", encoding="utf-8") as f:
+            for i, k in enumerate(keys):
+                f.write(json.dumps({"key": k, "row": start + i}) + "\n")
+        for i, k in enumerate(keys):
+            self._rows[k] = start + i
+        self._remap()
+
+    # -------------------- 对外 --------------------
+    def get_or_compute(
+        self,
+        texts: Sequence[str],
+        encode: Callable[[List[str]], Sequence[Sequence[float]]],
+    ) -> np.ndarray:
+        """
+        返回与 texts 对齐的 (n, dim) float32 矩阵；只有缓存未命中的文本（去重后）交给 encode。
+        """
+        keys = [text_key(t) for t in texts]
+        with self._lock:
+            missing: Dict[str, str] = {}
+            for k, t in zip(keys, texts):
+                if k not in self._rows and k not in missing:
+                    missing[k] = t
+            self.misses += len(missing)
+            self.hits += len(keys) - len(missing)
+
+            if missing:
+                new_vecs = np.asarray(encode(list(missing.values())), dtype="float32")
+                self._append(list(missing.keys()), new_vecs)
+
+            if not keys:
+                return np.zeros((0, self._dim or 0), dtype="float32")
+            rows = np.fromiter((self._rows[k] for k in keys), dtype=np.int64, count=len(keys))
+            return np.array(self._mm[rows], dtype="float32")
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    给 LangChain Embeddings 套一层缓存：embed_documents 走缓存，embed_query 直通。
+    """
+
+    def __init__(self, base, cache: EmbeddingCache):
+        self.base = base
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.cache.get_or_compute(texts, self.base.embed_documents).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.base.embed_query(text)
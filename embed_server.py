@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+# embed_server.py
+"""
+共享 embedding 进程：bge-m3 只在这里加载一次，多个 agent 进程通过本地 socket 复用。
+- 服务端：multiprocessing.connection.Listener，默认监听 Unix socket（RUNTIME_DIR/embed.sock，目录 0700、socket 0600；
+  Windows 为命名管道），每个连接一个线程；所有连接的查询汇入同一个 QueryBatcher 合并成批，建库用的批量文档直接 encode
+- 客户端：RemoteEmbeddings（langchain Embeddings 接口），不导入 torch / sentence-transformers；
+  设置 QA_AGENT_EMBED_SERVER 后 utils.load_vectorstore 自动改用它
+- 握手时校验模型目录与归一化设置，避免与向量库 / embed_cache 的指纹不一致
+- 安全：连接上传输的是 pickle，能通过 HMAC 握手的一方即可在服务进程内执行代码。
+  密钥取自 QA_AGENT_EMBED_AUTHKEY，未设置时服务端生成随机密钥写入 RUNTIME_DIR/embed.key（0600），
+  同一用户的客户端从该文件读取；没有密钥时客户端拒绝连接。TCP 只应在可信网络上配合显式密钥使用
+用法：
+    python embed_server.py                                   # 监听默认 Unix socket
+    QA_AGENT_EMBED_SERVER=default python server.py           # default 即默认地址
+    python embed_server.py --stats                           # 查看队列深度 / 批大小
+"""
+
+import argparse
+import json
+import os
+import secrets
+import stat
+import sys
+import threading
+import time
+from collections import Counter
+from multiprocessing.connection import Client, Connection, Listener
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from langchain_core.embeddings import Embeddings
+
+# 设置后 utils._get_embeddings 连接该地址的共享 embedding 进程，而不是在本进程加载模型
+EMBED_SERVER_ENV = "QA_AGENT_EMBED_SERVER"
+# 连接握手用的共享密钥（multiprocessing 以 HMAC 校验）；未设置时使用 AUTHKEY_FILE
+EMBED_AUTHKEY_ENV = "QA_AGENT_EMBED_AUTHKEY"
+
+# 仅当前用户可访问的运行目录：默认 socket 与自动生成的密钥都放在这里
+RUNTIME_DIR = Path(os.getenv("XDG_RUNTIME_DIR") or Path.home() / ".cache") / "qa-agent"
+AUTHKEY_FILE = RUNTIME_DIR / "embed.key"
+DEFAULT_ADDRESS = r"\\.\pipe\qa-agent-embed" if sys.platform == "win32" else str(RUNTIME_DIR / "embed.sock")
+
+Address = Union[str, Tuple[str, int]]
+
+
+def parse_address(value: str) -> Address:
+    """
+    "default" → DEFAULT_ADDRESS；"host:port" → TCP；
+    其余（/tmp/embed.sock、\\\\.\\pipe\\embed）原样作为 Unix socket / 命名管道路径。
+    """
+    if value == "default":
+        return DEFAULT_ADDRESS
+    host, sep, port = value.rpartition(":")
+    if sep and port.isdigit() and not value.startswith(("/", "\\\\")):
+        return host or "127.0.0.1", int(port)
+    return value
+
+
+def _private_dir(path: Path) -> None:
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    if os.name == "posix":
+        os.chmod(path, 0o700)
+
+
+def _read_key_file() -> Optional[bytes]:
+    try:
+        st = AUTHKEY_FILE.stat()
+    except FileNotFoundError:
+        return None
+    if os.name == "posix" and (st.st_uid != os.getuid() or st.st_mode & (stat.S_IRWXG | stat.S_IRWXO)):
+        raise RuntimeError(f"{AUTHKEY_FILE} 必须属于当前用户且权限为 0600")
+    return AUTHKEY_FILE.read_bytes().strip()
+
+
+def _authkey(create: bool = False) -> bytes:
+    """环境变量优先；否则读密钥文件，create=True（服务端）时不存在就生成。没有可用密钥时报错，不退回任何默认值。"""
+    key = os.getenv(EMBED_AUTHKEY_ENV)
+    if key:
+        return key.encode("utf-8")
+    existing = _read_key_file()
+    if existing:
+        return existing
+    if not create:
+        raise RuntimeError(f"未找到 embedding 服务密钥：请设置 {EMBED_AUTHKEY_ENV}，或先启动 embed_server.py 生成 {AUTHKEY_FILE}")
+    _private_dir(AUTHKEY_FILE.parent)
+    key_bytes = secrets.token_hex(32).encode("ascii")
+    fd = os.open(AUTHKEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key_bytes)
+    print(f"✔ 已生成 embedding 服务密钥：{AUTHKEY_FILE}（0600）")
+    return key_bytes
+
+
+class EmbedServer:
+    def __init__(self, embeddings, model_id: str, normalize: bool, max_batch: int = 64, max_wait_ms: float = 5.0):
+        from embed_batcher import QueryBatcher
+
+        self.embeddings = embeddings
+        self.model_id = model_id
+        self.normalize = normalize
+        # 同一时刻只让一个批次过模型：查询批与建库批交替，而不是在 CPU 上互相抢线程
+        self._model_lock = threading.Lock()
+        self.batcher = QueryBatcher(self._encode, max_batch=max_batch, max_wait_ms=max_wait_ms)
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.clients = 0
+        self.connections = 0
+        self.requests: Counter = Counter()
+        self.documents = 0
+        self.dim: Optional[int] = None
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        with self._model_lock:
+            vecs = np.asarray(self.embeddings.embed_documents(texts), dtype="float32")
+        self.dim = vecs.shape[1] if vecs.ndim == 2 else self.dim
+        return vecs
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = {
+                "uptime_s": round(time.time() - self.started, 1),
+                "clients": self.clients,
+                "connections": self.connections,
+                "requests": dict(self.requests),
+                "documents_encoded": self.documents,
+            }
+        out["query_batcher"] = self.batcher.stats()
+        return out
+
+    def _dispatch(self, op: str, payload: Any) -> Any:
+        if op == "hello":
+            return {"model": self.model_id, "normalize": self.normalize, "dim": self.dim}
+        if op == "query":
+            # 逐条提交给批合并器：不同客户端同时到达的查询会落进同一次前向计算
+            futs = [self.batcher.submit(t) for t in payload]
+            return np.asarray([f.result() for f in futs], dtype="float32")
+        if op == "documents":
+            vecs = self._encode(list(payload))
+            with self._lock:
+                self.documents += len(payload)
+            return vecs
+        if op == "stats":
+            return self.stats()
+        raise ValueError(f"未知操作：{op}")
+
+    def _serve_conn(self, conn: Connection) -> None:
+        with self._lock:
+            self.clients += 1
+            self.connections += 1
+        try:
+            while True:
+                try:
+                    op, payload = conn.recv()
+                except (EOFError, OSError):
+                    break
+                with self._lock:
+                    self.requests[op] += 1
+                try:
+                    conn.send(("ok", self._dispatch(op, payload)))
+                except Exception as e:  # 单个请求失败不断开连接
+                    conn.send(("error", f"{type(e).__name__}: {e}"))
+        finally:
+            conn.close()
+            with self._lock:
+                self.clients -= 1
+
+    def serve_forever(self, address: Address) -> None:
+        authkey = _authkey(create=True)
+        unix_socket = isinstance(address, str) and not address.startswith("\\\\")
+        if unix_socket:
+            if Path(address).parent == RUNTIME_DIR:
+                _private_dir(RUNTIME_DIR)
+            if os.path.exists(address):
+                os.unlink(address)  # 上次异常退出残留的 socket 文件
+        elif not isinstance(address, str):
+            print("⚠️ embedding 服务监听 TCP：能连上且持有密钥的一方可在本进程执行代码，只应在可信网络使用", file=sys.stderr)
+        old_umask = os.umask(0o177) if unix_socket else None  # socket 文件创建即为 0600
+        try:
+            listener = Listener(address, authkey=authkey)
+        finally:
+            if old_umask is not None:
+                os.umask(old_umask)
+        with listener:
+            print(f"✔ embedding 服务已启动：{listener.address}（模型 {self.model_id}）")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:  # 握手失败（密钥不对等）只影响该连接
+                    print(f"⚠️ 拒绝连接：{type(e).__name__}: {e}")
+                    continue
+                threading.Thread(target=self._serve_conn, args=(conn,), name="embed-conn", daemon=True).start()
+
+
+class RemoteEmbeddings(Embeddings):
+    """
+    共享 embedding 进程的瘦客户端；一个进程一条连接（加锁串行），
+    并发查询由外层 BatchedQueryEmbeddings 先在本进程合并成一个 query 请求。
+    断线时自动重连一次（embedding 服务重启后无需重启 agent）。
+    """
+
+    def __init__(self, address: Address, model_id: Optional[str] = None, normalize: Optional[bool] = None):
+        self.address = parse_address(address) if isinstance(address, str) else address
+        self._lock = threading.Lock()
+        self._conn: Optional[Connection] = None
+        with self._lock:
+            info = self._call("hello", None)
+        if model_id is not None and os.path.normpath(info["model"]) != os.path.normpath(model_id):
+            raise RuntimeError(f"embedding 服务加载的模型为 {info['model']}，本进程配置为 {model_id}")
+        if normalize is not None and bool(info["normalize"]) != bool(normalize):
+            raise RuntimeError(f"embedding 服务 normalize={info['normalize']}，本进程配置为 {normalize}")
+
+    def _call(self, op: str, payload: Any) -> Any:
+        for attempt in (0, 1):
+            try:
+                if self._conn is None:
+                    self._conn = Client(self.address, authkey=_authkey())
+                self._conn.send((op, payload))
+                status, result = self._conn.recv()
+                break
+            except (EOFError, OSError):
+                self._conn = None
+                if attempt:
+                    raise
+        if status != "ok":
+            raise RuntimeError(f"embedding 服务返回错误：{result}")
+        return result
+
+    def request(self, op: str, payload: Any = None) -> Any:
+        with self._lock:
+            return self._call(op, payload)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self.request("documents", list(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.request("query", [text])[0].tolist()
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self.request("query", list(texts)).tolist()
+
+    def stats(self) -> Dict[str, Any]:
+        return self.request("stats")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="共享 bge-m3 embedding 进程")
+    ap.add_argument("--address", default=os.getenv(EMBED_SERVER_ENV) or "default",
+                    help="default（RUNTIME_DIR 下的 Unix socket / 命名管道）、Unix socket 路径，或 host:port")
+    ap.add_argument("--max-batch", type=int, default=64, help="一次前向计算最多合并多少条查询")
+    ap.add_argument("--max-wait-ms", type=float, default=5.0, help="查询合并的收集窗口")
+    ap.add_argument("--stats", action="store_true", help="不启动服务，只打印运行中服务的统计")
+    args = ap.parse_args()
+
+    if args.stats:
+        print(json.dumps(RemoteEmbeddings(args.address).stats(), ensure_ascii=False, indent=2))
+        return
+
+    from utils import LOCAL_BGE_DIR, NORMALIZE_EMBEDDINGS, _local_embeddings
+
+    server = EmbedServer(
+        _local_embeddings(), str(LOCAL_BGE_DIR), NORMALIZE_EMBEDDINGS,
+        max_batch=args.max_batch, max_wait_ms=args.max_wait_ms,
+    )
+    server.serve_forever(parse_address(args.address))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,35 @@
-from langchain_ollama import ChatOllama
-from langchain_core.prompts import ChatPromptTemplate
-from langchain.agents import create_react_agent, AgentExecutor
-from tools.registry import init_all_tools
+import argparse
+from typing import TYPE_CHECKING, Any, List, Optional, Tuple
 
-def bootstrap_agent() -> AgentExecutor:
-    tools = init_all_tools()
-    llm = ChatOllama(model="llama3.1", temperature=0)
+from startup import PROFILE, DeferredTool, Warmup, phase
+
+with phase("import router / tracing"):
+    from router import FastPathRouter
+    from tracing import get_tracer, trace_config
+    from streaming import FinalAnswerStreamer, stream_config
+
+if TYPE_CHECKING:
+    from langchain.agents import AgentExecutor
+    from langchain_core.language_models import BaseChatModel
+    from langchain_core.tools import BaseTool
+
+def bootstrap_agent(
+    llm: Optional["BaseChatModel"] = None,
+    verbose: bool = True,
+    tools: Optional[List["BaseTool"]] = None,
+    lazy: bool = False,
+) -> "AgentExecutor":
+    # LangChain / 向量库相关模块都在这里才导入：只走快路由的轮次不需要它们
+    with phase("import langchain.agents"):
+        from langchain_core.prompts import ChatPromptTemplate
+        from langchain.agents import create_react_agent, AgentExecutor
+    with phase("import tools.registry（utils / faiss / CRC）"):
+        from tools.registry import init_all_tools
+    from LLM import get_llm
+
+    with phase("init_all_tools"):
+        tools = tools or init_all_tools(lazy=lazy)
+    llm = llm or get_llm(model="llama3.1", temperature=0)
 
     # ✅ 关键改动：去掉 {format_instructions}，改为“写死”的 ReAct 输出格式说明
     prompt = ChatPromptTemplate.from_messages([
@@ -32,23 +56,83 @@ def bootstrap_agent() -> AgentExecutor:
     ])
 
 
-    agent = create_react_agent(llm=llm, tools=tools, prompt=prompt)
+    with phase("create_react_agent"):
+        agent = create_react_agent(llm=llm, tools=tools, prompt=prompt)
 
     # ✅ 关键改动：给执行器开启解析容错，模型偶尔格式不严时自动重试
     executor = AgentExecutor(
         agent=agent,
         tools=tools,
-        verbose=True,
+        verbose=verbose,
         handle_parsing_errors=True
     )
     return executor
 
+def bootstrap_lazy(verbose: bool = True) -> Tuple[Warmup, List[Any]]:
+    """
+    快速启动：只在前台导入查库工具，Agent（LangChain）与 doc_qa（bge-m3 / FAISS / CRC）放到后台预热。
+    返回 (Agent 预热句柄, 快路由工具)；快路由中的 doc_qa 是占位工具，调用时才等待预热。
+    查库轮次（快路由或 Agent 调订单工具）都不会等 embedding 模型。
+    """
+    with phase("import tools.dbtools"):
+        from tools.dbtools import (
+            orders_get_by_id,
+            orders_search_by_phone,
+            orders_search_by_email,
+            orders_address_update,
+        )
+
+    agent = Warmup(lambda: bootstrap_agent(verbose=verbose, lazy=True), name="agent")
+    doc_qa = DeferredTool("doc_qa", lambda: next(t for t in agent.result().tools if t.name == "doc_qa"))
+    tools = [doc_qa, orders_get_by_id, orders_search_by_phone, orders_search_by_email, orders_address_update]
+    return agent, tools
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="智能客服 CLI")
+    ap.add_argument("--eager", action="store_true", help="启动时同步加载全部模型与向量库（旧行为）")
+    ap.add_argument("--startup-profile", action="store_true", help="退出时打印各阶段导入 / 初始化耗时")
+    ap.add_argument("--no-stream", action="store_true", help="关闭逐 token 输出，整段答复生成完再打印")
+    ap.add_argument("--user-id", default=None, help="当前登录用户 id；改地址只作用于该用户的订单，未提供时拒绝修改")
+    return ap.parse_args()
+
+
 if __name__ == "__main__":
-    executor = bootstrap_agent()
+    args = parse_args()
+    # 设置 QA_AGENT_TRACE 后用逐轮 trace（JSONL + Prometheus 指标）代替 verbose 输出；流式输出时也不打印 verbose 日志
+    tracer = get_tracer()
+    verbose = tracer is None and args.no_stream
+    if args.eager:
+        executor = bootstrap_agent(verbose=verbose)
+        agent, router_tools = None, executor.tools
+    else:
+        agent, router_tools = bootstrap_lazy(verbose=verbose)
+    # 意图明确的查单轮次直接调工具，不经过 LLM
+    router = FastPathRouter.from_tools(router_tools)
+    from tools.dbtools import user_context
+    PROFILE.mark("首个提示符")
     print("🤖 智能客服已启动（输入 '退出' 结束）\n")
     while True:
         q = input("用户：")
         if q.strip().lower() in ["退出", "exit", "quit"]:
             break
-        resp = executor.invoke({"input": q})
-        print("助理：", resp["output"], "\n")
+        streamer = None
+        if not args.no_stream:
+            print("助理：", end=" ", flush=True)
+            streamer = FinalAnswerStreamer(lambda t: print(t, end="", flush=True), tracer=tracer)
+        with user_context(args.user_id):
+            answer = router.handle(q, config=stream_config(streamer))
+            if answer is None:
+                if agent is not None:
+                    executor = agent.result()
+                config = stream_config(streamer, trace_config(tracer, session_id="cli"), agent=True)
+                answer = executor.invoke({"input": q}, config=config)["output"]
+        if streamer is None:
+            print("助理：", answer, "\n")
+        elif streamer.streamed:
+            print("\n")
+        else:
+            print(answer, "\n")  # 快路由查库 / 模型不支持流式：整段输出
+    print(router.stats.report())
+    if args.startup_profile:
+        print(PROFILE.report())
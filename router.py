@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# router.py
+"""
+Agent 之前的规则快路由：识别订单号 / 手机号 / 邮箱 + 关键词意图，
+意图明确时直接调用 tools/dbtools.py 中的工具，用 utterances.md 的话术模板（tools/templates.py）渲染答复，
+跳过 ReAct 的 LLM 往返；
+纯规则类问题（rules.*，不涉及具体订单）直接带场景 id 调 doc_qa，跳过 agent 与向量检索；
+拿不准的轮次返回 None，交给 AgentExecutor 处理。
+意图表的 key 与 flows.md / utterances.md 中的场景 id 保持一致。
+"""
+
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional
+
+from tools.templates import get_templates, order_values
+
+# 前后不能紧跟字母/数字；中文与 OD 相邻时 \b 不生效，所以用环视
+ORDER_ID_RE = re.compile(r"(?<![A-Za-z0-9])OD\d{10}(?!\d)", re.IGNORECASE)
+PHONE_RE = re.compile(r"(?<!\d)1[3-9]\d{9}(?!\d)")
+EMAIL_RE = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}")
+
+# 场景 id → 触发关键词（取自 flows.md 各节的“触发意图”）
+INTENTS: Dict[str, List[str]] = {
+    "orders.status_query": ["查订单", "查一下", "查询", "物流", "到哪", "单号", "状态", "快递", "进度", "发货了吗"],
+    "orders.address_update": ["改地址", "修改地址", "地址改", "换地址", "收货地址", "改派"],
+    "orders.return_request": ["退货", "退款", "退回", "RMA"],
+    "rules.return_policy": ["退换货", "无理由", "退货政策", "退换政策"],
+    "rules.shipping_sla": ["多久", "时效", "几天", "什么时候到", "出库"],
+    "rules.payment_methods": ["支付", "付款", "分期", "信用卡"],
+    "aftersales.complaint": ["投诉", "差评", "举报"],
+    "aftersales.invoice": ["发票", "开票", "抬头", "税号"],
+    "aftersales.oos_handling": ["缺货", "补货", "没货", "超卖"],
+}
+
+# 只有这些意图（或没有任何意图词）时才允许直接查库
+_LOOKUP_INTENTS = {"orders.status_query"}
+# 只需查文档、与具体订单无关的场景：唯一命中、句中没有订单号/手机号/邮箱，
+# 且问法是在问规则本身（而不是描述自己遇到的问题）时，直接按场景 id 调 doc_qa
+_DOC_INTENT_PREFIX = "rules."
+_POLICY_QUESTION_RE = re.compile(r"哪些|什么|怎么样|如何|政策|规则|规定|流程|多久|几天|多少天|支持|可以|能否|能不能")
+# “付款失败了怎么办”“信用卡被扣了两次”等是具体问题，固定的规则话术答不了，交给 Agent
+_INCIDENT_RE = re.compile(r"我的|我已|我刚|被|失败|没(有)?(更新|到账|收到|发货)|扣了|扣款|两次|重复|异常|报错|不了|怎么办")
+
+# 一次 ReAct 查单至少两次 LLM 调用：决定调工具 + 给出 Final Answer
+LLM_CALLS_PER_AGENT_TURN = 2
+
+
+@dataclass
+class Route:
+    tool: str
+    args: Dict[str, Any]
+    scenario_id: str = "orders.status_query"
+
+
+@dataclass
+class RouterStats:
+    turns: int = 0
+    short_circuited: int = 0
+    by_tool: Counter = field(default_factory=Counter)
+
+    @property
+    def llm_calls_saved(self) -> int:
+        return self.short_circuited * LLM_CALLS_PER_AGENT_TURN
+
+    def report(self) -> str:
+        ratio = self.short_circuited / self.turns if self.turns else 0.0
+        detail = "，".join(f"{k}={v}" for k, v in self.by_tool.most_common()) or "无"
+        return (
+            f"快路由：{self.short_circuited}/{self.turns} 轮直接命中（{ratio:.0%}），"
+            f"约节省 {self.llm_calls_saved} 次 LLM 调用；按工具：{detail}"
+        )
+
+
+def detect_intents(text: str) -> List[str]:
+    return [sid for sid, kws in INTENTS.items() if any(k.lower() in text.lower() for k in kws)]
+
+
+def is_policy_question(text: str) -> bool:
+    return bool(_POLICY_QUESTION_RE.search(text)) and not _INCIDENT_RE.search(text)
+
+
+def route(text: str) -> Optional[Route]:
+    """纯规则判定；返回 None 表示需要交给 Agent。"""
+    order_ids = {m.upper() for m in ORDER_ID_RE.findall(text)}
+    phones = set(PHONE_RE.findall(text))
+    emails = set(EMAIL_RE.findall(text))
+    intents = set(detect_intents(text))
+
+    if len(intents) == 1 and not (order_ids or phones or emails):
+        sid = next(iter(intents))
+        if sid.startswith(_DOC_INTENT_PREFIX) and is_policy_question(text):
+            return Route("doc_qa", {"question": text, "scenario_id": sid}, scenario_id=sid)
+
+    if not intents <= _LOOKUP_INTENTS:
+        return None  # 改地址、退货、投诉等需要多步推理或确认
+
+    if len(order_ids) == 1:
+        return Route("orders.get_by_id", {"order_id": order_ids.pop()})
+    if order_ids:
+        return None
+    if len(phones) == 1 and not emails:
+        return Route("orders.search_by_phone", {"phone": phones.pop()})
+    if len(emails) == 1 and not phones:
+        return Route("orders.search_by_email", {"email": emails.pop()})
+    return None
+
+
+def format_reply(r: Route, result: Dict[str, Any]) -> Optional[str]:
+    """返回 None 表示工具没给出可用结果，交给 Agent。"""
+    if r.tool == "doc_qa":
+        return result.get("answer") or None
+
+    if r.tool == "orders.get_by_id":
+        if not result.get("found"):
+            return f"没有查到订单 {r.args['order_id']}，请核对订单号，或提供下单手机号/邮箱。"
+        return get_templates().render(r.scenario_id, order_values(result["data"]))
+
+    items = result.get("items") or []
+    if not items:
+        return "没有查到与该联系方式关联的订单，请核对后重试，或直接提供订单号。"
+    head = f"查到 {len(items)} 笔相关订单（按下单时间倒序）："
+    body = "\n".join(
+        f"{i}. {o['order_id']} | {o.get('status')} | {o.get('item')} | {o.get('created_at')}"
+        for i, o in enumerate(items, start=1)
+    )
+    return f"{head}\n{body}\n请告诉我您要查询的是哪一笔。"
+
+
+class FastPathRouter:
+    """持有工具句柄 + 计数器；handle() 命中则返回答复文本，否则返回 None。"""
+
+    def __init__(self, tools: Dict[str, Any]):
+        self.tools = tools
+        self.stats = RouterStats()
+        get_templates()  # 启动时就解析模板，文档格式有问题尽早暴露
+
+    @classmethod
+    def from_tools(cls, tools: Iterable[Any]) -> "FastPathRouter":
+        return cls({t.name: t for t in tools})
+
+    def handle(self, text: str, config: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """config 原样传给工具的 invoke（如 streaming.stream_config：doc_qa 路由的答复可以边生成边输出）。"""
+        self.stats.turns += 1
+        r = route(text)
+        if r is None or r.tool not in self.tools:
+            return None
+        try:
+            result = self.tools[r.tool].invoke(r.args, config=config)
+        except Exception:
+            return None  # 参数校验失败等，交给 Agent 兜底
+        reply = format_reply(r, result)
+        if reply is None:
+            return None
+        self.stats.short_circuited += 1
+        self.stats.by_tool[r.tool] += 1
+        return reply
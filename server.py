@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+# server.py
+"""
+asyncio 多会话服务入口（替代 main.py 的 input() 循环）。
+协议：JSONL，一行一个请求 {"session_id": "...", "input": "...", "id": 可选}，
+      一行一个响应 {"id", "session_id", "output", "routed", "latency_ms"}。
+      请求带 "stream": true 时，先逐条发送 {"id", "session_id", "token"}，最后一行为完整响应（另含 ttft_ms）。
+      "user_id"（可选）为前端鉴权后的当前用户，本轮的修改类工具只作用于该用户的订单；未提供时拒绝修改。
+- stdio：从 stdin 读请求、向 stdout 写响应
+- tcp：本地 TCP 端口，每个连接上可以并发发送多条请求
+并发模型：
+- 同一 session 内按到达顺序串行（asyncio.Lock），不同 session 并发
+- 整轮 agent 调用受全局信号量限制（ReAct 一轮内 LLM 调用是串行的，所以等价于限制 Ollama 并发）
+- 快路由的 sqlite 查询、agent 中的同步工具（sqlite / FAISS）都在线程池中执行
+- 默认快速启动（main.bootstrap_lazy）：Agent 与向量库后台预热，期间查库轮次照常处理
+压测：
+    python server.py --stub-llm 0.2 --load-test 200 --sessions 50
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from LLM import STUB_LLM_ENV
+from startup import PROFILE, Warmup
+from streaming import FinalAnswerStreamer, stream_config
+from tracing import get_tracer, trace_config
+
+
+class AgentServer:
+    def __init__(self, executor, router=None, max_concurrency: int = 4):
+        # executor 也可以是 startup.Warmup（后台预热中的 AgentExecutor）
+        self.executor = executor
+        self.router = router
+        self.tracer = get_tracer()
+        self._llm_slots = asyncio.Semaphore(max_concurrency)
+        # 没有请求持有/等待时锁会被回收，空闲会话不占内存
+        self._session_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self.completed = 0
+        self.routed = 0
+
+    def _lock_for(self, session_id: str) -> asyncio.Lock:
+        lock = self._session_locks.get(session_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._session_locks[session_id] = lock
+        return lock
+
+    async def _agent(self):
+        if isinstance(self.executor, Warmup):
+            return await asyncio.wrap_future(self.executor.future)
+        return self.executor
+
+    async def handle(
+        self,
+        session_id: str,
+        text: str,
+        on_token: Optional[Callable[[str], None]] = None,
+        user_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """on_token 不为空时逐 token 回调最终答复（可能在工作线程中调用）。"""
+        from tools.dbtools import user_context
+        from tools.rag_docqa.memory_pool import session_context
+
+        t0 = time.perf_counter()
+        routed = False
+        streamer = FinalAnswerStreamer(on_token, tracer=self.tracer) if on_token is not None else None
+        async with self._lock_for(session_id):
+            with session_context(session_id), user_context(user_id):
+                answer = None
+                if self.router is not None:
+                    answer = await asyncio.to_thread(self.router.handle, text, stream_config(streamer))
+                    routed = answer is not None
+                if answer is None:
+                    executor = await self._agent()
+                    config = stream_config(streamer, trace_config(self.tracer, session_id=session_id), agent=True)
+                    async with self._llm_slots:
+                        resp = await executor.ainvoke({"input": text}, config=config)
+                    answer = resp["output"]
+        self.completed += 1
+        self.routed += int(routed)
+        out = {
+            "session_id": session_id,
+            "output": answer,
+            "routed": routed,
+            "latency_ms": round((time.perf_counter() - t0) * 1000, 2),
+        }
+        if streamer is not None and streamer.ttft_s is not None:
+            out["ttft_ms"] = round(streamer.ttft_s * 1000, 2)
+        return out
+
+    @staticmethod
+    async def _pump(tokens: "asyncio.Queue", send, head: Dict[str, Any]) -> None:
+        while True:
+            t = await tokens.get()
+            if t is None:
+                break
+            await send({**head, "token": t})
+
+    async def handle_line(
+        self, line: str, send: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """send 用于发送 token 消息；完整响应由调用方写出。"""
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            req = json.loads(line)
+            if not isinstance(req, dict):
+                raise TypeError(f"应为 JSON 对象，收到 {type(req).__name__}")
+            session_id = str(req.get("session_id") or "default")
+            text = str(req["input"])
+            user_id = str(req["user_id"]) if req.get("user_id") else None
+        except (ValueError, KeyError, TypeError) as e:
+            return {"error": f"请求格式错误：{e}"}
+        head = {"id": req["id"], "session_id": session_id} if "id" in req else {"session_id": session_id}
+        on_token, tokens, pump = None, None, None
+        if req.get("stream") and send is not None:
+            # 回调可能来自线程池（同步工具里的 doc_qa），统一投递回事件循环，按顺序发送
+            loop = asyncio.get_running_loop()
+            tokens = asyncio.Queue()
+            on_token = lambda t: loop.call_soon_threadsafe(tokens.put_nowait, t)  # noqa: E731
+            pump = asyncio.create_task(self._pump(tokens, send, head))
+        try:
+            resp = await self.handle(session_id, text, on_token=on_token, user_id=user_id)
+        except Exception as e:  # 单个请求失败不影响其他会话
+            resp = {"session_id": session_id, "error": f"{type(e).__name__}: {e}"}
+        if pump is not None:
+            tokens.put_nowait(None)
+            await pump
+        if "id" in req:
+            resp["id"] = req["id"]
+        return resp
+
+
+async def serve_stdio(server: AgentServer) -> None:
+    loop = asyncio.get_running_loop()
+    out_lock = asyncio.Lock()
+    pending = set()
+
+    async def send(msg: Dict[str, Any]) -> None:
+        async with out_lock:
+            sys.stdout.write(json.dumps(msg, ensure_ascii=False) + "\n")
+            sys.stdout.flush()
+
+    async def one(line: str) -> None:
+        resp = await server.handle_line(line, send)
+        if resp is not None:
+            await send(resp)
+
+    while True:
+        # Windows 上没有 connect_read_pipe，统一用线程读 stdin
+        line = await loop.run_in_executor(None, sys.stdin.readline)
+        if not line:
+            break
+        task = asyncio.create_task(one(line))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    if pending:
+        await asyncio.gather(*pending)
+
+
+async def serve_tcp(server: AgentServer, host: str, port: int) -> None:
+    async def on_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        out_lock = asyncio.Lock()
+        pending = set()
+
+        async def send(msg: Dict[str, Any]) -> None:
+            async with out_lock:
+                writer.write((json.dumps(msg, ensure_ascii=False) + "\n").encode("utf-8"))
+                await writer.drain()
+
+        async def one(line: str) -> None:
+            resp = await server.handle_line(line, send)
+            if resp is not None:
+                await send(resp)
+
+        while True:
+            raw = await reader.readline()
+            if not raw:
+                break
+            task = asyncio.create_task(one(raw.decode("utf-8")))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.gather(*pending)
+        writer.close()
+
+    srv = await asyncio.start_server(on_client, host, port)
+    print(f"✔ 服务已启动：tcp://{host}:{port}（JSONL）", file=sys.stderr)
+    async with srv:
+        await srv.serve_forever()
+
+
+async def load_test(server: AgentServer, turns: int, sessions: int) -> Dict[str, Any]:
+    """用内置请求模拟 sessions 个并发会话共 turns 轮，返回吞吐、延迟与流式首 token 时延。"""
+    questions = ["查一下 OD2408150001", "退货政策是什么？", "发票怎么开？", "物流一般几天到？"]
+
+    t0 = time.perf_counter()
+    results = await asyncio.gather(
+        *(server.handle(f"s{i % sessions}", questions[i % len(questions)], on_token=lambda t: None)
+          for i in range(turns))
+    )
+    elapsed = time.perf_counter() - t0
+    lat = sorted(r["latency_ms"] for r in results)
+    ttft = sorted(r["ttft_ms"] for r in results if "ttft_ms" in r)
+    return {
+        "turns": turns,
+        "sessions": sessions,
+        "elapsed_s": round(elapsed, 3),
+        "turns_per_s": round(turns / elapsed, 2) if elapsed else None,
+        "p50_ms": lat[len(lat) // 2],
+        "p95_ms": lat[min(len(lat) - 1, int(len(lat) * 0.95))],
+        "ttft_p50_ms": ttft[len(ttft) // 2] if ttft else None,
+        "routed": server.routed,
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="QA Agent 异步多会话服务")
+    ap.add_argument("--mode", choices=["stdio", "tcp"], default="stdio")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--max-concurrency", type=int, default=4, help="同时进行中的 agent 轮次（≈ Ollama 并发）上限")
+    ap.add_argument("--workers", type=int, default=16, help="sqlite / FAISS 等阻塞调用的线程池大小")
+    ap.add_argument("--no-router", action="store_true", help="关闭规则快路由，所有轮次走 agent")
+    ap.add_argument("--stub-llm", type=float, default=None, metavar="DELAY", help="使用本地桩 LLM（每次调用延迟秒数）")
+    ap.add_argument("--load-test", type=int, default=0, metavar="TURNS", help="不监听输入，直接压测 TURNS 轮")
+    ap.add_argument("--sessions", type=int, default=20, help="压测时的并发会话数")
+    ap.add_argument("--eager", action="store_true", help="启动时同步加载全部模型与向量库（压测时总是如此）")
+    ap.add_argument("--startup-profile", action="store_true", help="退出时向 stderr 打印各阶段导入 / 初始化耗时")
+    args = ap.parse_args()
+
+    if args.stub_llm is not None:
+        os.environ[STUB_LLM_ENV] = str(args.stub_llm)
+
+    from main import bootstrap_agent, bootstrap_lazy
+    from router import FastPathRouter
+
+    if args.eager or args.load_test:
+        # 压测要测的是稳态吞吐，预热时间不计入
+        executor = bootstrap_agent(verbose=False)
+        router_tools = executor.tools
+    else:
+        executor, router_tools = bootstrap_lazy(verbose=False)
+    router = None if args.no_router else FastPathRouter.from_tools(router_tools)
+    PROFILE.mark("开始接收请求")
+
+    async def run() -> None:
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="qa-io")
+        )
+        server = AgentServer(executor, router=router, max_concurrency=args.max_concurrency)
+        if args.load_test:
+            print(json.dumps(await load_test(server, args.load_test, args.sessions), ensure_ascii=False))
+        elif args.mode == "tcp":
+            await serve_tcp(server, args.host, args.port)
+        else:
+            await serve_stdio(server)
+
+    asyncio.run(run())
+    if router is not None:
+        print(router.stats.report(), file=sys.stderr)
+    if args.startup_profile:
+        print(PROFILE.report(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# startup.py
+"""
+启动加速：后台预热 + 启动耗时剖析。
+- Warmup：在守护线程里执行重初始化（导入 LangChain、加载 bge-m3 / FAISS、构建 CRC），
+  前台立即开始接收输入；首个真正需要它的调用才会 result() 等待
+- DeferredTool：工具占位，name 立即可用，invoke 时才等待后台构建出的真实工具
+  （快路由据此在预热期间照常处理查库轮次，只有 doc_qa 路由会等）
+- phase()：记录各阶段耗时（导入 / 初始化 / 等待预热），`--startup-profile` 时打印 report()
+"""
+
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# 时间起点：本模块首次被导入（main.py / server.py 最先导入它）
+T0 = time.perf_counter()
+
+
+class StartupProfile:
+    """线程安全的阶段耗时记录；phase 可嵌套、可在任意线程中调用。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.phases: List[Dict[str, Any]] = []
+        self.marks: Dict[str, float] = {}
+        self.pending: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.phases.append({
+                    "name": name,
+                    "thread": threading.current_thread().name,
+                    "start_ms": (t - T0) * 1000,
+                    "ms": (end - t) * 1000,
+                })
+
+    def mark(self, name: str) -> None:
+        """记录一个时间点（如“首个提示符出现”）。"""
+        with self._lock:
+            self.marks.setdefault(name, (time.perf_counter() - T0) * 1000)
+
+    def report(self) -> str:
+        with self._lock:
+            phases = sorted(self.phases, key=lambda p: p["start_ms"])
+            marks = dict(self.marks)
+            pending = dict(self.pending)
+        lines = ["—— 启动剖析（相对进程启动，单位 ms）——", f"{'开始':>8} {'耗时':>9}  {'线程':<16} 阶段"]
+        for p in phases:
+            lines.append(f"{p['start_ms']:>8.0f} {p['ms']:>9.1f}  {p['thread']:<16} {p['name']}")
+        for name, at in sorted(marks.items(), key=lambda kv: kv[1]):
+            lines.append(f"{at:>8.0f} {'':>9}  {'':<16} ▶ {name}")
+        for name, since in pending.items():
+            lines.append(f"{since:>8.0f} {'…':>9}  {'warmup-' + name:<16} 预热未完成")
+        return "\n".join(lines)
+
+
+PROFILE = StartupProfile()
+
+
+def phase(name: str):
+    return PROFILE.phase(name)
+
+
+class Warmup:
+    """在守护线程里执行 fn；result() 等待完成并返回结果（失败时重新抛出 fn 的异常）。"""
+
+    def __init__(self, fn: Callable[[], Any], name: str):
+        self.name = name
+        self.future: Future = Future()
+        PROFILE.pending[name] = (time.perf_counter() - T0) * 1000
+        self._thread = threading.Thread(target=self._run, args=(fn,), name=f"warmup-{name}", daemon=True)
+        self._thread.start()
+
+    def _run(self, fn: Callable[[], Any]) -> None:
+        try:
+            with phase(f"预热 {self.name}（合计）"):
+                result = fn()
+        except BaseException as e:  # 异常留给 result() 的调用方；这里先提示，免得预热失败到首次调用才发现
+            print(f"⚠️ 预热 {self.name} 失败：{type(e).__name__}: {e}", file=sys.stderr)
+            self.future.set_exception(e)
+        else:
+            self.future.set_result(result)
+        finally:
+            PROFILE.pending.pop(self.name, None)
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self, timeout: Optional[float] = None) -> Any:
+        if self.future.done():
+            return self.future.result()
+        with phase(f"等待预热 {self.name}"):
+            return self.future.result(timeout)
+
+
+class DeferredTool:
+    """工具占位：快路由只用到 name 与 invoke()；invoke 时才解析出真实工具。"""
+
+    def __init__(self, name: str, resolve: Callable[[], Any]):
+        self.name = name
+        self._resolve = resolve
+
+    def invoke(self, args: Any, **kwargs: Any) -> Any:
+        return self._resolve().invoke(args, **kwargs)
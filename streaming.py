@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# streaming.py
+"""
+逐 token 输出最终答复（ChatOllama 在 _generate 内部就是流式的，每个 chunk 都会触发 on_llm_new_token）。
+- agent 轮次：只转发 "Final Answer:" 之后的 token，Thought / Action / Action Input 等 ReAct 脚手架不展示
+- 快路由直接调 doc_qa 时答复就是 CRC 的生成结果：转发带 ANSWER_TAG 的 LLM run
+  （crc_chain 给生成答复那一步的 LLM 打了该标签；问题改写步骤不带标签，不会被输出）；
+  agent 内部调 doc_qa 时它的答复只是 Observation，agent 轮次的 config 带 AGENT_TAG 以示区分
+- 首 token 时延（TTFT）记在 streamer.ttft_s 上，开启追踪时同时计入 Tracer 的直方图（kind="stream", name="ttft"）
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+FINAL_ANSWER_MARKER = "Final Answer:"
+# 打在“生成面向用户答复”那一步的 LLM 上；带该标签的 token 原样转发
+ANSWER_TAG = "final_answer"
+# 由 stream_config(..., agent=True) 加到 agent 轮次的 config 上（config 中的 tags 会传给所有子 run）
+AGENT_TAG = "react_agent"
+
+
+class FinalAnswerStreamer(BaseCallbackHandler):
+    """一轮对话一个实例；sink 可能在工作线程中被调用，需自行保证线程安全。"""
+
+    run_inline = True
+
+    def __init__(self, sink: Callable[[str], None], tracer: Optional[Any] = None, marker: str = FINAL_ANSWER_MARKER):
+        self.sink = sink
+        self.tracer = tracer
+        self.marker = marker
+        self.t0 = time.perf_counter()
+        self.ttft_s: Optional[float] = None
+        self.text = ""
+        self._lock = threading.Lock()
+        self._pending: Dict[str, str] = {}  # run_id → 还没出现 marker 的输出
+        self._open: set = set()  # 已越过 marker 的 run
+
+    @property
+    def streamed(self) -> bool:
+        return bool(self.text)
+
+    def _emit(self, token: str) -> None:
+        if not self.text:
+            token = token.lstrip()  # "Final Answer: xxx" 冒号后的空白
+            if not token:
+                return
+            self.ttft_s = time.perf_counter() - self.t0
+            if self.tracer is not None:
+                self.tracer.observe("stream", "ttft", self.ttft_s)
+        self.text += token
+        self.sink(token)
+
+    def on_llm_new_token(self, token: str, *, run_id, tags: Optional[List[str]] = None, **kwargs: Any) -> None:
+        rid = str(run_id)
+        with self._lock:
+            tags = tags or ()
+            if rid in self._open or (ANSWER_TAG in tags and AGENT_TAG not in tags):
+                self._emit(token)
+                return
+            # marker 可能被切在两个 token 之间，先攒着
+            buf = self._pending.get(rid, "") + token
+            i = buf.find(self.marker)
+            if i < 0:
+                self._pending[rid] = buf
+                return
+            self._pending.pop(rid, None)
+            self._open.add(rid)
+            self._emit(buf[i + len(self.marker):])
+
+    def on_llm_end(self, response, *, run_id, **kwargs: Any) -> None:
+        with self._lock:
+            self._pending.pop(str(run_id), None)
+
+
+def stream_config(
+    streamer: Optional[FinalAnswerStreamer], config: Optional[Dict[str, Any]] = None, agent: bool = False
+) -> Dict[str, Any]:
+    """把 streamer 追加到 invoke/ainvoke 的 config（如 tracing.trace_config 的返回值）上；agent 轮次传 agent=True。"""
+    config = dict(config or {})
+    if streamer is not None:
+        config["callbacks"] = list(config.get("callbacks") or []) + [streamer]
+        if agent:
+            config["tags"] = list(config.get("tags") or []) + [AGENT_TAG]
+    return config
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# tests/test_answer_cache.py
+"""场景 id 计入答案缓存键：同一问题在不同场景 / 无场景之间互不命中。"""
+
+from tools.rag_docqa.answer_cache import SemanticAnswerCache
+
+QUESTION = "退货政策是什么？"
+
+
+def _cache(tmp_path):
+    # 所有问题同一个向量：只要哈希相同就一定语义命中，隔离只能来自缓存键
+    return SemanticAnswerCache(lambda q: [1.0, 0.0, 0.0], tmp_path / "answer_cache.json", "fp", save_every=10**6)
+
+
+def test_scenario_ids_do_not_share_answers(tmp_path):
+    cache = _cache(tmp_path)
+    cache.store(QUESTION, None, "七天无理由", [], scenario_id="rules.return_policy")
+
+    assert cache.lookup(QUESTION, scenario_id="rules.shipping_sla") is None
+    assert cache.lookup(QUESTION, scenario_id="rules.return_policy")["answer"] == "七天无理由"
+
+
+def test_scenario_and_retrieval_answers_do_not_mix(tmp_path):
+    cache = _cache(tmp_path)
+    cache.store(QUESTION, None, "检索答案", [])
+    cache.store("发货要多久？", None, "场景答案", [], scenario_id="rules.shipping_sla")
+
+    assert cache.lookup(QUESTION, scenario_id="rules.return_policy") is None
+    assert cache.lookup("发货要多久？")["answer"] == "检索答案"  # 只命中检索路径的条目
+
+
+def test_scenario_lookup_does_not_embed(tmp_path):
+    calls = []
+    cache = SemanticAnswerCache(
+        lambda q: calls.append(q) or [1.0, 0.0], tmp_path / "answer_cache.json", "fp", save_every=10**6
+    )
+    cache.store(QUESTION, None, "七天无理由", [], scenario_id="rules.return_policy")
+    calls.clear()
+
+    assert cache.lookup(QUESTION, scenario_id="rules.return_policy") is not None
+    assert calls == []
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+# tools/audit.py
+"""
+订单修改的审计日志（write-behind）与幂等键缓存（flows.md：审计与幂等）。
+- 写路径只把审计记录放进有界队列；后台线程在收集窗口内攒批，一个事务写入 order_audit（组提交）。
+  审计连接用 synchronous=FULL：每批一次 fsync，摊到每条记录上远低于同步逐条插入
+- 队列满时 record() 阻塞等待（背压），不丢记录；写库失败的批次追加到 FALLBACK_PATH（JSONL），事后可补录
+- 进程退出时（atexit）先写完队列再关闭；stats() 给出队列深度、批大小与落盘耗时，开启追踪时计入 Tracer 直方图
+- IdempotencyCache：幂等键 → 上次成功的结果（带 TTL）；agent 解析失败重试等重复指令直接返回缓存结果，不访问数据库
+"""
+
+import atexit
+import hashlib
+import json
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from tracing import get_tracer
+
+from .db_migrations import migrate
+
+FALLBACK_PATH = Path("SQLite/order_audit.fallback.jsonl")
+
+_COLUMNS = ("ts", "actor", "action", "order_id", "idempotency_key", "before_sha256", "after_sha256", "detail")
+_SQL_INSERT = f"INSERT INTO order_audit ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})"
+
+_STOP = object()
+
+
+def row_hash(row: Optional[Mapping[str, Any]]) -> Optional[str]:
+    """整行的 sha256（键排序后的 JSON）；行不存在时为 None。"""
+    if row is None:
+        return None
+    text = json.dumps(dict(row), sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def idempotency_key(order_id: str, action: str, payload: Any = None) -> str:
+    """order_id + action（flows.md 的约定）再带上参数摘要：同一订单先后改成不同地址是两条不同的指令。"""
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+    return f"{order_id}:{action}:{digest.hexdigest()[:16]}"
+
+
+@dataclass
+class AuditStats:
+    enqueued: int = 0
+    written: int = 0
+    spilled: int = 0  # 写库失败、转存到 FALLBACK_PATH 的记录
+    batches: int = 0
+    max_batch: int = 0
+    blocked: int = 0  # 入队时队列已满、需要等待的次数
+    flush_s_total: float = 0.0
+    flush_s_max: float = 0.0
+    queue_depth: int = 0
+
+    @property
+    def mean_flush_ms(self) -> float:
+        return self.flush_s_total / self.batches * 1000 if self.batches else 0.0
+
+    def report(self) -> str:
+        mean_batch = self.written / self.batches if self.batches else 0.0
+        return (
+            f"审计日志：入队 {self.enqueued}，落库 {self.written}（{self.batches} 批，平均 {mean_batch:.1f} 条/批，"
+            f"最大 {self.max_batch}），转存 {self.spilled}；队列深度 {self.queue_depth}，队列满等待 {self.blocked} 次；"
+            f"落盘耗时 平均 {self.mean_flush_ms:.2f}ms / 最大 {self.flush_s_max * 1000:.2f}ms"
+        )
+
+
+class AuditLog:
+    def __init__(
+        self,
+        db_path: str,
+        max_queue: int = 1024,
+        max_batch: int = 256,
+        max_wait_ms: float = 20.0,
+        fallback_path: Path = FALLBACK_PATH,
+    ):
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.fallback_path = Path(fallback_path)
+        self._q: "queue.Queue[Any]" = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._stats = AuditStats()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._worker.start()
+        atexit.register(self.close)  # 晚于 dbtools.close_all 注册，先于它执行
+
+    # -------------------- 写路径 --------------------
+    def record(
+        self,
+        action: str,
+        order_id: str,
+        before: Optional[Mapping[str, Any]],
+        after: Optional[Mapping[str, Any]],
+        actor: Optional[str] = None,
+        idempotency_key: Optional[str] = None,
+        **detail: Any,
+    ) -> None:
+        """只做哈希与入队；before / after 为变更前后的整行。"""
+        item = (
+            datetime.now().isoformat(timespec="milliseconds"),
+            actor,
+            action,
+            order_id,
+            idempotency_key,
+            row_hash(before),
+            row_hash(after),
+            json.dumps(detail, ensure_ascii=False, default=str) if detail else None,
+        )
+        if self._closed:  # 退出阶段还在写：直接同步落库
+            con = self._write(None, [item])
+            if con is not None:
+                con.close()
+            return
+        try:
+            self._q.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self._stats.blocked += 1
+            self._q.put(item)
+        with self._lock:
+            self._stats.enqueued += 1
+
+    def flush(self) -> None:
+        """阻塞到此前入队的记录全部落库（或转存）。"""
+        self._q.join()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._q.put(_STOP)
+        self._worker.join()
+
+    def stats(self) -> AuditStats:
+        with self._lock:
+            s = AuditStats(**asdict(self._stats))
+        s.queue_depth = self._q.qsize()
+        return s
+
+    # -------------------- 后台写线程 --------------------
+    def _open(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.db_path, timeout=30)
+        con.execute("PRAGMA journal_mode=WAL;")
+        con.execute("PRAGMA synchronous=FULL;")  # 组提交：每批一次 fsync
+        migrate(con)
+        return con
+
+    def _collect(self) -> List[Any]:
+        batch = [self._q.get()]  # 阻塞等第一条
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch and batch[-1] is not _STOP:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._q.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _spill(self, rows: List[Tuple]) -> None:
+        self.fallback_path.parent.mkdir(parents=True, exist_ok=True)
+        with self.fallback_path.open("a", encoding="utf-8") as f:
+            for r in rows:
+                f.write(json.dumps(dict(zip(_COLUMNS, r)), ensure_ascii=False) + "\n")
+            f.flush()
+
+    def _write(self, con: Optional[sqlite3.Connection], rows: List[Tuple]) -> Optional[sqlite3.Connection]:
+        t0 = time.perf_counter()
+        try:
+            if con is None:
+                con = self._open()
+            with con:
+                con.executemany(_SQL_INSERT, rows)
+            spilled = 0
+        except sqlite3.Error as e:
+            print(f"⚠️ 审计日志写库失败，{len(rows)} 条转存到 {self.fallback_path}：{e}", file=sys.stderr)
+            self._spill(rows)
+            spilled = len(rows)
+            if con is not None:
+                con.close()
+            con = None  # 下一批重新建连
+        dt = time.perf_counter() - t0
+
+        with self._lock:
+            s = self._stats
+            s.batches += 1
+            s.written += len(rows) - spilled
+            s.spilled += spilled
+            s.max_batch = max(s.max_batch, len(rows))
+            s.flush_s_total += dt
+            s.flush_s_max = max(s.flush_s_max, dt)
+        tracer = get_tracer()
+        if tracer is not None:
+            tracer.observe("db", "audit_flush", dt)
+        return con
+
+    def _run(self) -> None:
+        con: Optional[sqlite3.Connection] = None
+        while True:
+            batch = self._collect()
+            rows = [x for x in batch if x is not _STOP]
+            if rows:
+                con = self._write(con, rows)
+            for _ in batch:
+                self._q.task_done()
+            if len(rows) < len(batch):
+                break
+        if con is not None:
+            con.close()
+
+
+class IdempotencyCache:
+    """
+    幂等键 → 上次成功的结果；只缓存成功的修改，失败的指令重试时照常执行。
+    同一订单只保留最近一条指令的键：A → B → A 的第二次 A 是新的修改，不能被当成重复指令。
+    """
+
+    def __init__(self, ttl_s: float = 600.0, max_entries: int = 10000):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[str, Tuple[float, str, Dict[str, Any]]]" = OrderedDict()
+        self._latest: Dict[str, str] = {}  # order_id → 最近一条指令的键
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    self._pop(key)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key: str, order_id: str, result: Dict[str, Any]) -> None:
+        with self._lock:
+            prev = self._latest.get(order_id)
+            if prev is not None and prev != key:
+                self._pop(prev)
+            self._data[key] = (time.monotonic() + self.ttl_s, order_id, result)
+            self._data.move_to_end(key)
+            self._latest[order_id] = key
+            while len(self._data) > self.max_entries:
+                self._pop(next(iter(self._data)))
+
+    def invalidate(self, order_id: str) -> None:
+        """订单被其他途径修改后调用，丢弃该订单的缓存结果。"""
+        with self._lock:
+            key = self._latest.get(order_id)
+            if key is not None:
+                self._pop(key)
+
+    def _pop(self, key: str) -> None:
+        entry = self._data.pop(key, None)
+        if entry is not None and self._latest.get(entry[1]) == key:
+            del self._latest[entry[1]]
+
+    def __len__(self) -> int:
+        return len(self._data)
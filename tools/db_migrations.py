@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# tools/db_migrations.py
+"""
+orders.db 的版本化迁移（版本号存于 PRAGMA user_version）+ 查询计划检查。
+- migrate(con)：按顺序应用尚未执行的迁移，每个迁移一个事务，幂等
+- check_query_plans(con, queries)：EXPLAIN QUERY PLAN 断言每条工具查询都走索引、且没有临时排序
+命令行（在仓库根目录）：
+    python -m tools.db_migrations            # 迁移 SQLite/orders.db
+    python -m tools.db_migrations --check    # 迁移后检查 tools/dbtools.py 中各查询的执行计划
+"""
+
+import argparse
+import sqlite3
+from typing import Any, Dict, List, Sequence, Tuple
+
+# (版本号, 说明, SQL)；只能追加，不要修改已发布的迁移
+MIGRATIONS: List[Tuple[int, str, str]] = [
+    (
+        1,
+        "按手机号/邮箱检索最近订单的复合索引 + 下单时间索引",
+        """
+        -- phone/email 等值 + created_at 倒序：直接按索引顺序取前 N 条，无需临时 B-tree 排序
+        CREATE INDEX IF NOT EXISTS idx_orders_phone_created ON orders(phone, created_at DESC);
+        CREATE INDEX IF NOT EXISTS idx_orders_email_created ON orders(email, created_at DESC);
+        CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at);
+        -- 单列索引是上面复合索引的前缀，保留只会增加写放大
+        DROP INDEX IF EXISTS idx_orders_phone;
+        DROP INDEX IF EXISTS idx_orders_email;
+        """,
+    ),
+    (
+        2,
+        "订单修改审计表（只追加；由 tools/audit.py 的后台线程批量写入）",
+        """
+        CREATE TABLE IF NOT EXISTS order_audit (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts TEXT NOT NULL,
+            actor TEXT,
+            action TEXT NOT NULL,
+            order_id TEXT NOT NULL,
+            idempotency_key TEXT,
+            before_sha256 TEXT,
+            after_sha256 TEXT,
+            detail TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_order_audit_order_ts ON order_audit(order_id, ts);
+        """,
+    ),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(con: sqlite3.Connection) -> int:
+    return con.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _statements(sql: str) -> List[str]:
+    body = "\n".join(line for line in sql.splitlines() if not line.strip().startswith("--"))
+    return [s.strip() for s in body.split(";") if s.strip()]
+
+
+def migrate(con: sqlite3.Connection) -> List[int]:
+    """应用所有未执行的迁移，返回本次应用的版本号列表。"""
+    applied: List[int] = []
+    if current_version(con) >= LATEST_VERSION:
+        return applied
+    if con.in_transaction:
+        con.commit()
+    for version, _desc, sql in MIGRATIONS:
+        if current_version(con) >= version:
+            continue
+        con.execute("BEGIN IMMEDIATE")  # 拿到写锁后再确认一次，防止多个进程重复迁移
+        try:
+            if current_version(con) >= version:
+                con.execute("COMMIT")
+                continue
+            for stmt in _statements(sql):
+                con.execute(stmt)
+            con.execute(f"PRAGMA user_version = {int(version)}")
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        applied.append(version)
+    return applied
+
+
+def explain(con: sqlite3.Connection, sql: str, params: Sequence[Any] = ()) -> List[str]:
+    return [row[-1] for row in con.execute(f"EXPLAIN QUERY PLAN {sql}", tuple(params))]
+
+
+def check_query_plans(
+    con: sqlite3.Connection,
+    queries: Dict[str, Tuple[str, Sequence[Any], str]],
+) -> Dict[str, List[str]]:
+    """
+    queries: 名称 → (SQL, 示例参数, 期望使用的索引名)。
+    任一步骤为 SCAN（全表或整条索引扫描）、没有 SEARCH 步骤、SEARCH 没有用到期望的索引，
+    或出现 TEMP B-TREE 排序时抛 AssertionError。返回各查询的执行计划，便于打印。
+    """
+    plans: Dict[str, List[str]] = {}
+    problems: List[str] = []
+    for name, (sql, params, index) in queries.items():
+        plan = explain(con, sql, params)
+        plans[name] = plan
+        text = " | ".join(plan)
+        scans = [step for step in plan if step.startswith("SCAN ")]
+        searches = [step for step in plan if step.startswith("SEARCH ")]
+        if scans:
+            problems.append(f"{name}: 存在扫描 → {text}")
+        if not searches:
+            problems.append(f"{name}: 没有走索引查找 → {text}")
+        elif not any(f" INDEX {index} " in f"{step} " for step in searches):
+            problems.append(f"{name}: 未使用期望的索引 {index} → {text}")
+        if "TEMP B-TREE" in text:
+            problems.append(f"{name}: 存在临时排序 → {text}")
+    if problems:
+        raise AssertionError("查询计划检查未通过：\n" + "\n".join(problems))
+    return plans
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="orders.db 迁移与查询计划检查")
+    ap.add_argument("--db", default="SQLite/orders.db")
+    ap.add_argument("--check", action="store_true", help="迁移后检查 dbtools 查询的执行计划")
+    args = ap.parse_args()
+
+    con = sqlite3.connect(args.db)
+    applied = migrate(con)
+    print(f"schema 版本：{current_version(con)}（本次应用：{applied or '无'}）")
+    if args.check:
+        from tools.dbtools import TOOL_QUERIES
+
+        for name, plan in check_query_plans(con, TOOL_QUERIES).items():
+            print(f"✅ {name}: {' | '.join(plan)}")
+    con.close()
+
+
+if __name__ == "__main__":
+    main()
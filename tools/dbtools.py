@@ -1,31 +1,142 @@
 # -*- coding: utf-8 -*-
 # tools/dbtools.py
 """
-DB 工具：按 id / phone / email 查询订单 & 修改地址。
+DB 工具：按 id / phone / email 查询订单 & 修改地址（含后台批量改地址）。
 与当前表结构对齐：orders(order_id,user_id,user_name,email,phone,status,tracking_no,item_summary,total_amount,created_at,address)
 统一输出结构，便于与 doc_qa 协作。
+连接按线程复用（PRAGMA 只在建连时设置一次），SQL 为模块级常量以命中 sqlite3 的语句缓存。
+修改类工具写审计日志（后台线程组提交，见 tools/audit.py），重复的修改指令按幂等键直接返回上次结果。
+Agent 工具只修改当前用户名下的订单：用户 id 由入口（server.py / main.py）通过 user_context() 绑定，不由 LLM 传参。
+命令行（在仓库根目录）：
+    python -m tools.dbtools --bulk-address fixes.csv --actor ops    # CSV 列：order_id,new_address
 """
 
+import argparse
+import atexit
+import csv
 import sqlite3
-from typing import Dict, Any, List, Optional
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
 from pydantic import BaseModel, Field, EmailStr, constr
 from langchain_core.tools import tool
+from .audit import AuditLog, IdempotencyCache, idempotency_key
+from .db_migrations import migrate
 
 _DB_PATH = "SQLite/orders.db"
 
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;",       # 读写不互斥
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA mmap_size=268435456;",    # 256MB 内存映射读
+    "PRAGMA cache_size=-65536;",      # 64MB 页缓存（负数单位为 KiB）
+    "PRAGMA temp_store=MEMORY;",
+)
 
-def _connect() -> sqlite3.Connection:
-    con = sqlite3.connect(_DB_PATH, timeout=5)
+_SQL_GET_BY_ID = "SELECT * FROM orders WHERE order_id=? LIMIT 1"
+_SQL_SEARCH_BY_PHONE = "SELECT * FROM orders WHERE phone=? ORDER BY created_at DESC LIMIT ?"
+_SQL_SEARCH_BY_EMAIL = "SELECT * FROM orders WHERE email=? ORDER BY created_at DESC LIMIT ?"
+
+# 可直接改地址的状态（flows.md 1.2 前置）；其余状态给出原因与下一步建议
+ADDRESS_EDITABLE_STATUSES = ("已支付待发货", "待发货")
+_STATUS_HINTS = {
+    "已发货": "已发货订单不能直接改地址，可尝试向承运商申请拦截改派（不保证成功）",
+    "已签收": "已签收订单不支持改地址，可引导签收后退货",
+}
+
+# 需要 SQLite >= 3.35（RETURNING）。状态 / 归属校验写在 WHERE 里：判断与写入是同一条语句，并发下不会改到刚变更状态的订单。
+# 每次修改是两条语句：审计的 before 哈希需要旧行，而 RETURNING（含其中的子查询）只能拿到新值，
+# 所以 _update_address 先在同一个写事务里读旧行（见其 docstring）；两条语句同一连接、同一次提交
+# 不校验归属的 _SQL_UPDATE_ADDRESS 只用于后台批量修改（update_addresses），Agent 工具总是带 user_id
+_GUARD = f"order_id=? AND status IN ({', '.join('?' * len(ADDRESS_EDITABLE_STATUSES))})"
+_SQL_UPDATE_ADDRESS = f"UPDATE orders SET address=? WHERE {_GUARD} RETURNING *"
+_SQL_UPDATE_ADDRESS_OWNED = f"UPDATE orders SET address=? WHERE {_GUARD} AND user_id=? RETURNING *"
+
+# 供 `python -m tools.db_migrations --check` 检查执行计划：名称 → (SQL, 示例参数, 期望使用的索引)
+_PK_INDEX = "sqlite_autoindex_orders_1"  # order_id TEXT PRIMARY KEY 的隐式唯一索引
+TOOL_QUERIES = {
+    "orders.get_by_id": (_SQL_GET_BY_ID, ("OD2408150001",), _PK_INDEX),
+    "orders.search_by_phone": (_SQL_SEARCH_BY_PHONE, ("13800000000", 10), "idx_orders_phone_created"),
+    "orders.search_by_email": (_SQL_SEARCH_BY_EMAIL, ("zhang@example.com", 10), "idx_orders_email_created"),
+    "orders.address_update": (
+        _SQL_UPDATE_ADDRESS, ("北京市", "OD2408150001", *ADDRESS_EDITABLE_STATUSES), _PK_INDEX),
+    "orders.address_update(owned)": (
+        _SQL_UPDATE_ADDRESS_OWNED, ("北京市", "OD2408150001", *ADDRESS_EDITABLE_STATUSES, "U000001"), _PK_INDEX),
+}
+
+_AUDIT: Optional[AuditLog] = None
+_AUDIT_LOCK = threading.Lock()
+_IDEMPOTENCY = IdempotencyCache()
+
+_current_user: ContextVar[Optional[str]] = ContextVar("orders_user_id", default=None)
+
+_local = threading.local()
+_all_conns: List[sqlite3.Connection] = []
+_all_lock = threading.Lock()
+
+
+def _open() -> sqlite3.Connection:
+    # check_same_thread=False 仅为了进程退出时能统一 close；使用上每个连接只属于一个线程
+    con = sqlite3.connect(_DB_PATH, timeout=5, check_same_thread=False, cached_statements=128)
     con.row_factory = sqlite3.Row
-    # 可选：更稳的写入模式
-    try:
-        con.execute("PRAGMA journal_mode=WAL;")
-        con.execute("PRAGMA synchronous=NORMAL;")
-    except Exception:
-        pass
+    for pragma in _PRAGMAS:
+        try:
+            con.execute(pragma)
+        except sqlite3.DatabaseError:
+            pass
+    migrate(con)  # 已是最新版本时只读一次 user_version
+    return con
+
+
+def _connect() -> sqlite3.Connection:
+    """
+    返回当前线程的长连接。配合 `with _connect() as con:` 使用：
+    with 块结束时提交/回滚事务，但不关闭连接。
+    """
+    con = getattr(_local, "con", None)
+    if con is None:
+        con = _open()
+        _local.con = con
+        with _all_lock:
+            _all_conns.append(con)
     return con
 
 
+def audit_log() -> AuditLog:
+    """首次修改时才启动审计写线程（压测会先把 _DB_PATH 指向副本）。"""
+    global _AUDIT
+    if _AUDIT is None:
+        with _AUDIT_LOCK:
+            if _AUDIT is None:
+                _AUDIT = AuditLog(_DB_PATH)
+    return _AUDIT
+
+
+@atexit.register
+def close_all() -> None:
+    with _all_lock:
+        while _all_conns:
+            try:
+                _all_conns.pop().close()
+            except sqlite3.Error:
+                pass
+
+
+def current_user_id() -> Optional[str]:
+    return _current_user.get()
+
+
+@contextmanager
+def user_context(user_id: Optional[str]) -> Iterator[None]:
+    """在该上下文内（含线程池中执行的同步工具）修改类工具只作用于该用户名下的订单；None 表示未登录。"""
+    token = _current_user.set(user_id)
+    try:
+        yield
+    finally:
+        _current_user.reset(token)
+
+
 def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
     """把一行记录映射成统一输出字段；不存在的字段给 None。"""
     d = dict(row)
@@ -63,10 +174,7 @@ def orders_get_by_id(order_id: str) -> Dict[str, Any]:
     输出：{"found": bool, "data": {...} 或 None, "meta": {...}}
     """
     with _connect() as con:
-        cur = con.execute(
-            "SELECT * FROM orders WHERE order_id=? LIMIT 1",
-            (order_id,),
-        )
+        cur = con.execute(_SQL_GET_BY_ID, (order_id,))
         row = cur.fetchone()
     if not row:
         return {"found": False, "data": None, "meta": {"source": "sqlite/orders"}}
@@ -86,10 +194,7 @@ def orders_search_by_phone(phone: str, limit: int = 10) -> Dict[str, Any]:
     输出：{"total": int, "items": [{...}], "meta": {...}}
     """
     with _connect() as con:
-        cur = con.execute(
-            "SELECT * FROM orders WHERE phone=? ORDER BY created_at DESC LIMIT ?",
-            (phone, limit),
-        )
+        cur = con.execute(_SQL_SEARCH_BY_PHONE, (phone, limit))
         rows = cur.fetchall()
     items = [_row_to_dict(r) for r in rows]
     return {"total": len(items), "items": items, "meta": {"source": "sqlite/orders", "phone": phone}}
@@ -107,16 +212,41 @@ def orders_search_by_email(email: EmailStr, limit: int = 10) -> Dict[str, Any]:
     当用户只有邮箱时调用；返回最近 N 笔订单摘要供用户确认。
     """
     with _connect() as con:
-        cur = con.execute(
-            "SELECT * FROM orders WHERE email=? ORDER BY created_at DESC LIMIT ?",
-            (email, limit),
-        )
+        cur = con.execute(_SQL_SEARCH_BY_EMAIL, (email, limit))
         rows = cur.fetchall()
     items = [_row_to_dict(r) for r in rows]
     return {"total": len(items), "items": items, "meta": {"source": "sqlite/orders", "email": email}}
 
 
 # -------------------- 修改地址 --------------------
+def _update_address(
+    con: sqlite3.Connection, order_id: str, new_address: str, user_id: Optional[str]
+) -> Tuple[Optional[sqlite3.Row], Optional[sqlite3.Row]]:
+    """
+    在调用方已开启的写事务（BEGIN IMMEDIATE）里执行；返回 (旧行, 新行)，条件不满足时新行为 None。
+    旧行用于审计的 before 哈希（RETURNING 只能拿到更新后的值），同时用于解释失败原因，失败时不再额外查询。
+    """
+    before = con.execute(_SQL_GET_BY_ID, (order_id,)).fetchone()
+    if before is None:
+        return None, None
+    if user_id is None:
+        cur = con.execute(_SQL_UPDATE_ADDRESS, (new_address, order_id, *ADDRESS_EDITABLE_STATUSES))
+    else:
+        cur = con.execute(_SQL_UPDATE_ADDRESS_OWNED, (new_address, order_id, *ADDRESS_EDITABLE_STATUSES, user_id))
+    return before, cur.fetchone()
+
+
+def _rejection(before: Optional[sqlite3.Row], user_id: Optional[str]) -> Dict[str, Any]:
+    if before is None:
+        return {"reason": "not_found"}
+    if user_id is not None and before["user_id"] != user_id:
+        return {"reason": "not_owner"}  # 不透露他人订单的状态
+    out = {"reason": "status_not_editable", "status": before["status"]}
+    if before["status"] in _STATUS_HINTS:
+        out["hint"] = _STATUS_HINTS[before["status"]]
+    return out
+
+
 class AddressUpdateIn(BaseModel):
     order_id: str = Field(..., description="订单号")
     new_address: str = Field(..., description="新的收货地址")
@@ -125,24 +255,89 @@ class AddressUpdateIn(BaseModel):
 @tool("orders.address_update", args_schema=AddressUpdateIn)
 def orders_address_update(order_id: str, new_address: str) -> Dict[str, Any]:
     """
-    当用户明确要求修改地址时调用。
-    注意：已发货/已签收订单通常不可直接改，应先由 doc_qa 给出流程说明与备选方案后再决定是否调用。
-    输出：{"ok": bool, "affected": int, "data": {...} 或 None, "meta": {...}}
+    当用户明确要求修改地址时调用。只有当前用户名下、已支付待发货 / 待发货的订单会被修改；
+    已发货 / 已签收等状态返回 ok=false 与 reason、status、hint，请按 hint 与 doc_qa 的流程说明答复用户。
+    输出：{"ok": bool, "affected": int, "data": {...} 或 None, "meta": {...}}；失败时另含 reason 等字段
     """
-    with _connect() as con:
-        cur = con.execute("UPDATE orders SET address=? WHERE order_id=?", (new_address, order_id))
-        affected = cur.rowcount
-        con.commit()
+    user_id = current_user_id()
+    if user_id is None:  # flows.md：修改前须确认订单属于当前用户，未登录时无从确认
+        return {"ok": False, "affected": 0, "data": None, "reason": "not_authenticated",
+                "meta": {"source": "sqlite/orders"}}
 
-        cur = con.execute("SELECT * FROM orders WHERE order_id=? LIMIT 1", (order_id,))
-        row = cur.fetchone()
+    key = idempotency_key(order_id, "address_update", {"new_address": new_address, "user_id": user_id})
+    replay = _IDEMPOTENCY.get(key)
+    if replay is not None:
+        return {**replay, "meta": {**replay["meta"], "idempotent_replay": True}}
 
-    if affected == 0 or not row:
-        return {"ok": False, "affected": 0, "data": None, "meta": {"source": "sqlite/orders"}}
+    with _connect() as con:
+        con.execute("BEGIN IMMEDIATE")  # 读旧行与更新在同一个写事务里
+        before, after = _update_address(con, order_id, new_address, user_id)
 
-    return {
+    if after is None:
+        return {"ok": False, "affected": 0, "data": None, **_rejection(before, user_id),
+                "meta": {"source": "sqlite/orders"}}
+
+    audit_log().record("address_update", order_id, dict(before), dict(after), actor=user_id, idempotency_key=key)
+    result = {
         "ok": True,
-        "affected": affected,
-        "data": _row_to_dict(row),
+        "affected": 1,
+        "data": _row_to_dict(after),
         "meta": {"source": "sqlite/orders"},
     }
+    _IDEMPOTENCY.put(key, order_id, result)
+    return result
+
+
+def update_addresses(
+    changes: Iterable[Tuple[str, str]],
+    user_id: Optional[str] = None,
+    actor: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    后台批量改地址（如仓库调整后的批量更正），不注册为 Agent 工具。
+    changes: [(order_id, new_address), ...]；全部变更在同一个写事务里执行、只提交一次，
+    状态 / 归属不满足的订单跳过并记录原因；出现数据库错误时整批回滚并抛出异常。
+    输出：{"updated": int, "rejected": [{"order_id", "reason", ...}], "meta": {...}}
+    """
+    applied: List[Tuple[sqlite3.Row, sqlite3.Row]] = []
+    rejected: List[Dict[str, Any]] = []
+    with _connect() as con:
+        con.execute("BEGIN IMMEDIATE")
+        for order_id, new_address in changes:
+            before, after = _update_address(con, order_id, new_address, user_id)
+            if after is None:
+                rejected.append({"order_id": order_id, **_rejection(before, user_id)})
+            else:
+                applied.append((before, after))
+
+    # 提交成功后才写审计；同一订单之前缓存的单条修改结果不再有效
+    audit = audit_log()
+    for before, after in applied:
+        audit.record("address_update.bulk", after["order_id"], dict(before), dict(after), actor=actor)
+        _IDEMPOTENCY.invalidate(after["order_id"])
+    return {"updated": len(applied), "rejected": rejected, "meta": {"source": "sqlite/orders"}}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="orders.db 后台批量改地址")
+    ap.add_argument("--bulk-address", required=True, help="CSV 文件，列：order_id,new_address")
+    ap.add_argument("--actor", default="ops", help="写入审计日志的操作者")
+    ap.add_argument("--user-id", default=None, help="（可选）只修改该用户名下的订单")
+    ap.add_argument("--db", default=None, help="默认 SQLite/orders.db")
+    args = ap.parse_args()
+
+    global _DB_PATH
+    _DB_PATH = args.db or _DB_PATH
+    with open(args.bulk_address, encoding="utf-8-sig", newline="") as f:
+        changes = [(r["order_id"].strip(), r["new_address"].strip()) for r in csv.DictReader(f)]
+    res = update_addresses(changes, user_id=args.user_id, actor=args.actor)
+    print(f"✅ 已修改 {res['updated']} 笔，跳过 {len(res['rejected'])} 笔")
+    for r in res["rejected"]:
+        print(f"  - {r['order_id']}: {r['reason']}" + (f"（{r['status']}）" if "status" in r else ""))
+    audit = audit_log()
+    audit.flush()
+    print(audit.stats().report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+# tools/rag_docqa/answer_cache.py
+"""
+doc_qa 的语义答案缓存：放在 CRC 调用之前。
+- 命中条件：facts 哈希完全一致，且问题向量余弦相似度 ≥ threshold
+- 带 scenario_id 的条目（上下文是该场景的流程 + 话术）：场景 id 计入哈希，与其他场景、检索路径的条目互不命中；
+  查找按问题原文精确匹配，命中时不算问题向量（向量只在未命中、随 LLM 调用一起写入时计算）
+- 淘汰：LRU（max_entries）+ TTL（ttl_seconds）
+- 持久化：条目元数据存 JSON，问题向量按行存同名 .npy（float32）；随进程重启复用。
+  store() 只累计脏计数，攒够 save_every 条或距上次落盘超过 save_interval_s 才写，进程退出时补写一次；
+  写盘持有 _save_lock，先写唯一命名的临时文件再原子替换
+- 失效：记录向量库指纹（utils.store_fingerprint），指纹变化即清空
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+
+def facts_hash(facts: Optional[Dict[str, Any]], scenario_id: Optional[str] = None) -> str:
+    if scenario_id:
+        raw = json.dumps({"scenario_id": scenario_id, "facts": facts or None}, ensure_ascii=False, sort_keys=True,
+                         default=str)
+    elif facts:
+        raw = json.dumps(facts, ensure_ascii=False, sort_keys=True, default=str)
+    else:
+        return ""
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _entry_key(fh: str, question: str) -> str:
+    return hashlib.sha256(f"{fh}|{question}".encode("utf-8")).hexdigest()
+
+
+def _unit(vec) -> np.ndarray:
+    v = np.asarray(vec, dtype="float32")
+    n = float(np.linalg.norm(v))
+    return v / n if n > 0 else v
+
+
+class SemanticAnswerCache:
+    def __init__(
+        self,
+        embed_query: Callable[[str], List[float]],
+        path: Path,
+        fingerprint: str,
+        threshold: float = 0.92,
+        max_entries: int = 512,
+        ttl_seconds: float = 24 * 3600,
+        save_every: int = 32,
+        save_interval_s: float = 60.0,
+    ):
+        self.embed_query = embed_query
+        self.path = Path(path)
+        self.fingerprint = fingerprint
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.save_every = save_every
+        self.save_interval_s = save_interval_s
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # 串行化落盘；与 _lock 分开，写盘期间不阻塞 lookup
+        self._dirty = 0
+        self._last_save = time.monotonic()
+        # key → {"vec", "facts_hash", "scenario_id", "question", "answer", "sources", "created_at"}
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._load()
+        atexit.register(self.save)
+
+    @property
+    def vectors_path(self) -> Path:
+        return self.path.with_suffix(".npy")
+
+    # -------------------- 持久化 --------------------
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        if data.get("fingerprint") != self.fingerprint:
+            return  # 向量库已变化，旧答案可能引用过期资料
+        entries = data.get("entries", [])
+        if entries and "vec" not in entries[0]:
+            try:
+                vecs = np.load(self.vectors_path)
+            except (OSError, ValueError):
+                return
+            if len(vecs) != len(entries):
+                return  # 两个文件不是同一次写出的，放弃旧缓存
+            for e, v in zip(entries, vecs):
+                e["vec"] = v
+        for e in entries:  # 旧格式：向量以 JSON 列表内联
+            e["vec"] = np.asarray(e["vec"], dtype="float32")
+            self._entries[e["key"]] = e
+        self._evict()
+
+    @staticmethod
+    def _replace(path: Path, write: Callable[[Any], None]) -> None:
+        """写到同目录下唯一命名的临时文件，再原子替换目标文件。"""
+        with tempfile.NamedTemporaryFile(dir=path.parent, prefix=path.name + ".", suffix=".tmp", delete=False) as f:
+            try:
+                write(f)
+            except BaseException:
+                f.close()
+                os.unlink(f.name)
+                raise
+        os.replace(f.name, path)
+
+    def save(self) -> None:
+        """有未落盘的修改时写出；先写 .npy 再写 JSON，加载时按条数校验两者是否配套。"""
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                entries = [{k: v for k, v in e.items() if k != "vec"} for e in self._entries.values()]
+                vecs = [e["vec"] for e in self._entries.values()]
+                self._dirty = 0
+                self._last_save = time.monotonic()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            matrix = np.stack(vecs).astype("float32") if vecs else np.zeros((0, 0), dtype="float32")
+            self._replace(self.vectors_path, lambda f: np.save(f, matrix))
+            payload = json.dumps({"fingerprint": self.fingerprint, "entries": entries}, ensure_ascii=False)
+            self._replace(self.path, lambda f: f.write(payload.encode("utf-8")))
+
+    # -------------------- 维护 --------------------
+    def _evict(self) -> None:
+        if self.ttl_seconds:
+            deadline = time.time() - self.ttl_seconds
+            for k in [k for k, e in self._entries.items() if e["created_at"] < deadline]:
+                del self._entries[k]
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, fingerprint: Optional[str] = None) -> None:
+        """清空缓存；传入新指纹时同时切换到新版本向量库。"""
+        with self._lock:
+            self._entries.clear()
+            self._dirty += 1
+            if fingerprint is not None:
+                self.fingerprint = fingerprint
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # -------------------- 读写 --------------------
+    def embed(self, question: str) -> np.ndarray:
+        """lookup 未命中后 store 同一问题时可复用这次的向量。"""
+        return _unit(self.embed_query(question))
+
+    def lookup(
+        self,
+        question: str,
+        facts: Optional[Dict[str, Any]] = None,
+        vec: Optional[np.ndarray] = None,
+        scenario_id: Optional[str] = None,
+    ) -> Optional[Dict[str, Any]]:
+        fh = facts_hash(facts, scenario_id)
+        if scenario_id:
+            return self._lookup_exact(_entry_key(fh, question))
+        q = vec if vec is not None else self.embed(question)
+        with self._lock:
+            self._evict()
+            best_key, best_score = None, self.threshold
+            for k, e in self._entries.items():
+                if e["facts_hash"] != fh:
+                    continue
+                score = float(np.dot(q, e["vec"]))
+                if score >= best_score:
+                    best_key, best_score = k, score
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            e = self._entries[best_key]
+            return {"answer": e["answer"], "sources": e["sources"], "score": best_score}
+
+    def _lookup_exact(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._evict()
+            e = self._entries.get(key)
+            if e is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return {"answer": e["answer"], "sources": e["sources"], "score": 1.0}
+
+    def store(
+        self,
+        question: str,
+        facts: Optional[Dict[str, Any]],
+        answer: str,
+        sources: List[Dict[str, Any]],
+        vec: Optional[np.ndarray] = None,
+        scenario_id: Optional[str] = None,
+    ) -> None:
+        fh = facts_hash(facts, scenario_id)
+        key = _entry_key(fh, question)
+        if vec is None:
+            vec = self.embed(question)
+        with self._lock:
+            self._entries[key] = {
+                "key": key,
+                "vec": vec,
+                "facts_hash": fh,
+                "scenario_id": scenario_id,
+                "question": question,
+                "answer": answer,
+                "sources": sources,
+                "created_at": time.time(),
+            }
+            self._entries.move_to_end(key)
+            self._evict()
+            self._dirty += 1
+            due = self._dirty >= self.save_every or time.monotonic() - self._last_save >= self.save_interval_s
+        if due:
+            self.save()
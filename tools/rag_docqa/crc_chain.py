@@ -4,17 +4,42 @@
 把你现有的 ConversationalRetrievalChain 独立成“构建函数”，供 doc_qa 工具复用。
 """
 
-from typing import Any
+import re
+from typing import Any, Sequence
 from langchain_community.vectorstores import FAISS
 from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferWindowMemory
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from prompt import SYSTEM_INSTRUCTION
-from utils import _ensure_ollama_model_local
+from utils import _ensure_ollama_model_local, load_lexical_index
+from LLM import get_llm, stub_enabled
+from streaming import ANSWER_TAG
+from .hybrid import HybridRetriever
+from .packing import ContextPacker, PackingRetriever
+
+# 混合检索每一路取 CANDIDATE_K 个候选，RRF 融合后整条排序列表（最多 CANDIDATE_K 个）交给上下文装配
+CANDIDATE_K = 10
+# 送进 ANSWER_PROMPT 的资料部分的估算 token 上限：装配器合并重叠、去重后按融合排名装箱，
+# 放不下的低排名 chunk 丢弃；约等于 3 个完整 chunk，prompt 预填充与原先固定取前 3 个持平
+CONTEXT_TOKEN_BUDGET = 1000
+
+# 指代 / 省略的线索：命中时问题离不开上文，才值得多花一次 LLM 调用做改写（condense）。
+# 只收代词与指示词；“之前 / 前面 / 同样”多是时间或比较用语（“发货之前还能改地址吗”），不算指代
+_REFERENCE_RE = re.compile(
+    r"它|他们|她|[这那](个|笔|单|种|样|些|里|件)|该(订单|笔|单)|上(面|述)|刚(才|刚)(说|提|问)"
+    r"|\b(it|this|that|they|them|those)\b",
+    re.IGNORECASE,
+)
+_ELLIPSIS_RE = re.compile(r"^(那|还有|另外|然后)")
+# 句末的“呢”本身只是语气词（“退货运费由谁承担呢？”），只有很短的“X 呢？”才是省略式追问
+_TRAILING_NE_RE = re.compile(r"呢[？?]?$")
+SHORT_QUESTION_CHARS = 4
+SHORT_NE_QUESTION_CHARS = 6
 
 
 def _get_llm():
-    """优先新版 langchain_ollama，失败则回退 community 版。"""
+    """优先新版 langchain_ollama，失败则回退 community 版；设置 QA_AGENT_STUB_LLM 时用本地桩模型。"""
+    if stub_enabled():
+        return get_llm()
     try:
         from langchain_ollama import ChatOllama  # type: ignore
         return ChatOllama(model="llama3.1", temperature=0)
@@ -37,30 +62,46 @@ ANSWER_PROMPT = ChatPromptTemplate.from_messages(
 )
 
 
+def needs_condense(question: str, chat_history: Sequence[Any]) -> bool:
+    """
+    便宜的启发式：有历史，且问题带指代词、是“那…呢？”式追问或短到不成句时才改写。
+    agent 写给 doc_qa 的问题通常已自带主语（往往还附了 facts），直接检索即可。
+    """
+    if not chat_history:
+        return False
+    q = question.strip()
+    if _REFERENCE_RE.search(q) or _ELLIPSIS_RE.search(q) or len(q) <= SHORT_QUESTION_CHARS:
+        return True
+    return bool(_TRAILING_NE_RE.search(q)) and len(q.rstrip("？?")) <= SHORT_NE_QUESTION_CHARS
+
+
 def build_crc(vs: FAISS) -> Any:
     """
     基于给定向量库构建 ConversationalRetrievalChain。
+    链本身不带 memory：调用方按会话传入 chat_history（见 memory_pool.py），
+    这样检索器与 LLM 只构建一次、由所有会话共享。
+    doc_qa 只在 needs_condense() 为真时调用整条链；其余情况直接用 chain.retriever + chain.combine_docs_chain，一次 LLM 调用。
     """
-    _ensure_ollama_model_local("llama3.1")
+    if not stub_enabled():
+        _ensure_ollama_model_local("llama3.1")
 
-    retriever = vs.as_retriever(search_type="similarity", search_kwargs={"k": 5})
+    # BM25 + 向量 RRF 融合：精确匹配（场景 id、变量名）也能排进前几名
+    hybrid = HybridRetriever(vectorstore=vs, lexical=load_lexical_index(vs), k=CANDIDATE_K, fetch_k=CANDIDATE_K)
+    # 融合后的完整候选列表经上下文装配（packing.py）：同小节重叠的 chunk 合并、近似重复去掉，
+    # 再按排名在 token 预算内装箱，由预算而不是固定条数决定送进 prompt 的资料量
+    retriever = PackingRetriever(base=hybrid, packer=ContextPacker(CONTEXT_TOKEN_BUDGET))
     llm = _get_llm()
 
-    memory = ConversationBufferWindowMemory(
-        k=6,
-        memory_key="chat_history",
-        input_key="question",
-        output_key="answer",
-        return_messages=True,
-    )
-
     chain = ConversationalRetrievalChain.from_llm(
         llm=llm,
         retriever=retriever,
-        memory=memory,
         get_chat_history=lambda h: h,
         combine_docs_chain_kwargs={"prompt": ANSWER_PROMPT.partial(system=SYSTEM_INSTRUCTION)},
         return_source_documents=True,
         verbose=False,
     )
+    # 只有生成答复的这一步打标签：流式输出时转发它的 token，问题改写（condense）步骤的 token 不外露。
+    # Chain.tags 不会传给子 run，所以绑在这一步用的 LLM 上（与问题改写共用同一个模型实例）
+    answer_chain = chain.combine_docs_chain.llm_chain
+    answer_chain.llm = answer_chain.llm.with_config(tags=[ANSWER_TAG])
     return chain
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# tools/rag_docqa/hybrid.py
+"""
+doc_qa 的混合检索：BM25（词 + 汉字 n-gram）与 FAISS 向量检索，用 RRF（倒数排名融合）合并。
+- 纯向量检索对精确匹配不敏感：场景 id（orders.address_update）、变量名（{RMA}）、短中文关键词常常排不上来
+- 词法索引与向量库基于同一批 chunk（按 chunk id 对齐），由 utils.load_vectorstore 一起构建、落盘
+- RRF 只看名次不看分数，两路分数尺度不同也无需调权重
+"""
+
+import json
+import math
+import re
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+# 场景 id / 变量占位符 / 英文数字词整体保留
+_WORD_RE = re.compile(r"\{[A-Za-z_][\w.]*\}|[A-Za-z0-9_]+(?:[.\-][A-Za-z0-9_]+)*")
+_CJK_RE = re.compile(r"[一-鿿]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """英文按词（点号/连字符连接的 id 额外拆出各段），中文按单字 + 相邻二字。"""
+    toks: List[str] = []
+    for m in _WORD_RE.finditer(text):
+        w = m.group().lower()
+        toks.append(w)
+        parts = re.split(r"[.\-{}]", w)
+        if len(parts) > 1:
+            toks += [p for p in parts if p]
+    for m in _CJK_RE.finditer(text):
+        s = m.group()
+        toks += list(s)
+        toks += [s[i:i + 2] for i in range(len(s) - 1)]
+    return toks
+
+
+def index_text(doc: Document) -> str:
+    """标题路径也参与词法匹配（场景 id 写在 h3 标题里）。"""
+    return f"{doc.metadata.get('section_path', '')}\n{doc.page_content}"
+
+
+class BM25Index:
+    """倒排表形式的 Okapi BM25；语料只有几十到几千个 chunk，纯 Python 足够。"""
+
+    def __init__(
+        self,
+        doc_ids: List[str],
+        postings: Dict[str, List[Tuple[int, int]]],
+        doc_len: List[int],
+        k1: float = 1.5,
+        b: float = 0.75,
+    ):
+        self.doc_ids = doc_ids
+        self.postings = postings
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+        self.avgdl = (sum(doc_len) / len(doc_len)) if doc_len else 0.0
+        n = len(doc_ids)
+        self.idf = {t: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for t, p in postings.items()}
+
+    @classmethod
+    def build(cls, docs: Iterable[Document], **kwargs: Any) -> "BM25Index":
+        doc_ids: List[str] = []
+        doc_len: List[int] = []
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        for i, d in enumerate(docs):
+            tf = Counter(tokenize(index_text(d)))
+            doc_ids.append(d.id)
+            doc_len.append(sum(tf.values()))
+            for t, c in tf.items():
+                postings[t].append((i, c))
+        return cls(doc_ids, dict(postings), doc_len, **kwargs)
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        scores: Dict[int, float] = defaultdict(float)
+        for t, qtf in Counter(tokenize(query)).items():
+            plist = self.postings.get(t)
+            if not plist:
+                continue
+            idf = self.idf[t]
+            for i, tf in plist:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[i] / self.avgdl)
+                scores[i] += qtf * idf * tf * (self.k1 + 1) / (tf + norm)
+        top = sorted(scores.items(), key=lambda x: -x[1])[:k]
+        return [(self.doc_ids[i], s) for i, s in top]
+
+    # -------------------- 持久化 --------------------
+    def save(self, path: Path) -> None:
+        data = {
+            "k1": self.k1,
+            "b": self.b,
+            "doc_ids": self.doc_ids,
+            "doc_len": self.doc_len,
+            "postings": self.postings,
+        }
+        tmp = Path(path).with_suffix(".tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "BM25Index":
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        postings = {t: [tuple(x) for x in p] for t, p in data["postings"].items()}
+        return cls(data["doc_ids"], postings, data["doc_len"], k1=data["k1"], b=data["b"])
+
+
+def rrf_fuse(rankings: Sequence[Sequence[str]], k: int = 60) -> List[str]:
+    """倒数排名融合：score(d) = Σ 1 / (k + rank)。"""
+    scores: Dict[str, float] = defaultdict(float)
+    for ranked in rankings:
+        for rank, doc_id in enumerate(ranked, start=1):
+            scores[doc_id] += 1.0 / (k + rank)
+    return sorted(scores, key=lambda d: -scores[d])
+
+
+class HybridRetriever(BaseRetriever):
+    """两路各取 fetch_k 个候选，RRF 融合后返回前 k 个。"""
+
+    vectorstore: Any
+    lexical: Any  # BM25Index
+    k: int = 3
+    fetch_k: int = 10
+    rrf_k: int = 60
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: Optional[CallbackManagerForRetrieverRun] = None
+    ) -> List[Document]:
+        dense = [d.id for d in self.vectorstore.similarity_search(query, k=self.fetch_k)]
+        sparse = [i for i, _ in self.lexical.search(query, k=self.fetch_k)]
+        docs: List[Document] = []
+        for doc_id in rrf_fuse([dense, sparse], k=self.rrf_k)[: self.k]:
+            doc = self.vectorstore.docstore.search(doc_id)
+            if isinstance(doc, Document):
+                docs.append(doc)
+        return docs
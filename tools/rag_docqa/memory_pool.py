@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# tools/rag_docqa/memory_pool.py
+"""
+按会话隔离的对话记忆池：CRC（检索器 + LLM）全局共享，只有 chat_history 按 session_id 区分。
+- 每个会话一个 ConversationBufferWindowMemory（窗口 k 轮）
+- 池子有上限（max_sessions，超出按 LRU 淘汰）与空闲过期（idle_ttl_seconds）
+- current_session_id：由服务入口按轮次设置（session_context），doc_qa 只从这里取会话 id
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List
+
+from langchain.memory import ConversationBufferWindowMemory
+from langchain_core.messages import BaseMessage
+
+DEFAULT_SESSION = "default"
+
+_current_session: ContextVar[str] = ContextVar("doc_qa_session_id", default=DEFAULT_SESSION)
+
+
+def current_session_id() -> str:
+    return _current_session.get()
+
+
+@contextmanager
+def session_context(session_id: str) -> Iterator[None]:
+    """在该上下文内（含线程池中执行的同步工具）doc_qa 默认使用这个会话的记忆。"""
+    token = _current_session.set(session_id)
+    try:
+        yield
+    finally:
+        _current_session.reset(token)
+
+
+def new_session_memory(k: int = 6) -> ConversationBufferWindowMemory:
+    return ConversationBufferWindowMemory(
+        k=k,
+        memory_key="chat_history",
+        input_key="question",
+        output_key="answer",
+        return_messages=True,
+    )
+
+
+class SessionMemoryPool:
+    def __init__(self, window_k: int = 6, max_sessions: int = 1000, idle_ttl_seconds: float = 1800):
+        self.window_k = window_k
+        self.max_sessions = max_sessions
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._lock = threading.Lock()
+        # session_id → (memory, last_used)
+        self._sessions: "OrderedDict[str, tuple[ConversationBufferWindowMemory, float]]" = OrderedDict()
+
+    def _evict(self, now: float) -> None:
+        if self.idle_ttl_seconds:
+            while self._sessions:
+                sid, (_, last_used) = next(iter(self._sessions.items()))
+                if now - last_used < self.idle_ttl_seconds:
+                    break
+                del self._sessions[sid]
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def get(self, session_id: str) -> ConversationBufferWindowMemory:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            memory = entry[0] if entry else new_session_memory(self.window_k)
+            self._sessions[session_id] = (memory, now)  # 重新插入到队尾 = 最近使用
+            self._evict(now)
+            return memory
+
+    def history(self, session_id: str) -> List[BaseMessage]:
+        return self.get(session_id).load_memory_variables({})["chat_history"]
+
+    def append(self, session_id: str, question: str, answer: str) -> None:
+        self.get(session_id).save_context({"question": question}, {"answer": answer})
+
+    def drop(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+# tools/rag_docqa/packing.py
+"""
+检索结果 → prompt 上下文之间的装配：合并重叠、去重、按 token 预算装箱。
+- 分块脚本带 60~120 字重叠，同一小节的相邻 chunk 常被一起召回：首尾重叠（或互相包含）的合并成一段
+- 近似重复（字符 shingle 覆盖率 ≥ DUP_THRESHOLD）只保留排名靠前的一份
+- 按相关性顺序装入，总量不超过 budget_tokens；排第一的放不下时截断到预算内，后面放不下的跳过
+- prompt 预填充（prefill）在 CPU 上是每次调用的大头，每次装配都记录节省的 token 数（日志 + trace span）
+"""
+
+import logging
+import math
+import re
+import threading
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Set, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import Field
+
+from tracing import traced
+
+logger = logging.getLogger(__name__)
+
+MIN_OVERLAP = 20  # 小于该长度的首尾相同视为巧合，不合并
+MAX_OVERLAP = 400  # 分块重叠最多 120 字，留余量
+SHINGLE = 5
+DUP_THRESHOLD = 0.9
+
+_CJK_RE = re.compile(r"[一-鿿　-〿＀-￯]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗估 llama 系 tokenizer 的 token 数：中文约 1 字 1 token，其余约 4 字符 1 token。"""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def _overlap(a: str, b: str) -> int:
+    """a 的后缀与 b 的前缀最长重合长度（< MIN_OVERLAP 记为 0）。"""
+    for n in range(min(len(a), len(b), MAX_OVERLAP), MIN_OVERLAP - 1, -1):
+        if a.endswith(b[:n]):
+            return n
+    return 0
+
+
+def _merge(a: str, b: str) -> Optional[str]:
+    """两段同小节文本能拼接时返回拼接结果（顺序由重叠方向决定），否则 None。"""
+    if b in a:
+        return a
+    if a in b:
+        return b
+    n = _overlap(a, b)
+    if n:
+        return a + b[n:]
+    n = _overlap(b, a)
+    if n:
+        return b + a[n:]
+    return None
+
+
+def _shingles(text: str) -> Set[str]:
+    t = re.sub(r"\s+", "", text)
+    return {t[i:i + SHINGLE] for i in range(max(1, len(t) - SHINGLE + 1))}
+
+
+def _section_key(doc: Document):
+    m = doc.metadata
+    return m.get("namespace") or m.get("source"), m.get("section_path")
+
+
+@dataclass
+class PackingStats:
+    calls: int = 0
+    tokens_in: int = 0
+    tokens_out: int = 0
+    merged: int = 0
+    duplicates: int = 0
+    over_budget: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_in - self.tokens_out
+
+    def report(self) -> str:
+        ratio = self.tokens_saved / self.tokens_in if self.tokens_in else 0.0
+        return (
+            f"上下文装配：{self.calls} 次，估算 token {self.tokens_in} → {self.tokens_out}（节省 {ratio:.0%}）；"
+            f"合并 {self.merged}，去重 {self.duplicates}，超预算丢弃 {self.over_budget}"
+        )
+
+
+class ContextPacker:
+    def __init__(self, budget_tokens: int = 1500, count_tokens: Callable[[str], int] = estimate_tokens):
+        self.budget_tokens = budget_tokens
+        self.count_tokens = count_tokens
+        self.stats = PackingStats()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _merge_sections(docs: List[Document]) -> Tuple[List[Document], int]:
+        out: List[Document] = []
+        merged = 0
+        for d in docs:
+            for i, kept in enumerate(out):
+                if _section_key(kept) != _section_key(d):
+                    continue
+                text = _merge(kept.page_content, d.page_content)
+                if text is not None:
+                    # 保留排名靠前那一块的位置与元数据，记下被并入的 chunk id
+                    ids = kept.metadata.get("merged_ids") or [kept.id]
+                    meta = {**kept.metadata, "merged_ids": ids + [d.id]}
+                    out[i] = Document(page_content=text, metadata=meta, id=kept.id)
+                    merged += 1
+                    break
+            else:
+                out.append(d)
+        return out, merged
+
+    @staticmethod
+    def _drop_duplicates(docs: List[Document]) -> Tuple[List[Document], int]:
+        out: List[Document] = []
+        seen: List[Set[str]] = []
+        for d in docs:
+            sh = _shingles(d.page_content)
+            if any(len(sh & s) >= DUP_THRESHOLD * len(sh) for s in seen):
+                continue
+            out.append(d)
+            seen.append(sh)
+        return out, len(docs) - len(out)
+
+    def _truncate(self, doc: Document, budget: int) -> Document:
+        text = doc.page_content
+        lo, hi = 0, len(text)
+        while lo < hi:  # 二分找预算内最长前缀
+            mid = (lo + hi + 1) // 2
+            if self.count_tokens(text[:mid]) <= budget:
+                lo = mid
+            else:
+                hi = mid - 1
+        cut = text.rfind("\n", 0, lo)
+        text = text[: cut if cut > lo // 2 else lo]
+        return Document(page_content=text, metadata={**doc.metadata, "truncated": True}, id=doc.id)
+
+    def pack(self, docs: List[Document]) -> List[Document]:
+        """docs 需按相关性降序；返回值保持该顺序。"""
+        with traced("context", "pack") as span:
+            tokens_in = sum(self.count_tokens(d.page_content) for d in docs)
+            candidates, merged = self._merge_sections(list(docs))
+            candidates, duplicates = self._drop_duplicates(candidates)
+            packed: List[Document] = []
+            used = over = 0
+            for d in candidates:
+                n = self.count_tokens(d.page_content)
+                if used + n > self.budget_tokens:
+                    if packed:
+                        over += 1
+                        continue
+                    d = self._truncate(d, self.budget_tokens)
+                    n = self.count_tokens(d.page_content)
+                packed.append(d)
+                used += n
+            span.update(tokens_in=tokens_in, tokens_out=used, docs_in=len(docs), docs_out=len(packed))
+
+        with self._lock:
+            s = self.stats
+            s.calls += 1
+            s.tokens_in += tokens_in
+            s.tokens_out += used
+            s.merged += merged
+            s.duplicates += duplicates
+            s.over_budget += over
+        logger.info(
+            "上下文装配：%d 段 / %d token → %d 段 / %d token（节省 %d；合并 %d，去重 %d，超预算 %d）",
+            len(docs), tokens_in, len(packed), used, tokens_in - used, merged, duplicates, over,
+        )
+        return packed
+
+
+class PackingRetriever(BaseRetriever):
+    """包一层任意检索器：取回结果后经 ContextPacker 装配再交给 combine-docs 步骤。"""
+
+    base: BaseRetriever
+    packer: ContextPacker = Field(default_factory=ContextPacker)
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: Optional[CallbackManagerForRetrieverRun] = None
+    ) -> List[Document]:
+        callbacks = run_manager.get_child() if run_manager else None
+        return self.packer.pack(self.base.invoke(query, config={"callbacks": callbacks}))
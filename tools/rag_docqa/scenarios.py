@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# tools/rag_docqa/scenarios.py
+"""
+场景 id → 配套 chunk 的直查索引。
+flows.md 与 utterances.md 按 `category.subcategory`（如 orders.status_query）一一对应，
+分块脚本把 id 写进 metadata["scenario_id"]；这里预先建好 id → {flows: [...], utterances: [...]}，
+已知场景时 doc_qa 直接按 chunk id 取上下文，不做向量检索。
+"""
+
+import json
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List
+
+from langchain_core.documents import Document
+
+NAMESPACES = ("flows", "utterances")
+
+
+class ScenarioIndex:
+    def __init__(self, scenarios: Dict[str, Dict[str, List[str]]]):
+        self.scenarios = scenarios
+
+    @classmethod
+    def build(cls, docs: Iterable[Document]) -> "ScenarioIndex":
+        """按文档原始顺序收集；同一场景被切成多块时全部保留。"""
+        scenarios: Dict[str, Dict[str, List[str]]] = defaultdict(lambda: {ns: [] for ns in NAMESPACES})
+        for d in docs:
+            sid = d.metadata.get("scenario_id")
+            ns = d.metadata.get("namespace")
+            if sid and ns in NAMESPACES and d.id:
+                scenarios[sid][ns].append(d.id)
+        return cls(dict(scenarios))
+
+    def __contains__(self, scenario_id: str) -> bool:
+        return scenario_id in self.scenarios
+
+    def ids(self) -> List[str]:
+        return sorted(self.scenarios)
+
+    def chunk_ids(self) -> List[str]:
+        return [i for entry in self.scenarios.values() for ns in NAMESPACES for i in entry[ns]]
+
+    def documents(self, scenario_id: str, docstore: Any) -> List[Document]:
+        """先流程后话术；未知 id 返回空列表。"""
+        entry = self.scenarios.get(scenario_id)
+        if entry is None:
+            return []
+        docs = [docstore.search(i) for ns in NAMESPACES for i in entry[ns]]
+        return [d for d in docs if isinstance(d, Document)]
+
+    # -------------------- 持久化 --------------------
+    def save(self, path: Path) -> None:
+        tmp = Path(path).with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.scenarios, ensure_ascii=False, indent=2), encoding="utf-8")
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "ScenarioIndex":
+        return cls(json.loads(Path(path).read_text(encoding="utf-8")))
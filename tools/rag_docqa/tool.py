@@ -2,23 +2,83 @@
 # agent_tools/rag_docqa/tool.py
 """
 把 CRC 封装成一个可被 Agent 调用的 doc_qa 工具；支持注入外部 facts。
+CRC 之前有一层语义答案缓存（answer_cache.py），相似问题直接返回已有答案。
+对话记忆按 session_id 隔离（memory_pool.py），CRC 本身全局共享。
+已知场景 id 时（scenarios.py）直接取配套的流程 + 话术 chunk，跳过问题改写与向量检索。
+问题本身完整时（crc_chain.needs_condense 为假）直接按原问题检索 + 生成，一次 LLM 调用；
+只有带指代 / 省略的追问才走 CRC 的“改写 → 检索 → 生成”两次调用，这类问题也不读写答案缓存。
+可由 start_doc_qa_warmup() 在后台线程初始化；初始化完成前的调用会先等待预热。
 """
 
-from typing import Optional, Dict, Any, List
+from pathlib import Path
+from typing import Callable, Optional, Dict, Any, List
 from pydantic import BaseModel, Field
 from langchain_core.tools import tool
-from .crc_chain import build_crc
+from startup import Warmup, phase
+from utils import FAISS_DIR, store_fingerprint, load_scenario_index
+from .crc_chain import build_crc, needs_condense
+from .answer_cache import SemanticAnswerCache
+from .scenarios import ScenarioIndex
+from .memory_pool import SessionMemoryPool, current_session_id
+
+ANSWER_CACHE_PATH = FAISS_DIR / "answer_cache.json"
 
 # 会话内复用的 CRC 实例
 _CRC = None
+_CACHE: Optional[SemanticAnswerCache] = None
+_MEMORY: Optional[SessionMemoryPool] = None
+_SCENARIOS: Optional[ScenarioIndex] = None
+_DOCSTORE = None
+_WARMUP: Optional[Warmup] = None
 
 
-def init_doc_qa_tool(vectorstore) -> None:
+def init_doc_qa_tool(
+    vectorstore,
+    cache_threshold: float = 0.92,
+    cache_max_entries: int = 512,
+    cache_ttl_seconds: float = 24 * 3600,
+    cache_path: Optional[Path] = ANSWER_CACHE_PATH,
+    memory_window_k: int = 6,
+    max_sessions: int = 1000,
+    session_idle_seconds: float = 1800,
+) -> None:
     """
     在应用启动时调用一次：注入向量库并构建 CRC。
+    cache_path=None 时关闭答案缓存。
     """
-    global _CRC
+    global _CRC, _CACHE, _MEMORY, _SCENARIOS, _DOCSTORE
     _CRC = build_crc(vectorstore)
+    _SCENARIOS = load_scenario_index(vectorstore)
+    _DOCSTORE = vectorstore.docstore
+    _MEMORY = SessionMemoryPool(
+        window_k=memory_window_k,
+        max_sessions=max_sessions,
+        idle_ttl_seconds=session_idle_seconds,
+    )
+    _CACHE = None
+    if cache_path is not None:
+        _CACHE = SemanticAnswerCache(
+            embed_query=vectorstore.embedding_function.embed_query,
+            path=cache_path,
+            fingerprint=store_fingerprint(),
+            threshold=cache_threshold,
+            max_entries=cache_max_entries,
+            ttl_seconds=cache_ttl_seconds,
+        )
+
+
+def start_doc_qa_warmup(load_vectorstore: Callable[[], Any], **kwargs: Any) -> Warmup:
+    """后台加载向量库（bge-m3 + FAISS）并调用 init_doc_qa_tool；立即返回预热句柄。"""
+    global _WARMUP
+
+    def run() -> None:
+        with phase("load_vectorstore"):
+            vs = load_vectorstore()
+        with phase("init_doc_qa_tool（CRC）"):
+            init_doc_qa_tool(vs, **kwargs)
+
+    _WARMUP = Warmup(run, name="doc_qa")
+    return _WARMUP
 
 
 class DocQAInput(BaseModel):
@@ -27,24 +87,63 @@ class DocQAInput(BaseModel):
         default=None,
         description="（可选）来自其他工具的结构化事实块，将作为前情提示拼接",
     )
+    scenario_id: Optional[str] = Field(
+        default=None,
+        description="（可选）已知的场景 id（如 orders.address_update、rules.shipping_sla），直接取对应流程与话术",
+    )
 
 
 @tool("doc_qa", args_schema=DocQAInput)
-def doc_qa(question: str, facts: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+def doc_qa(
+    question: str,
+    facts: Optional[Dict[str, Any]] = None,
+    scenario_id: Optional[str] = None,
+) -> Dict[str, Any]:
     """
     基于员工手册/流程/FAQ 的文档检索问答工具。
     用法：当用户问题涉及政策、流程、规则、话术等需要查文档时调用。
-    输入：question；如已获得 DB 等外部事实，请放到 facts。
+    输入：question；如已获得 DB 等外部事实，请放到 facts；已确定场景时可传 scenario_id（如 orders.address_update）。
     输出：{"answer": str, "sources": [{"page_content": str, "metadata": {...}}, ...]}
     """
+    if _CRC is None and _WARMUP is not None:
+        try:
+            _WARMUP.result()
+        except Exception as e:
+            return {"error": f"doc_qa 初始化失败：{type(e).__name__}: {e}"}
     if _CRC is None:
         return {"error": "doc_qa 未初始化：请先在启动阶段调用 init_doc_qa_tool(vectorstore) 注入向量库。"}
 
+    # 会话只取自服务入口设置的上下文，不作为工具参数暴露给 LLM，避免跨会话读写记忆
+    sid = current_session_id()
     q = question if not facts else f"【已知事实】{facts}\n【问题】{question}"
-    result = _CRC.invoke({"question": q})
 
-    answer = result.get("answer") or ""
-    src_docs = result.get("source_documents") or []
+    history = _MEMORY.history(sid)
+    scenario_docs = _SCENARIOS.documents(scenario_id, _DOCSTORE) if scenario_id and _SCENARIOS else []
+    # 依赖上文的追问，答案随历史而变，不能按问题文本缓存
+    condense = not scenario_docs and needs_condense(question, history)
+
+    qvec = None
+    if _CACHE is not None and not condense:
+        # 场景 id 计入缓存键：场景答案与检索答案互不命中；场景路径按原文精确匹配，不算问题向量
+        qvec = None if scenario_id else _CACHE.embed(question)
+        hit = _CACHE.lookup(question, facts, vec=qvec, scenario_id=scenario_id)
+        if hit is not None:
+            _MEMORY.append(sid, q, hit["answer"])
+            return {"answer": hit["answer"], "sources": hit["sources"]}
+
+    if condense:
+        result = _CRC.invoke({"question": q, "chat_history": history})
+        answer = result.get("answer") or ""
+        src_docs = result.get("source_documents") or []
+    else:
+        if scenario_docs:
+            # 场景已知：上下文就是该场景的流程 + 话术，不需要检索；与检索路径共用同一个装配器
+            src_docs = _CRC.retriever.packer.pack(scenario_docs)
+        else:
+            # 问题已完整：按原问题检索（facts 只进 prompt，不参与检索）
+            src_docs = _CRC.retriever.invoke(question)
+        out = _CRC.combine_docs_chain.invoke({"input_documents": src_docs, "question": q, "chat_history": history})
+        answer = out.get("output_text") or ""
 
     sources: List[Dict[str, Any]] = []
     for d in src_docs:
@@ -55,4 +154,7 @@ def doc_qa(question: str, facts: Optional[Dict[str, Any]] = None) -> Dict[str, A
             }
         )
 
+    _MEMORY.append(sid, q, answer)
+    if _CACHE is not None and answer and not condense:
+        _CACHE.store(question, facts, answer, sources, vec=qvec, scenario_id=scenario_id)
     return {"answer": answer, "sources": sources}
@@ -3,13 +3,14 @@
 """
 统一初始化并导出所有工具（供 Agent 注入）。
 - 在这里加载向量库并初始化 doc_qa（CRC）。
+- lazy=True 时向量库与 CRC 放到后台线程预热，立即返回工具列表；doc_qa 首次被调用时才等待。
 """
 
 from typing import List
 from langchain_core.tools import BaseTool
 
 from utils import load_vectorstore
-from .rag_docqa.tool import init_doc_qa_tool, doc_qa
+from .rag_docqa.tool import init_doc_qa_tool, start_doc_qa_warmup, doc_qa
 from .dbtools import (
     orders_get_by_id,
     orders_search_by_phone,
@@ -18,10 +19,14 @@ from .dbtools import (
 )
 
 
-def init_all_tools() -> List[BaseTool]:
-    # 1) 加载/构建向量库，并初始化 doc_qa（封装 CRC）
-    vs = load_vectorstore()
-    init_doc_qa_tool(vs)
+def init_all_tools(vs=None, lazy: bool = False, **doc_qa_kwargs) -> List[BaseTool]:
+    # 1) 加载/构建向量库，并初始化 doc_qa（封装 CRC）；压测时可传入现成的向量库与缓存配置
+    if vs is None and lazy:
+        start_doc_qa_warmup(load_vectorstore, **doc_qa_kwargs)
+    else:
+        if vs is None:
+            vs = load_vectorstore()
+        init_doc_qa_tool(vs, **doc_qa_kwargs)
 
     # 2) 组装全量工具列表
     tools: List[BaseTool] = [
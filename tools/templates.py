@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# tools/templates.py
+"""
+话术模板渲染：utterances.md 的模板在首次使用时解析、编译一次，之后直接用工具结果填充，不经过 LLM。
+- 模板按场景 id + 语气（neutral / empathetic / formal）索引，与 flows.md / utterances.md 的 id 一致
+- `{# 有运单 #}` / `{# 无运单 #}` 为条件行，按是否有 tracking_no 取舍；
+  empathetic / formal 中“分支同上”的注释行沿用同场景 neutral 的条件行，其余 `{# ... #}` 注释丢弃
+- 常量（no_reason_days、warehouse_process_hours 等）取自 flows.md 顶层的 yaml vars
+- 个人信息按 flows.md“隐私与合规”的规则脱敏；缺失变量填“暂无”（见 utterances.md 顶部说明）
+"""
+
+import re
+import string
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+import yaml
+
+UTTERANCES_MD = Path("Resources/utterances/utterances_wo_toc.md")
+FLOWS_MD = Path("Resources/flows/flows_wo_toc.md")
+
+DEFAULT_TONE = "neutral"
+MISSING = "暂无"
+
+_SCENARIO_RE = re.compile(r"^#{2,4}\s.*（id:\s*`([\w.]+)`）")
+_TONE_RE = re.compile(r"^\*\*(\w+)\*\*\s*$")
+_COMMENT_RE = re.compile(r"\{#\s*(.*?)\s*#\}")
+_VARS_RE = re.compile(r"```yaml\n(.*?)```", re.S)
+
+# 条件注释 → 判定函数（入参为渲染用的变量表）
+CONDITIONS: Dict[str, Callable[[Mapping[str, Any]], bool]] = {
+    "有运单": lambda v: bool(v.get("tracking_no")),
+    "无运单": lambda v: not v.get("tracking_no"),
+}
+_INHERIT_MARK = "分支同上"
+
+_FORMATTER = string.Formatter()
+
+
+# -------------------- 脱敏（flows.md：隐私与合规模块） --------------------
+def mask_phone(phone: Optional[str]) -> str:
+    """13800000000 → 138****0000"""
+    if not phone or len(phone) < 7:
+        return phone or MISSING
+    return phone[:3] + "****" + phone[-4:]
+
+
+def mask_email(email: Optional[str]) -> str:
+    """zhang@example.com → z***@example.com"""
+    if not email or "@" not in email:
+        return email or MISSING
+    name, domain = email.split("@", 1)
+    return name[:1] + "***@" + domain
+
+
+def mask_address(address: Optional[str]) -> str:
+    """北京市朝阳区建国路88号 → 北京市朝阳区建国路**号…（门牌号起脱敏）"""
+    if not address:
+        return MISSING
+    m = re.search(r"\d", address)
+    return (address[:m.start()] if m else address[:6]) + "**号…"
+
+
+def mask_name(name: Optional[str]) -> str:
+    """张三 → 张*"""
+    if not name:
+        return MISSING
+    return name[:1] + "*" * max(1, len(name) - 1)
+
+
+def order_values(order: Mapping[str, Any]) -> Dict[str, Any]:
+    """dbtools._row_to_dict 的输出 → 模板变量（PII 只给脱敏后的版本）。"""
+    return {
+        "order_id": order.get("order_id"),
+        "status": order.get("status"),
+        "tracking_no": order.get("tracking_no"),
+        "item_summary": order.get("item"),
+        "total_amount": order.get("total_amount"),
+        "created_at": order.get("created_at"),
+        "address_masked": mask_address(order.get("address")),
+        "phone_masked": mask_phone(order.get("phone")),
+        "email_masked": mask_email(order.get("email")),
+        "user_name_masked": mask_name(order.get("user_name")),
+    }
+
+
+# -------------------- 编译 --------------------
+@dataclass
+class Template:
+    scenario_id: str
+    tone: str
+    # (条件名或 None, format 串)；条件名对应 CONDITIONS
+    lines: List[Tuple[Optional[str], str]] = field(default_factory=list)
+
+    @property
+    def fields(self) -> List[str]:
+        seen: Dict[str, None] = {}
+        for _, fmt in self.lines:
+            for _, name, _, _ in _FORMATTER.parse(fmt):
+                if name:
+                    seen.setdefault(name, None)
+        return list(seen)
+
+
+class _Values(dict):
+    def __missing__(self, key: str) -> str:
+        return MISSING
+
+
+def _clean(line: str) -> str:
+    # 去掉引用块前缀、markdown 加粗与行尾的硬换行空格
+    line = re.sub(r"^>\s?", "", line).strip()
+    return line.replace("**", "")
+
+
+def parse_utterances(text: str) -> Dict[str, Dict[str, Template]]:
+    templates: Dict[str, Dict[str, Template]] = {}
+    sid: Optional[str] = None
+    current: Optional[Template] = None
+    for raw in text.splitlines():
+        m = _SCENARIO_RE.match(raw)
+        if m:
+            sid, current = m.group(1), None
+            continue
+        if sid is None:
+            continue
+        m = _TONE_RE.match(raw.strip())
+        if m:
+            current = Template(sid, m.group(1))
+            templates.setdefault(sid, {})[current.tone] = current
+            continue
+        if current is None or not raw.startswith(">"):
+            continue
+        line = _clean(raw)
+        if not line:
+            continue
+        m = _COMMENT_RE.match(line)
+        if m is None:
+            current.lines.append((None, line))
+        elif m.group(1) in CONDITIONS:
+            current.lines.append((m.group(1), line[m.end():].strip()))
+        elif _INHERIT_MARK in m.group(1):
+            base = templates[sid].get(DEFAULT_TONE)
+            if base is not None and base is not current:
+                current.lines.extend(ln for ln in base.lines if ln[0] is not None)
+    return templates
+
+
+def parse_flow_vars(text: str) -> Dict[str, Any]:
+    """flows.md 顶层配置块中的 vars。"""
+    for block in _VARS_RE.findall(text):
+        data = yaml.safe_load(block) or {}
+        if isinstance(data, dict) and isinstance(data.get("vars"), dict):
+            return dict(data["vars"])
+    return {}
+
+
+class UtteranceTemplates:
+    def __init__(self, templates: Dict[str, Dict[str, Template]], constants: Optional[Dict[str, Any]] = None):
+        self.templates = templates
+        self.constants = constants or {}
+
+    @classmethod
+    def load(cls, utterances_path: Path = UTTERANCES_MD, flows_path: Path = FLOWS_MD) -> "UtteranceTemplates":
+        templates = parse_utterances(Path(utterances_path).read_text(encoding="utf-8"))
+        constants = parse_flow_vars(Path(flows_path).read_text(encoding="utf-8"))
+        return cls(templates, constants)
+
+    def __contains__(self, scenario_id: str) -> bool:
+        return scenario_id in self.templates
+
+    def get(self, scenario_id: str, tone: str = DEFAULT_TONE) -> Optional[Template]:
+        tones = self.templates.get(scenario_id) or {}
+        return tones.get(tone) or tones.get(DEFAULT_TONE)
+
+    def render(self, scenario_id: str, values: Mapping[str, Any], tone: str = DEFAULT_TONE) -> Optional[str]:
+        """返回 None 表示没有该场景的模板，调用方交给 LLM。"""
+        t = self.get(scenario_id, tone)
+        if t is None:
+            return None
+        v = _Values(self.constants)
+        v.update((k, x) for k, x in values.items() if x not in (None, ""))
+        out = [fmt.format_map(v) for cond, fmt in t.lines if cond is None or CONDITIONS[cond](v)]
+        return "\n".join(out)
+
+
+@lru_cache(maxsize=1)
+def get_templates() -> UtteranceTemplates:
+    """进程内只解析一次。"""
+    return UtteranceTemplates.load()
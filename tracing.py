@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+# tracing.py
+"""
+按轮次的调用链追踪（替代 verbose=True 定位热点）。
+- TraceCallbackHandler：挂到 AgentExecutor / CRC 的 callbacks 上，按 run_id / parent_run_id 还原 span 树
+  （LLM 调用含 prompt/completion token 数、工具调用、检索器、链），根 run 结束时导出一条 JSONL
+- traced(kind, name)：给不走 LangChain 回调的步骤（如 embedding）补 span；未开启追踪时只做一次 ContextVar 读取
+- Tracer：汇总各 span 的耗时直方图与 token 计数，输出 Prometheus 文本格式
+开启方式：设置环境变量 QA_AGENT_TRACE=traces.jsonl（指标写到同名 .prom 文件）；未设置时 get_tracer() 返回 None，不挂任何回调。
+指标文件不在每轮写：距上次写出超过 metrics_interval_s 才写，进程退出时（atexit）补写一次；先写临时文件再原子替换。
+"""
+
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+TRACE_ENV = "QA_AGENT_TRACE"
+
+# 秒；覆盖从 sqlite 亚毫秒到 CPU 上 LLM 生成数十秒
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# LangChain 内部的胶水 Runnable 不单独成 span，其子节点挂到最近的有效祖先上
+_SKIP_PREFIXES = ("Runnable", "ChatPromptTemplate", "PromptTemplate", "ReActSingleInputOutputParser")
+
+# (handler, 当前 span id)：traced() 据此找到父 span
+_active: ContextVar[Optional[Tuple["TraceCallbackHandler", str]]] = ContextVar("qa_trace_active", default=None)
+
+
+class Tracer:
+    """进程级：写 trace JSONL、汇总指标。"""
+
+    def __init__(self, trace_path: Path, metrics_path: Optional[Path] = None, metrics_interval_s: float = 15.0):
+        self.trace_path = Path(trace_path)
+        self.metrics_path = Path(metrics_path) if metrics_path else self.trace_path.with_suffix(".prom")
+        self.metrics_interval_s = metrics_interval_s
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # 串行化指标落盘；与 _lock 分开，写盘期间不阻塞记录
+        self._dirty = False
+        self._last_write = time.monotonic()
+        # (kind, name) → [bucket counts..., count, sum]
+        self._hist: Dict[Tuple[str, str], List[float]] = defaultdict(lambda: [0] * (len(BUCKETS) + 2))
+        self._tokens = {"prompt": 0, "completion": 0}
+        self._turns = 0
+        self._errors = 0
+        atexit.register(self.write_metrics)
+
+    def handler(self, **attrs: Any) -> "TraceCallbackHandler":
+        """每轮新建一个 handler；attrs（如 session_id）写入 trace 根节点。"""
+        return TraceCallbackHandler(self, attrs)
+
+    def _observe(self, span: Dict[str, Any]) -> None:
+        h = self._hist[(span["kind"], span["name"])]
+        d = span["duration_s"]
+        for i, b in enumerate(BUCKETS):
+            if d <= b:
+                h[i] += 1
+        h[-2] += 1
+        h[-1] += d
+        self._tokens["prompt"] += span.get("prompt_tokens") or 0
+        self._tokens["completion"] += span.get("completion_tokens") or 0
+        self._errors += 1 if span.get("error") else 0
+
+    def observe(self, kind: str, name: str, duration_s: float) -> None:
+        """记录不对应 span 的耗时（如 streaming.py 的首 token 时延），下次写出时计入指标文件。"""
+        with self._lock:
+            self._observe({"kind": kind, "name": name, "duration_s": duration_s})
+            self._dirty = True
+
+    def export(self, trace: Dict[str, Any], spans: List[Dict[str, Any]]) -> None:
+        line = json.dumps(trace, ensure_ascii=False, default=str)
+        with self._lock:
+            self._turns += 1
+            for s in spans:
+                self._observe(s)
+            self.trace_path.parent.mkdir(parents=True, exist_ok=True)
+            with self.trace_path.open("a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self._dirty = True
+            due = time.monotonic() - self._last_write >= self.metrics_interval_s
+        if due:
+            self.write_metrics()
+
+    def write_metrics(self) -> None:
+        """有新数据时写出指标文件：同目录下唯一命名的临时文件写完后原子替换，读方不会看到写了一半的文件。"""
+        with self._write_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                text = self._metrics_text_locked()
+                self._dirty = False
+                self._last_write = time.monotonic()
+            self.metrics_path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                "w", encoding="utf-8", dir=self.metrics_path.parent, prefix=self.metrics_path.name + ".",
+                suffix=".tmp", delete=False,
+            ) as f:
+                try:
+                    f.write(text)
+                except BaseException:
+                    f.close()
+                    os.unlink(f.name)
+                    raise
+            os.replace(f.name, self.metrics_path)
+
+    def metrics_text(self) -> str:
+        with self._lock:
+            return self._metrics_text_locked()
+
+    def _metrics_text_locked(self) -> str:
+        out = [
+            "# HELP qa_agent_turns_total 已完成追踪的轮次数",
+            "# TYPE qa_agent_turns_total counter",
+            f"qa_agent_turns_total {self._turns}",
+            "# HELP qa_agent_span_errors_total 以异常结束的 span 数",
+            "# TYPE qa_agent_span_errors_total counter",
+            f"qa_agent_span_errors_total {self._errors}",
+            "# HELP qa_agent_llm_tokens_total LLM token 数",
+            "# TYPE qa_agent_llm_tokens_total counter",
+        ]
+        for direction, n in self._tokens.items():
+            out.append(f'qa_agent_llm_tokens_total{{direction="{direction}"}} {n}')
+        out += [
+            "# HELP qa_agent_span_seconds 各步骤耗时",
+            "# TYPE qa_agent_span_seconds histogram",
+        ]
+        for (kind, name), h in sorted(self._hist.items()):
+            labels = f'kind="{kind}",name="{_escape(name)}"'
+            for i, b in enumerate(BUCKETS):
+                out.append(f'qa_agent_span_seconds_bucket{{{labels},le="{b}"}} {h[i]}')
+            out.append(f'qa_agent_span_seconds_bucket{{{labels},le="+Inf"}} {h[-2]}')
+            out.append(f"qa_agent_span_seconds_sum{{{labels}}} {h[-1]:.6f}")
+            out.append(f"qa_agent_span_seconds_count{{{labels}}} {h[-2]}")
+        return "\n".join(out) + "\n"
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _run_name(serialized: Optional[Dict[str, Any]], kwargs: Dict[str, Any], default: str) -> str:
+    if kwargs.get("name"):
+        return kwargs["name"]
+    if serialized:
+        if serialized.get("name"):
+            return serialized["name"]
+        if serialized.get("id"):
+            return serialized["id"][-1]
+    return default
+
+
+def _token_usage(response) -> Tuple[Optional[int], Optional[int]]:
+    """兼容 usage_metadata（新版）、llm_output.token_usage 与 Ollama 的 prompt_eval_count/eval_count。"""
+    prompt = completion = None
+    for gens in getattr(response, "generations", None) or []:
+        for g in gens:
+            usage = getattr(getattr(g, "message", None), "usage_metadata", None)
+            if usage:
+                prompt = (prompt or 0) + usage.get("input_tokens", 0)
+                completion = (completion or 0) + usage.get("output_tokens", 0)
+                continue
+            info = getattr(g, "generation_info", None) or {}
+            if "prompt_eval_count" in info or "eval_count" in info:
+                prompt = (prompt or 0) + info.get("prompt_eval_count", 0)
+                completion = (completion or 0) + info.get("eval_count", 0)
+    if prompt is None:
+        usage = (getattr(response, "llm_output", None) or {}).get("token_usage") or {}
+        if usage:
+            prompt, completion = usage.get("prompt_tokens"), usage.get("completion_tokens")
+    return prompt, completion
+
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    """一轮对话一个实例：收集 span，根 run 结束时交给 Tracer 导出。"""
+
+    run_inline = True  # 异步链路中也在调用方上下文内同步执行，ContextVar 才能正确传递
+
+    def __init__(self, tracer: Tracer, attrs: Dict[str, Any]):
+        self.tracer = tracer
+        self.attrs = attrs
+        self.trace_id = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._spans: Dict[str, Dict[str, Any]] = {}
+        self._alias: Dict[str, Optional[str]] = {}  # 被跳过的 run → 最近的有效祖先
+        self._prev_active: Dict[str, Any] = {}
+        self._root: Optional[str] = None
+
+    # -------------------- span 基础操作 --------------------
+    def _parent(self, parent_run_id) -> Optional[str]:
+        if parent_run_id is None:
+            return None
+        pid = str(parent_run_id)
+        if pid in self._alias:
+            return self._alias[pid]
+        return pid if pid in self._spans else None
+
+    def _start(self, run_id, parent_run_id, kind: str, name: str, **attrs: Any) -> None:
+        rid = str(run_id)
+        with self._lock:
+            parent = self._parent(parent_run_id)
+            if kind == "chain" and name.startswith(_SKIP_PREFIXES) and parent is not None:
+                self._alias[rid] = parent
+                return
+            self._spans[rid] = {
+                "span_id": rid,
+                "parent_id": parent,
+                "kind": kind,
+                "name": name,
+                "start": time.time(),
+                "_t0": time.perf_counter(),
+                **attrs,
+            }
+            if parent is None and self._root is None:
+                self._root = rid
+        self._prev_active[rid] = _active.set((self, rid))
+
+    def _end(self, run_id, error: Optional[BaseException] = None, **attrs: Any) -> None:
+        rid = str(run_id)
+        with self._lock:
+            if rid in self._alias:
+                self._alias.pop(rid)
+                return
+            span = self._spans.get(rid)
+            if span is None:
+                return
+            span["duration_s"] = time.perf_counter() - span.pop("_t0")
+            if error is not None:
+                span["error"] = f"{type(error).__name__}: {error}"
+            span.update(attrs)
+            is_root = rid == self._root
+        token = self._prev_active.pop(rid, None)
+        if token is not None:
+            try:
+                _active.reset(token)
+            except ValueError:  # 在另一个上下文中结束（线程池），直接忽略
+                pass
+        if is_root:
+            self._flush()
+
+    def add_span(self, parent_id: str, kind: str, name: str, start: float, duration_s: float, **attrs) -> None:
+        with self._lock:
+            sid = uuid.uuid4().hex
+            self._spans[sid] = {
+                "span_id": sid, "parent_id": parent_id, "kind": kind, "name": name,
+                "start": start, "duration_s": duration_s, **attrs,
+            }
+
+    def _flush(self) -> None:
+        with self._lock:
+            spans = [s for s in self._spans.values() if "duration_s" in s]
+            root = self._spans.get(self._root)
+        by_parent: Dict[Optional[str], List[Dict[str, Any]]] = defaultdict(list)
+        for s in spans:
+            by_parent[s["parent_id"]].append(s)
+
+        def tree(s: Dict[str, Any]) -> Dict[str, Any]:
+            node = {k: v for k, v in s.items() if k not in ("span_id", "parent_id")}
+            kids = sorted(by_parent.get(s["span_id"], []), key=lambda c: c["start"])
+            if kids:
+                node["children"] = [tree(c) for c in kids]
+            return node
+
+        trace = {
+            "trace_id": self.trace_id,
+            **self.attrs,
+            "duration_s": root["duration_s"] if root else None,
+            "root": tree(root) if root else None,
+        }
+        self.tracer.export(trace, spans)
+
+    # -------------------- LangChain 回调 --------------------
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, "chain", _run_name(serialized, kwargs, "chain"))
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        chars = sum(len(str(m.content)) for batch in messages for m in batch)
+        self._start(run_id, parent_run_id, "llm", _run_name(serialized, kwargs, "chat_model"), prompt_chars=chars)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        chars = sum(len(p) for p in prompts)
+        self._start(run_id, parent_run_id, "llm", _run_name(serialized, kwargs, "llm"), prompt_chars=chars)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        prompt, completion = _token_usage(response)
+        self._end(run_id, prompt_tokens=prompt, completion_tokens=completion)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, "tool", _run_name(serialized, kwargs, "tool"))
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, "retriever", _run_name(serialized, kwargs, "retriever"))
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id, documents=len(documents))
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+
+@contextmanager
+def traced(kind: str, name: str, **attrs: Any) -> Iterator[Dict[str, Any]]:
+    """
+    给非 LangChain 回调覆盖的步骤记 span；当前没有活动 trace 时什么都不做。
+    yield 出 attrs：块内可以补充只有执行完才知道的属性（如装配前后的 token 数）。
+    """
+    active = _active.get()
+    if active is None:
+        yield attrs
+        return
+    handler, parent_id = active
+    start, t0 = time.time(), time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        handler.add_span(parent_id, kind, name, start, time.perf_counter() - t0, **attrs)
+
+
+_TRACER: Optional[Tracer] = None
+_TRACER_LOCK = threading.Lock()
+
+
+def get_tracer() -> Optional[Tracer]:
+    """QA_AGENT_TRACE 未设置时返回 None（调用方不挂回调，零开销）。"""
+    global _TRACER
+    path = os.getenv(TRACE_ENV)
+    if not path:
+        return None
+    with _TRACER_LOCK:
+        if _TRACER is None:
+            _TRACER = Tracer(Path(path))
+        return _TRACER
+
+
+def trace_config(tracer: Optional[Tracer], **attrs: Any) -> Dict[str, Any]:
+    """生成 invoke/ainvoke 的 config；tracer 为 None 时返回空 dict。"""
+    return {"callbacks": [tracer.handler(**attrs)]} if tracer is not None else {}
@@ -1,10 +1,35 @@
 from prompt import SYSTEM_INSTRUCTION, QA_TEMPLATE;
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_core.documents import Document
+from embed_cache import CachedEmbeddings, EmbeddingCache
+from embed_batcher import BatchedQueryEmbeddings
+from embed_server import EMBED_SERVER_ENV, RemoteEmbeddings
+from tools.rag_docqa.hybrid import BM25Index
+from tools.rag_docqa.scenarios import ScenarioIndex
+from ann_index import (
+    FULL_VECTORS_FILE,
+    SPEC_FILE,
+    IndexSpec,
+    create_index,
+    load_spec,
+    open_full_vectors,
+    rescore,
+    resolve_spec,
+    set_search_params,
+    train,
+    write_full_vectors,
+)
+from startup import phase
+import functools
+import os
 import subprocess
+import hashlib
 import json
 
 
@@ -12,12 +37,27 @@ LOCAL_BGE_DIR = Path(r"D:\huggingface\models\bge-m3")  # ← 改成你的真实
 UTTER_JSONL = Path("Resources/utterances/utterances_chunks.jsonl")
 FLOWS_JSONL = Path("Resources/flows/flows_chunks.jsonl")
 FAISS_DIR = Path("faiss_store")
+MANIFEST_FILE = FAISS_DIR / "manifest.json"
+EMBED_CACHE_DIR = FAISS_DIR / "embed_cache"
+BM25_FILE = FAISS_DIR / "bm25.json"
+SCENARIO_INDEX_FILE = FAISS_DIR / "scenario_index.json"
+# ANN 索引类型与参数（由 Resources/embedding.py --index/--bench 写出；不存在时为 flat）
+ANN_SPEC_FILE = FAISS_DIR / SPEC_FILE
+# 压缩存储 + rerank 时的 float32 原始向量（行号 = 索引位置）
+FULL_VECTORS_PATH = FAISS_DIR / FULL_VECTORS_FILE
+MANIFEST_VERSION = 1
+NORMALIZE_EMBEDDINGS = True
+# 并发查询的微批合并：一次最多合并多少条、最多等待多久
+QUERY_BATCH_MAX = 32
+QUERY_BATCH_WAIT_MS = 5.0
 
 
+@functools.lru_cache(maxsize=None)
 def _ensure_ollama_model_local(tag: str = "llama3.1"):
-    """可选：若本地无该模型则直接报错（而不是尝试下载）"""
+    """可选：若本地无该模型则直接报错（而不是尝试下载）；检查通过后进程内不再重复执行 `ollama list`"""
     try:
-        out = subprocess.check_output(["ollama", "list"], text=True)
+        with phase(f"ollama list（{tag}）"):
+            out = subprocess.check_output(["ollama", "list"], text=True)
         if tag not in out:
             raise RuntimeError(
                 f"Ollama 本地不存在模型 {tag}。请在可联网环境先执行：ollama pull {tag}。"
@@ -41,21 +81,260 @@ def load_jsonl(path: Path, namespace: str) -> List[Document]:
             meta = obj.get("metadata", {}) or {}
             meta["namespace"] = namespace
             if text:
-                docs.append(Document(page_content=text, metadata=meta))
+                # chunk id 由分块脚本按内容确定性生成，作为 docstore id 用于增量同步
+                docs.append(Document(page_content=text, metadata=meta, id=obj.get("id")))
     return docs
 
-def load_vectorstore(rebuild: bool = False) -> FAISS:
-    embed = HuggingFaceEmbeddings(
+def _sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _file_stat(path: Path) -> Dict[str, int]:
+    st = path.stat()
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _embed_config() -> str:
+    return f"v{MANIFEST_VERSION}|{LOCAL_BGE_DIR}|{NORMALIZE_EMBEDDINGS}"
+
+
+def store_fingerprint() -> str:
+    """
+    向量库内容指纹：源 JSONL 的 sha256 + 模型标识 + 归一化设置。
+    任一变化都意味着已落盘的索引不再可信，需要重建。
+    """
+    h = hashlib.sha256()
+    h.update(_embed_config().encode("utf-8"))
+    for p in (UTTER_JSONL, FLOWS_JSONL):
+        digest = _sha256_file(p) if p.exists() else "missing"
+        h.update(f"|{p.as_posix()}={digest}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def _read_manifest() -> Dict[str, Any]:
+    if not MANIFEST_FILE.exists():
+        return {}
+    try:
+        return json.loads(MANIFEST_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(fingerprint: str, *files: Path, index: Optional[Dict[str, Any]] = None) -> None:
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "fingerprint": fingerprint,
+        "embed_config": _embed_config(),
+        "model": str(LOCAL_BGE_DIR),
+        "normalize_embeddings": NORMALIZE_EMBEDDINGS,
+        "sources": [p.as_posix() for p in (UTTER_JSONL, FLOWS_JSONL)],
+        # requested：index_spec.json 中的配置；resolved：按语料规模补齐参数（或降级）后实际构建的索引
+        "index": index or {},
+        # 记录索引文件的 size/mtime：Resources/embedding.py 也会写 index.faiss，被覆盖后需要识别出来
+        "files": {f.name: _file_stat(f) for f in files},
+    }
+    tmp = MANIFEST_FILE.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp.replace(MANIFEST_FILE)
+
+
+def _index_files_intact(manifest: Dict[str, Any], *paths: Path) -> bool:
+    """manifest 记录的索引文件仍是本函数写出的那一份（未被删除或被其他脚本覆盖）。"""
+    if manifest.get("version") != MANIFEST_VERSION:
+        return False
+    files = manifest.get("files") or {}
+    for f in paths:
+        if not f.exists() or files.get(f.name) != _file_stat(f):
+            return False
+    return True
+
+
+def _sync_vectorstore(vs: FAISS, docs: List[Document]) -> Tuple[int, int, int]:
+    """
+    按 chunk id 对比已索引集合与最新 JSONL：只删除消失的向量、只嵌入新增的 chunk。
+    id 由内容派生，所以“修改”会表现为一删一增；只有 metadata 变化的 chunk 直接替换 docstore 条目，不重新嵌入。
+    返回 (新增数, 删除数, 仅更新 metadata 数)。
+    """
+    wanted = {d.id: d for d in docs}
+    indexed = set(vs.index_to_docstore_id.values())
+    removed = [i for i in indexed if i not in wanted]
+    added = [i for i in wanted if i not in indexed]
+    if removed:
+        vs.delete(removed)
+    if added:
+        vs.add_documents([wanted[i] for i in added], ids=added)
+    stale = [i for i in wanted if i in indexed and vs.docstore.search(i).metadata != wanted[i].metadata]
+    if stale:
+        vs.docstore.delete(stale)
+        vs.docstore.add({i: wanted[i] for i in stale})
+    return len(added), len(removed), len(stale)
+
+
+def _local_embeddings() -> HuggingFaceEmbeddings:
+    """在本进程加载 bge-m3（约 2GB 权重）；多进程部署时由 embed_server.py 统一持有。"""
+    return HuggingFaceEmbeddings(
         model_name=str(LOCAL_BGE_DIR),
         model_kwargs={
             "device": "cpu",  # 或 "cuda"
             # "cache_folder": str(LOCAL_BGE_DIR),  # 可选；进一步指定缓存目录
         },
-        encode_kwargs={"normalize_embeddings": True},
+        encode_kwargs={"normalize_embeddings": NORMALIZE_EMBEDDINGS},
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _shared_embeddings(address: Optional[str], model_id: str, normalize: bool) -> BatchedQueryEmbeddings:
+    """
+    同一配置在进程内只建一份：模型只加载一次，微批线程只有一个，
+    重复调用 load_vectorstore（压测 / 重新加载）不会每次多起一个线程，各向量库的查询也共用同一个批窗口。
+    """
+    if address:
+        # 共享 embedding 进程：本进程只需 FAISS 索引 + 瘦客户端，不加载模型
+        base = RemoteEmbeddings(address, model_id=model_id, normalize=normalize)
+    else:
+        base = _local_embeddings()
+    return BatchedQueryEmbeddings(base, max_batch=QUERY_BATCH_MAX, max_wait_ms=QUERY_BATCH_WAIT_MS)
+
+
+def _get_embeddings() -> BatchedQueryEmbeddings:
+    return _shared_embeddings(os.getenv(EMBED_SERVER_ENV) or None, str(LOCAL_BGE_DIR), NORMALIZE_EMBEDDINGS)
+
+
+class RescoringFAISS(FAISS):
+    """
+    压缩索引（fp16 / int8 / PQ）的近似分数有误差：先取 k·rerank 个候选，
+    再用磁盘上的 float32 原始向量（memmap）精确重排。rerank 未开启时与 FAISS 完全一致。
+    chunk id → 索引位置的映射按需建立；增删向量（id 映射变化）后作废，下次查询时重建。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rerank = 1
+        self.full_vectors: Optional[np.ndarray] = None
+        self._positions: Optional[Dict[str, int]] = None
+
+    def add_texts(self, *args, **kwargs) -> List[str]:
+        self._positions = None
+        return super().add_texts(*args, **kwargs)
+
+    def add_embeddings(self, *args, **kwargs) -> List[str]:
+        self._positions = None
+        return super().add_embeddings(*args, **kwargs)
+
+    def delete(self, *args, **kwargs) -> Optional[bool]:
+        self._positions = None
+        return super().delete(*args, **kwargs)
+
+    def merge_from(self, target: FAISS) -> None:
+        self._positions = None
+        super().merge_from(target)
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, fetch_k=20, **kwargs):
+        if self.full_vectors is None or self.rerank <= 1:
+            return super().similarity_search_with_score_by_vector(embedding, k, filter, fetch_k, **kwargs)
+        n = k * self.rerank
+        cands = super().similarity_search_with_score_by_vector(embedding, n, filter, max(fetch_k, n), **kwargs)
+        positions = self._positions
+        if positions is None:
+            positions = self._positions = {doc_id: pos for pos, doc_id in self.index_to_docstore_id.items()}
+        by_pos = {positions[d.id]: d for d, _ in cands}
+        return [(by_pos[p], s) for p, s in rescore(self.full_vectors, embedding, list(by_pos), k)]
+
+
+def _distance_strategy(spec: IndexSpec) -> DistanceStrategy:
+    # 未压缩的 flat 沿用 LangChain 默认的 IndexFlatL2；其余索引按内积构建（向量已归一化，两者排序一致）
+    if spec.kind == "flat" and not spec.storage:
+        return DistanceStrategy.EUCLIDEAN_DISTANCE
+    return DistanceStrategy.MAX_INNER_PRODUCT
+
+
+def _uses_rerank(spec: IndexSpec) -> bool:
+    return (spec.rerank or 0) > 1
+
+
+def _sidecar_files(spec: IndexSpec) -> List[Path]:
+    """与 index.faiss / index.pkl 一起落盘、一起校验的文件。"""
+    return [BM25_FILE, SCENARIO_INDEX_FILE] + ([FULL_VECTORS_PATH] if _uses_rerank(spec) else [])
+
+
+def _attach_full_vectors(vs: RescoringFAISS, spec: IndexSpec, embedding=None) -> None:
+    """
+    开启 rerank 时挂上原始向量；传入 embedding 时先按索引位置顺序重写文件
+    （全部命中 embed_cache，不会重新过模型）。
+    """
+    if not _uses_rerank(spec):
+        return
+    if embedding is not None:
+        texts = [vs.docstore.search(vs.index_to_docstore_id[i]).page_content for i in range(len(vs.index_to_docstore_id))]
+        write_full_vectors(FULL_VECTORS_PATH, np.asarray(embedding.embed_documents(texts), dtype="float32"))
+    vs.rerank = spec.rerank
+    vs.full_vectors = open_full_vectors(FULL_VECTORS_PATH, vs.index.d)
+
+
+def _build_vectorstore(docs: List[Document], embedding, requested: IndexSpec) -> Tuple[RescoringFAISS, IndexSpec]:
+    """全量构建；非 flat / 压缩索引先用全部向量训练（IVF 聚类中心 / 量化范围 / PQ 码本）。"""
+    texts = [d.page_content for d in docs]
+    vecs = np.asarray(embedding.embed_documents(texts), dtype="float32")
+    spec = resolve_spec(requested, len(docs), vecs.shape[1])
+    pairs = list(zip(texts, vecs.tolist()))
+    metadatas = [d.metadata for d in docs]
+    ids = [d.id for d in docs]
+    if spec.kind == "flat" and not spec.storage:
+        return RescoringFAISS.from_embeddings(pairs, embedding, metadatas=metadatas, ids=ids), spec
+
+    index = create_index(spec, vecs.shape[1])
+    train(index, vecs)
+    vs = RescoringFAISS(
+        embedding_function=embedding,
+        index=index,
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+        distance_strategy=_distance_strategy(spec),
     )
+    vs.add_embeddings(pairs, metadatas=metadatas, ids=ids)
+    print(f"向量库索引：{spec.describe()}")
+    return vs, spec
+
+
+def load_vectorstore(rebuild: bool = False) -> FAISS:
+    """
+    加载向量库：manifest 指纹与源文件一致时直接从 faiss_store/ 读取，
+    否则（或 rebuild=True）重新嵌入并落盘，同时刷新 manifest。
+    索引类型取自 index_spec.json；加载时按 manifest 记录的实际索引设置 nprobe / efSearch。
+    """
+    with phase("加载 embedding 模型"):
+        embed = _get_embeddings()
     index_file = FAISS_DIR / "index.faiss"
     store_file = FAISS_DIR / "index.pkl"
 
+    fingerprint = store_fingerprint()
+    manifest = _read_manifest()
+    requested = load_spec(ANN_SPEC_FILE)
+    built = manifest.get("index") or {}
+    built_requested = IndexSpec.from_dict(built.get("requested"))
+    resolved = IndexSpec.from_dict(built.get("resolved"))
+    # 只改查询参数不需要重建；以 index_spec.json 中最新的值为准
+    resolved.nprobe = requested.nprobe or resolved.nprobe
+    resolved.ef_search = requested.ef_search or resolved.ef_search
+
+    intact = not rebuild and _index_files_intact(manifest, index_file, store_file)
+    intact = intact and built_requested.build_key() == requested.build_key()
+    sidecars_ok = _index_files_intact(manifest, *_sidecar_files(resolved))
+    if intact and manifest.get("fingerprint") == fingerprint and sidecars_ok:
+        # index.pkl 由本函数自己写出，反序列化是可信的
+        with phase("读取 FAISS 索引"):
+            vs = RescoringFAISS.load_local(
+                str(FAISS_DIR), embed, allow_dangerous_deserialization=True,
+                distance_strategy=_distance_strategy(resolved),
+            )
+        set_search_params(vs.index, resolved)
+        _attach_full_vectors(vs, resolved)
+        return vs
+
     docs: List[Document] = []
     docs += load_jsonl(UTTER_JSONL, namespace="utterances")
     docs += load_jsonl(FLOWS_JSONL, namespace="flows")
@@ -63,6 +342,72 @@ def load_vectorstore(rebuild: bool = False) -> FAISS:
     if not docs:
         raise FileNotFoundError("未读取到任何文档，请检查 JSONL 路径与内容是否存在 text/metadata 字段。")
 
-    vs = FAISS.from_documents(docs, embed)
+    # 只有新增/修改过的 chunk 才会真正过模型
+    cached = CachedEmbeddings(embed, EmbeddingCache(str(LOCAL_BGE_DIR), NORMALIZE_EMBEDDINGS, EMBED_CACHE_DIR))
+    vs = None
+    if intact and manifest.get("embed_config") == _embed_config():
+        vs = RescoringFAISS.load_local(
+            str(FAISS_DIR), cached, allow_dangerous_deserialization=True,
+            distance_strategy=_distance_strategy(resolved),
+        )
+        # LangChain 的 FAISS.delete 假定删除后位置连续前移，只有 flat 满足；其余索引有删除时全量重建
+        wanted = {d.id for d in docs}
+        if resolved.kind != "flat" and any(i not in wanted for i in vs.index_to_docstore_id.values()):
+            vs = None
+    if vs is not None:
+        # 仅文档变化：在已有索引上增量 upsert/delete
+        added, removed, updated = _sync_vectorstore(vs, docs)
+        print(f"向量库增量同步：新增 {added}，删除 {removed}，更新元数据 {updated}")
+    else:
+        vs, resolved = _build_vectorstore(docs, cached, requested)
+    set_search_params(vs.index, resolved)
+    _attach_full_vectors(vs, resolved, embedding=cached)
     vs.save_local(str(FAISS_DIR))
-    return vs
\ No newline at end of file
+    # 词法索引与向量库同批 chunk、同时落盘（混合检索用，见 tools/rag_docqa/hybrid.py）
+    BM25Index.build(docs).save(BM25_FILE)
+    ScenarioIndex.build(docs).save(SCENARIO_INDEX_FILE)
+    _write_manifest(
+        fingerprint, index_file, store_file, *_sidecar_files(resolved),
+        index={"requested": requested.to_dict(), "resolved": resolved.to_dict()},
+    )
+    return vs
+
+
+def _docstore_documents(vs: FAISS) -> List[Document]:
+    docs = [vs.docstore.search(i) for i in vs.index_to_docstore_id.values()]
+    return [d for d in docs if isinstance(d, Document)]
+
+
+def load_lexical_index(vs: FAISS) -> BM25Index:
+    """
+    读取与向量库配套的 BM25 索引；chunk id 集合对不上（缺文件、被单独重建过）时
+    从向量库的 docstore 现场重建并落盘。
+    """
+    indexed = list(vs.index_to_docstore_id.values())
+    if BM25_FILE.exists():
+        try:
+            lexical = BM25Index.load(BM25_FILE)
+            if set(lexical.doc_ids) == set(indexed):
+                return lexical
+        except (OSError, ValueError, KeyError):
+            pass
+    lexical = BM25Index.build(_docstore_documents(vs))
+    if FAISS_DIR.exists():
+        lexical.save(BM25_FILE)
+    return lexical
+
+
+def load_scenario_index(vs: FAISS) -> ScenarioIndex:
+    """读取场景 id 直查索引；引用了向量库中不存在的 chunk 时从 docstore 重建。"""
+    indexed = set(vs.index_to_docstore_id.values())
+    if SCENARIO_INDEX_FILE.exists():
+        try:
+            scenarios = ScenarioIndex.load(SCENARIO_INDEX_FILE)
+            if scenarios.scenarios and set(scenarios.chunk_ids()) <= indexed:
+                return scenarios
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+    scenarios = ScenarioIndex.build(_docstore_documents(vs))
+    if FAISS_DIR.exists():
+        scenarios.save(SCENARIO_INDEX_FILE)
+    return scenarios